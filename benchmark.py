@@ -0,0 +1,182 @@
+"""
+Benchmark del pipeline de optimización con instancias sintéticas reproducibles.
+
+Uso:
+    python benchmark.py --tamanos 50 500 2000 --tipos clustered uniform --salida bench.json
+    python benchmark.py --tamanos 50 --importaciones   # añade el tiempo de import en frío por módulo
+
+Cada etapa (matriz de distancias, asignación, cada solver TSP y run_optimization completo) se
+cronometra y se guarda junto con métricas de calidad, para comparar velocidad y calidad entre commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+from solver import (ASIGNACIONES, ASIGNACIONES_SIN_MATRIZ, SOLVERS_TSP, assign_stops_to_vehicles, create_distance_matrix, run_optimization,
+                    solve_tsp_with_fallback)
+
+DEPOT_POR_DEFECTO = (4.4389, -76.1951)
+KM_POR_GRADO = 111.32
+# Nodos máximos del TSP cronometrado por solver; SA de python-tsp es muy lento en rutas grandes.
+MAX_NODOS_TSP = {'sa': 150, 'local_search': 1500, 'anytime': 1500, 'anytime_insercion': 1500, 'nn': 3000, 'portfolio': 500}
+MAX_PARADAS_MATRIZ_DENSA = 6000  # 6000² float64 ≈ 290 MB
+MODULOS_APP = ('solver', 'io_parser', 'visualization', 'cli')
+DEPENDENCIAS_PESADAS = ('python_tsp', 'folium', 'streamlit_folium', 'streamlit', 'openpyxl', 'odf', 'scipy')
+
+def generate_instance(n_paradas, tipo='clustered', seed=0, depot=DEPOT_POR_DEFECTO, radio_km=15.0,
+                      n_clusters=8, demanda_max=10):
+    """
+    Genera paradas alrededor del depósito: 'uniform' en un disco de `radio_km`, o 'clustered' en
+    `n_clusters` grupos gaussianos. Devuelve un DataFrame con el depósito en la primera fila.
+    """
+    rng = np.random.default_rng(seed)
+    if tipo == 'uniform':
+        radio = radio_km * np.sqrt(rng.uniform(0, 1, n_paradas))
+        angulo = rng.uniform(0, 2 * np.pi, n_paradas)
+        dx, dy = radio * np.cos(angulo), radio * np.sin(angulo)
+    elif tipo == 'clustered':
+        centros = rng.uniform(-radio_km, radio_km, size=(n_clusters, 2)) * 0.8
+        grupo = rng.integers(0, n_clusters, n_paradas)
+        dispersion = rng.uniform(0.5, 2.5, n_clusters)[grupo]
+        dx = centros[grupo, 0] + rng.normal(0, 1, n_paradas) * dispersion
+        dy = centros[grupo, 1] + rng.normal(0, 1, n_paradas) * dispersion
+    else:
+        raise ValueError(f"Tipo de instancia desconocido: {tipo}")
+    lat = depot[0] + dy / KM_POR_GRADO
+    lon = depot[1] + dx / (KM_POR_GRADO * np.cos(np.radians(depot[0])))
+    clientes = pd.DataFrame({
+        'id': [f"P{i:05d}" for i in range(n_paradas)], 'lat': lat, 'lon': lon,
+        'demanda': rng.integers(1, demanda_max + 1, n_paradas), 'is_depot': False
+    })
+    depot_df = pd.DataFrame([{'id': 'depot', 'lat': depot[0], 'lon': depot[1], 'demanda': 0, 'is_depot': True}])
+    return pd.concat([depot_df, clientes], ignore_index=True)
+
+def generate_fleet(paradas_df, n_vehiculos=10, holgura=1.1):
+    """Flota homogénea con capacidad suficiente para toda la demanda más una holgura."""
+    capacidad = int(np.ceil(paradas_df['demanda'].sum() * holgura / n_vehiculos))
+    return pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': capacidad} for i in range(n_vehiculos)])
+
+def _cronometrar(funcion, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcion(*args, **kwargs)
+    return resultado, time.perf_counter() - inicio
+
+def _metricas_resultados(resultados, paradas_df):
+    asignadas = sum(len(r['secuencia_paradas_ids']) for r in resultados)
+    return {
+        "rutas": len(resultados),
+        "distancia_total_km": float(sum(r['distancia_km'] for r in resultados)),
+        "paradas_sin_asignar": int((~paradas_df['is_depot']).sum()) - asignadas,
+        "utilizacion_media_pct": float(np.mean([r['capacidad_utilizada_pct'] for r in resultados])) if resultados else 0.0,
+    }
+
+def benchmark_instance(n_paradas, tipo='clustered', seed=0, n_vehiculos=10, solvers=SOLVERS_TSP,
+                       metodo_run='local_search', max_paradas_densa=MAX_PARADAS_MATRIZ_DENSA):
+    """Cronometra cada etapa del pipeline sobre una instancia sintética y devuelve un dict serializable."""
+    paradas_df = generate_instance(n_paradas, tipo, seed)
+    vehiculos_df = generate_fleet(paradas_df, n_vehiculos)
+    depot = paradas_df.iloc[0].to_dict()
+    etapas = {}
+    denso = len(paradas_df) <= max_paradas_densa
+
+    if denso:
+        (dist_matrix, _), t = _cronometrar(create_distance_matrix, paradas_df)
+        etapas["create_distance_matrix"] = {"tiempo_s": t, "bytes": int(dist_matrix.nbytes)}
+    for asignacion in ASIGNACIONES:
+        asignaciones, t = _cronometrar(assign_stops_to_vehicles, paradas_df.iloc[1:], vehiculos_df, depot, asignacion)
+        # La greedy conserva el nombre de etapa original para poder comparar con informes anteriores.
+        etapa = "assign_stops_to_vehicles" if asignacion == 'greedy' else f"assign_stops_to_vehicles_{asignacion}"
+        etapas[etapa] = {"tiempo_s": t, "paradas_asignadas": sum(map(len, asignaciones.values()))}
+
+    for metodo in solvers:
+        nodos = min(len(paradas_df), MAX_NODOS_TSP.get(metodo, len(paradas_df)))
+        if not denso and nodos > max_paradas_densa:
+            continue
+        sub_matrix, _ = create_distance_matrix(paradas_df.iloc[:nodos])
+        (ruta, distancia), t = _cronometrar(solve_tsp_with_fallback, sub_matrix, seed, metodo)
+        etapas[f"tsp_{metodo}"] = {"tiempo_s": t, "nodos": nodos, "distancia_km": float(distancia)}
+
+    if denso:
+        resultados, t = _cronometrar(run_optimization, paradas_df, vehiculos_df, 1.0, 60.0, seed, metodo_tsp=metodo_run)
+        etapas[f"run_optimization_{metodo_run}"] = {"tiempo_s": t, **_metricas_resultados(resultados, paradas_df)}
+    # El barrido, los ahorros y el modo disperso no construyen la matriz global: se miden en todos los tamaños.
+    for asignacion in ASIGNACIONES_SIN_MATRIZ:
+        resultados, t = _cronometrar(run_optimization, paradas_df, vehiculos_df, 1.0, 60.0, seed, metodo_tsp=metodo_run,
+                                     asignacion=asignacion)
+        etapas[f"run_optimization_{asignacion}_{metodo_run}"] = {"tiempo_s": t, **_metricas_resultados(resultados, paradas_df)}
+    resultados, t = _cronometrar(run_optimization, paradas_df, vehiculos_df, 1.0, 60.0, seed, metodo_tsp=metodo_run,
+                                 disperso=True)
+    etapas[f"run_optimization_disperso_{metodo_run}"] = {"tiempo_s": t, **_metricas_resultados(resultados, paradas_df)}
+    return {"n_paradas": n_paradas, "tipo": tipo, "seed": seed, "n_vehiculos": n_vehiculos, "etapas": etapas}
+
+def medir_importaciones(modulos=MODULOS_APP, repeticiones=3):
+    """
+    Tiempo de import en frío de cada módulo (mínimo de varias ejecuciones en un intérprete nuevo)
+    y qué dependencias pesadas deja cargadas.
+    """
+    codigo = ("import sys, time, json; t = time.perf_counter(); import {modulo}; t = time.perf_counter() - t; "
+              "print(json.dumps([t, [m for m in {pesadas!r} if m in sys.modules]]))")
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    informe = {}
+    for modulo in modulos:
+        tiempos = []
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, "-c", codigo.format(modulo=modulo, pesadas=DEPENDENCIAS_PESADAS)],
+                                    cwd=raiz, capture_output=True, text=True, check=True)
+            tiempo, cargadas = json.loads(salida.stdout.strip().splitlines()[-1])
+            tiempos.append(tiempo)
+        informe[modulo] = {"tiempo_s": min(tiempos), "dependencias_pesadas": cargadas}
+    return informe
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(tamanos, tipos=('clustered', 'uniform'), seed=0, importaciones=False, **kwargs):
+    informe = {
+        "meta": {
+            "commit": _commit_actual(), "fecha": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+        },
+        "resultados": [benchmark_instance(n, tipo, seed, **kwargs) for n in tamanos for tipo in tipos],
+    }
+    if importaciones:
+        informe["importaciones"] = medir_importaciones()
+    return informe
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de optimización de rutas.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[50, 200, 1000, 5000, 20000])
+    parser.add_argument("--tipos", nargs="+", default=["clustered", "uniform"], choices=["clustered", "uniform"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vehiculos", type=int, default=10)
+    parser.add_argument("--solvers", nargs="+", default=list(SOLVERS_TSP), choices=SOLVERS_TSP)
+    parser.add_argument("--metodo-run", default="local_search", choices=SOLVERS_TSP)
+    parser.add_argument("--max-densa", type=int, default=MAX_PARADAS_MATRIZ_DENSA,
+                        help="Tamaño máximo para etapas que necesitan la matriz densa completa.")
+    parser.add_argument("--importaciones", action="store_true", help="Mide también el tiempo de import en frío.")
+    parser.add_argument("--salida", default="bench_output.json")
+    args = parser.parse_args(argv)
+    informe = run_benchmark(args.tamanos, args.tipos, args.seed, importaciones=args.importaciones,
+                            n_vehiculos=args.vehiculos, solvers=args.solvers, metodo_run=args.metodo_run,
+                            max_paradas_densa=args.max_densa)
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    for fila in informe["resultados"]:
+        resumen = ", ".join(f"{etapa}={datos['tiempo_s']:.3f}s" for etapa, datos in fila["etapas"].items())
+        print(f"{fila['tipo']:>9} n={fila['n_paradas']:>6}: {resumen}")
+    for modulo, datos in informe.get("importaciones", {}).items():
+        print(f"import {modulo}: {datos['tiempo_s']:.3f}s, dependencias pesadas: {', '.join(datos['dependencias_pesadas']) or '-'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections.abc import Mapping
+import numpy as np
+
+VERSION_CACHE = 1  # Cambiarla invalida todas las entradas guardadas con formatos anteriores
+MAX_BYTES_POR_DEFECTO = 256 * 1024 * 1024
+
+def _hash_columna(h, nombre, valores):
+    # `valores` es una Serie o un array (p. ej. una columna de `stops.StopTable`); ambos dan el mismo hash.
+    h.update(str(nombre).encode())
+    if valores.dtype.kind in 'biuf':
+        h.update(np.ascontiguousarray(np.asarray(valores, dtype=np.float64)).tobytes())
+    else:
+        h.update(json.dumps([str(v) for v in valores]).encode())
+
+def _a_json(valor):
+    # Las rutas pueden ser Mappings que no son dict (ver `solver.RouteResult`).
+    return dict(valor) if isinstance(valor, Mapping) else str(valor)
+
+def coordinates_fingerprint(paradas_df):
+    """Hash de las coordenadas (en orden); identifica una matriz de distancias."""
+    h = hashlib.sha256(f"coords-v{VERSION_CACHE}".encode())
+    for col in ('lat', 'lon'):
+        _hash_columna(h, col, paradas_df[col])
+    return h.hexdigest()
+
+def instance_fingerprint(paradas_df, vehiculos_df, **parametros):
+    """
+    Hash SHA-256 del contenido de una instancia: ids, coordenadas, demandas, depósito, flota y
+    cualquier parámetro que influya en el resultado (costos, velocidad, semilla, solver...).
+    """
+    h = hashlib.sha256(f"instancia-v{VERSION_CACHE}".encode())
+    for col in ('id', 'lat', 'lon', 'demanda', 'is_depot'):
+        _hash_columna(h, col, paradas_df[col])
+    for col in ('id', 'capacidad'):
+        _hash_columna(h, col, vehiculos_df[col])
+    h.update(json.dumps(parametros, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def results_fingerprint(resultados, paradas_df=None):
+    """Hash de una lista de resultados (y opcionalmente de las paradas que referencian), para memoizar su presentación."""
+    h = hashlib.sha256(f"resultados-v{VERSION_CACHE}".encode())
+    h.update(json.dumps(resultados, sort_keys=True, default=_a_json).encode())
+    if paradas_df is not None:
+        for col in ('id', 'lat', 'lon', 'demanda', 'is_depot'):
+            _hash_columna(h, col, paradas_df[col])
+    return h.hexdigest()
+
+class SolutionCache:
+    """
+    Caché en disco direccionada por contenido para resultados de `run_optimization` y,
+    opcionalmente, matrices de distancias. Cuando el tamaño total supera `max_bytes` se borran
+    las entradas usadas hace más tiempo (la fecha de modificación se renueva en cada acierto).
+    """
+
+    def __init__(self, directorio, max_bytes=MAX_BYTES_POR_DEFECTO, guardar_matrices=False):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.guardar_matrices = guardar_matrices
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave, extension):
+        return os.path.join(self.directorio, f"{clave}{extension}")
+
+    def _tocar(self, ruta):
+        try:
+            os.utime(ruta)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _escribir(self, ruta, escribir):
+        # Escritura atómica: otra sesión nunca ve un archivo a medio escribir.
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                escribir(f)
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.unlink(temporal)
+            raise
+        self._expulsar()
+
+    def get(self, clave):
+        ruta = self._ruta(clave, '.pkl')
+        if not self._tocar(ruta):
+            return None
+        with open(ruta, 'rb') as f:
+            return pickle.load(f)
+
+    def put(self, clave, valor):
+        self._escribir(self._ruta(clave, '.pkl'), lambda f: pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get_matrix(self, clave):
+        """Matriz guardada (mapeada en memoria, solo lectura) o None."""
+        ruta = self._ruta(clave, '.npy')
+        if not self.guardar_matrices or not self._tocar(ruta):
+            return None
+        return np.load(ruta, mmap_mode='r')
+
+    def put_matrix(self, clave, matriz):
+        if self.guardar_matrices:
+            self._escribir(self._ruta(clave, '.npy'), lambda f: np.save(f, matriz))
+
+    def _expulsar(self):
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith(('.pkl', '.npy')):
+                try:
+                    stat = os.stat(os.path.join(self.directorio, nombre))
+                except FileNotFoundError:
+                    continue
+                entradas.append((stat.st_mtime, stat.st_size, nombre))
+        total = sum(tamano for _, tamano, _ in entradas)
+        for _, tamano, nombre in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                pass
+            total -= tamano
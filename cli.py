@@ -0,0 +1,162 @@
+"""
+Modo batch sin Streamlit: optimiza uno o varios archivos de paradas y emite un resultado por archivo.
+
+Uso:
+    python cli.py --depot-lat 4.4389 --depot-lon -76.1951 datos/ "entregas_*.csv" --procesos 4 > rutas.jsonl
+
+Cada entrada puede ser un archivo, un directorio (se leen todos los .csv/.xlsx/.ods que contenga) o un
+patrón glob. Los resultados se escriben en cuanto termina cada archivo, en JSONL (uno por archivo)
+o CSV (una fila por ruta).
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+from io_parser import save_results, safe_read_table
+from solver import ASIGNACIONES, SOLVERS_TSP, run_optimization
+from utils import Telemetria, get_logger
+
+EXTENSIONES_SOPORTADAS = ('.csv', '.xlsx', '.xls', '.ods', '.parquet', '.arrow', '.feather', '.npz')
+COLUMNAS_CSV = ['archivo', 'estado', 'error', 'vehiculo_id', 'paradas', 'total_demanda', 'capacidad_utilizada_pct',
+                'distancia_km', 'costo_estimado', 'tiempo_estimado_h', 'solver', 'fallback', 'secuencia_paradas_ids']
+
+def expandir_entradas(entradas):
+    """Archivos a procesar a partir de rutas, directorios y patrones glob, sin duplicados y en orden."""
+    archivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            candidatos = sorted(os.path.join(entrada, nombre) for nombre in os.listdir(entrada))
+        elif os.path.isfile(entrada):
+            candidatos = [entrada]
+        else:
+            candidatos = sorted(glob.glob(entrada))
+        archivos.extend(c for c in candidatos if os.path.isfile(c) and c.lower().endswith(EXTENSIONES_SOPORTADAS))
+    return list(dict.fromkeys(archivos))
+
+def optimizar_archivo(ruta, depot_lat, depot_lon, n_vehiculos, capacidad, costo_km, velocidad_kmh, random_seed, metodo_tsp,
+                      directorio_npz=None, asignacion='greedy', proveedor=None, disperso=False):
+    """
+    Lee y optimiza un archivo. Nunca lanza: los errores se devuelven en el propio resultado.
+    Con `directorio_npz` guarda además las rutas en `<directorio>/<archivo>.npz` (ver `io_parser.load_results`).
+    El resultado incluye la telemetría de la ejecución (tiempos por fase, contadores y solver de cada ruta).
+    """
+    telemetria = Telemetria()
+    try:
+        with telemetria.fase('lectura'):
+            paradas_df = safe_read_table(ruta)
+        depot_df = pd.DataFrame([{'id': 'depot', 'lat': depot_lat, 'lon': depot_lon, 'demanda': 0, 'is_depot': True}])
+        full_paradas_df = pd.concat([depot_df, paradas_df], ignore_index=True)
+        vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': capacidad} for i in range(n_vehiculos)])
+        resultados = run_optimization(full_paradas_df, vehiculos_df, costo_km, velocidad_kmh, random_seed,
+                                      metodo_tsp=metodo_tsp, asignacion=asignacion, proveedor=proveedor,
+                                      telemetria=telemetria, disperso=disperso)
+        if directorio_npz:
+            with telemetria.fase('exportacion'):
+                save_results(os.path.join(directorio_npz, os.path.splitext(os.path.basename(ruta))[0] + '.npz'), resultados)
+        asignadas = sum(len(r['secuencia_paradas_ids']) for r in resultados)
+        return {"archivo": ruta, "estado": "ok", "paradas": len(paradas_df), "paradas_sin_asignar": len(paradas_df) - asignadas,
+                "distancia_total_km": sum(r['distancia_km'] for r in resultados),
+                "costo_total": sum(r['costo_estimado'] for r in resultados), "rutas": resultados,
+                "telemetria": telemetria.como_dict()}
+    except Exception as e:
+        get_logger().warning(f"Error procesando {ruta}: {e}")
+        return {"archivo": ruta, "estado": "error", "error": str(e), "rutas": [], "telemetria": telemetria.como_dict()}
+
+def _a_json(valor):
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, Mapping):
+        return dict(valor)
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+class EscritorResultados:
+    """Escribe cada resultado en cuanto llega, en JSONL o en CSV (una fila por ruta)."""
+
+    def __init__(self, salida, formato):
+        self.salida, self.formato = salida, formato
+        if formato == 'csv':
+            self.csv = csv.DictWriter(salida, fieldnames=COLUMNAS_CSV)
+            self.csv.writeheader()
+
+    def escribir(self, resultado):
+        if self.formato == 'jsonl':
+            self.salida.write(json.dumps(resultado, default=_a_json, ensure_ascii=False) + "\n")
+        elif not resultado['rutas']:
+            self.csv.writerow({'archivo': resultado['archivo'], 'estado': resultado['estado'], 'error': resultado.get('error', '')})
+        else:
+            for ruta in resultado['rutas']:
+                fila = {k: ruta[k] for k in COLUMNAS_CSV if k in ruta}
+                fila.update(archivo=resultado['archivo'], estado=resultado['estado'], error='',
+                            paradas=len(ruta['secuencia_paradas_ids']),
+                            secuencia_paradas_ids="|".join(str(pid) for pid in ruta['secuencia_paradas_ids']))
+                self.csv.writerow(fila)
+        self.salida.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimización de rutas en modo batch (sin Streamlit).")
+    parser.add_argument("entradas", nargs="+", help="Archivos, directorios o patrones glob con paradas.")
+    parser.add_argument("--depot-lat", type=float, required=True)
+    parser.add_argument("--depot-lon", type=float, required=True)
+    parser.add_argument("--vehiculos", type=int, default=3)
+    parser.add_argument("--capacidad", type=float, default=50)
+    parser.add_argument("--costo-km", type=float, default=1500.0)
+    parser.add_argument("--velocidad", type=float, default=60.0, help="Velocidad media en km/h.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--solver", default="local_search", choices=SOLVERS_TSP)
+    parser.add_argument("--asignacion", default="greedy", choices=ASIGNACIONES,
+                        help="'sweep' reparte por barrido angular y 'savings' por ahorros de Clarke-Wright; ambos resuelven "
+                             "las rutas grandes por bloques (instancias muy grandes).")
+    parser.add_argument("--disperso", action="store_true",
+                        help="Sin matrices n×n: rutas sobre un grafo de k vecinos con distancias bajo demanda (memoria lineal).")
+    parser.add_argument("--red-nodos", help="CSV/Parquet de nodos (id, lat, lon) de una red vial local.")
+    parser.add_argument("--red-aristas", help="CSV/Parquet de aristas (origen, destino[, distancia_km]) de la red vial.")
+    parser.add_argument("--red-cache", help="Archivo SQLite donde guardar las distancias por carretera ya calculadas.")
+    parser.add_argument("--procesos", type=int, default=1, help="Archivos a procesar en paralelo.")
+    parser.add_argument("--formato", default="jsonl", choices=["jsonl", "csv"])
+    parser.add_argument("--salida", default="-", help="Archivo de salida ('-' para stdout).")
+    parser.add_argument("--npz-dir", help="Directorio donde guardar también las rutas de cada archivo en formato .npz.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S')
+    get_logger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    archivos = expandir_entradas(args.entradas)
+    if not archivos:
+        parser.error("No se encontraron archivos de paradas en las entradas indicadas.")
+    if bool(args.red_nodos) != bool(args.red_aristas):
+        parser.error("--red-nodos y --red-aristas se usan juntos.")
+    proveedor = None
+    if args.red_nodos:
+        from distances import RoadNetworkProvider
+        proveedor = RoadNetworkProvider(args.red_nodos, args.red_aristas, cache_path=args.red_cache)
+    parametros = (args.depot_lat, args.depot_lon, args.vehiculos, args.capacidad, args.costo_km, args.velocidad,
+                  args.seed, args.solver, args.npz_dir, args.asignacion, proveedor, args.disperso)
+    if args.npz_dir:
+        os.makedirs(args.npz_dir, exist_ok=True)
+
+    salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8", newline="")
+    try:
+        escritor = EscritorResultados(salida, args.formato)
+        if args.procesos > 1 and len(archivos) > 1:
+            with ProcessPoolExecutor(max_workers=min(args.procesos, len(archivos))) as executor:
+                futuros = [executor.submit(optimizar_archivo, ruta, *parametros) for ruta in archivos]
+                for futuro in as_completed(futuros):
+                    escritor.escribir(futuro.result())
+        else:
+            for ruta in archivos:
+                escritor.escribir(optimizar_archivo(ruta, *parametros))
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
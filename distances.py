@@ -0,0 +1,328 @@
+import hashlib
+import heapq
+import importlib.util
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from spatial_index import SpatialIndex, to_unit_xyz
+from utils import get_logger
+
+logger = get_logger()
+
+R_TIERRA_KM = 6371  # Radio de la Tierra en km
+BLOQUE_FILAS = 1024  # Filas por bloque en el cálculo de la matriz
+VECINOS_GRAFO = 10  # Vecinos por punto en CandidateGraph (como local_search.VECINOS_CANDIDATOS)
+MAX_PARES_CACHE = 1 << 18  # Pares de distancia que CandidateGraph conserva (LRU) con proveedores costosos
+MAX_CELDAS_DIJKSTRA = 1 << 22  # Distancias (orígenes x nodos) por llamada a scipy en RoadNetworkProvider
+MAX_PARAMETROS_SQL = 900  # Destinos por consulta a la caché SQLite (el límite de SQLite es 999)
+
+def haversine_matrix(lats1, lons1, lats2=None, lons2=None, dtype=np.float64, block_size=BLOQUE_FILAS):
+    """
+    Calcula todas las distancias haversine (km) entre dos conjuntos de puntos con broadcasting.
+    Si no se da el segundo conjunto se calcula la matriz cuadrada del primero consigo mismo.
+    Las filas se procesan en bloques de `block_size` para acotar la memoria temporal;
+    `block_size=None` calcula todo en un solo bloque.
+    """
+    lat1, lon1 = np.radians(np.asarray(lats1, dtype=np.float64)), np.radians(np.asarray(lons1, dtype=np.float64))
+    if lats2 is None:
+        lat2, lon2 = lat1, lon1
+    else:
+        lat2, lon2 = np.radians(np.asarray(lats2, dtype=np.float64)), np.radians(np.asarray(lons2, dtype=np.float64))
+    n, m = len(lat1), len(lat2)
+    dist_matrix = np.empty((n, m), dtype=dtype)
+    paso = block_size or max(n, 1)
+    cos_lat2 = np.cos(lat2)
+    for inicio in range(0, n, paso):
+        fin = min(inicio + paso, n)
+        dlat = lat2[None, :] - lat1[inicio:fin, None]
+        dlon = lon2[None, :] - lon1[inicio:fin, None]
+        a = np.sin(dlat / 2)**2 + np.cos(lat1[inicio:fin, None]) * cos_lat2[None, :] * np.sin(dlon / 2)**2
+        dist_matrix[inicio:fin] = R_TIERRA_KM * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return dist_matrix
+
+def haversine_pairs(lat1, lon1, lat2, lon2):
+    """Distancias haversine (km) elemento a elemento entre dos arrays de puntos."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return R_TIERRA_KM * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+class HaversineProvider:
+    """
+    Proveedor de distancias por defecto: línea recta sobre la esfera.
+    Un proveedor expone `clave` (identifica sus distancias en las cachés), `matrix` y `pairs`, y
+    `simetrica` si d(a, b) == d(b, a) siempre (la búsqueda local lo supone si falta).
+    """
+    clave = 'haversine'
+    simetrica = True
+
+    def matrix(self, lats1, lons1, lats2=None, lons2=None, dtype=np.float64):
+        return haversine_matrix(lats1, lons1, lats2, lons2, dtype=dtype)
+
+    def pairs(self, lat1, lon1, lat2, lon2):
+        return haversine_pairs(lat1, lon1, lat2, lon2)
+
+HAVERSINE = HaversineProvider()
+
+class CandidateGraph:
+    """
+    Grafo de candidatos: los `k` vecinos más cercanos en línea recta de cada punto, hallados con el
+    índice espacial, sin ninguna matriz n×n. `grafo[i, j]` (índices o arrays que se combinan con
+    broadcasting, como en una matriz) devuelve la distancia exacta del proveedor calculada bajo demanda
+    desde las coordenadas, así que puede sustituir a la matriz en `local_search` y la memoria crece
+    linealmente con los puntos. Con un proveedor distinto del haversine los pares ya calculados se
+    guardan en un LRU de `max_cache` pares; los haversine se recalculan, que es más barato que buscarlos
+    (con la cuerda entre puntos de la esfera unitaria, sin trigonometría por par salvo un arcsin).
+    """
+
+    def __init__(self, lats, lons, k=VECINOS_GRAFO, proveedor=None, max_cache=MAX_PARES_CACHE):
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lons = np.ascontiguousarray(lons, dtype=np.float64)
+        self.proveedor = proveedor or HAVERSINE
+        self.simetrica = getattr(self.proveedor, 'simetrica', True)
+        self.max_cache = max_cache
+        self._cache = None if self.proveedor is HAVERSINE else OrderedDict()
+        self._xyz = tuple(np.ascontiguousarray(c) for c in to_unit_xyz(self.lats, self.lons).T)
+        # Celdas de unos `k` puntos: casi todos los vecinos se resuelven con la celda y sus adyacentes.
+        self.vecinos = SpatialIndex(self.lats, self.lons, puntos_por_celda=max(k, 4)).vecinos_cercanos(k)
+
+    def __len__(self):
+        return len(self.lats)
+
+    @property
+    def shape(self):
+        return (len(self), len(self))
+
+    @property
+    def nbytes(self):
+        return 5 * self.lats.nbytes + self.vecinos.nbytes + 24 * len(self._cache or ())
+
+    def __getitem__(self, clave):
+        filas, columnas = np.broadcast_arrays(*(np.asarray(c, dtype=np.intp) for c in clave))
+        if self._cache is None:
+            cuerda = np.sqrt(sum((c[filas] - c[columnas]) ** 2 for c in self._xyz))
+            return 2 * R_TIERRA_KM * np.arcsin(np.minimum(cuerda / 2, 1.0))
+        return self._pares_en_cache(filas.ravel(), columnas.ravel()).reshape(filas.shape)
+
+    def desde(self, origen, destinos):
+        return self[origen, destinos]
+
+    def _pares_en_cache(self, filas, columnas):
+        n = len(self)
+        unicas, inversa = np.unique(filas * n + columnas, return_inverse=True)
+        valores = np.empty(len(unicas))
+        faltan = []
+        for i, par in enumerate(unicas.tolist()):
+            valor = self._cache.get(par)
+            if valor is None:
+                faltan.append(i)
+            else:
+                valores[i] = valor
+                self._cache.move_to_end(par)
+        if faltan:
+            origen, destino = np.divmod(unicas[faltan], n)
+            valores[faltan] = self.proveedor.pairs(self.lats[origen], self.lons[origen], self.lats[destino], self.lons[destino])
+            self._cache.update(zip(unicas[faltan].tolist(), valores[faltan].tolist()))
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+        return valores[inversa]
+
+def _leer_tabla(ruta):
+    return pd.read_parquet(ruta) if str(ruta).lower().endswith('.parquet') else pd.read_csv(ruta)
+
+def _huella_archivos(*rutas):
+    h = hashlib.sha256()
+    for ruta in rutas:
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+    return h.hexdigest()[:16]
+
+class RoadNetworkProvider:
+    """
+    Distancias por una red vial local, sin servicios externos. `nodos` es un CSV/Parquet con
+    'id', 'lat', 'lon' y `aristas` otro con 'origen', 'destino' y opcionalmente 'distancia_km'
+    (si falta se usa la haversine entre sus nodos). Las aristas son de doble sentido salvo
+    `dirigido=True`; en ese caso la matriz puede no ser simétrica.
+    Cada punto se engancha a su nodo más cercano (el tramo hasta él se suma en línea recta) y
+    los caminos mínimos se calculan con un Dijkstra por nodo origen distinto: con scipy si está
+    instalado, si no con heapq. Con `cache_path` las distancias nodo a nodo pedidas (no todas las
+    del origen) se guardan en SQLite y no se vuelven a calcular. Los pares sin camino usan la
+    distancia haversine.
+    """
+
+    def __init__(self, nodos, aristas, cache_path=None, dirigido=False):
+        nodos_df, aristas_df = _leer_tabla(nodos), _leer_tabla(aristas)
+        self.clave = f"red-{_huella_archivos(nodos, aristas)}-{'dirigida' if dirigido else 'doble'}"
+        self.simetrica = not dirigido
+        nodos_df = nodos_df.drop_duplicates('id')
+        self.nodos_ids = nodos_df['id'].astype(str).to_numpy()
+        self.lats = nodos_df['lat'].to_numpy(dtype=np.float64)
+        self.lons = nodos_df['lon'].to_numpy(dtype=np.float64)
+        posicion = pd.Series(np.arange(len(self.nodos_ids)), index=self.nodos_ids)
+        origen = posicion.reindex(aristas_df['origen'].astype(str)).to_numpy()
+        destino = posicion.reindex(aristas_df['destino'].astype(str)).to_numpy()
+        validas = ~(np.isnan(origen) | np.isnan(destino))
+        if not validas.all():
+            logger.warning(f"Se ignoran {int((~validas).sum())} aristas con nodos desconocidos.")
+        origen, destino = origen[validas].astype(np.intp), destino[validas].astype(np.intp)
+        if 'distancia_km' in aristas_df.columns:
+            pesos = aristas_df['distancia_km'].to_numpy(dtype=np.float64)[validas]
+        else:
+            pesos = haversine_pairs(self.lats[origen], self.lons[origen], self.lats[destino], self.lons[destino])
+        if not dirigido:
+            origen, destino, pesos = np.r_[origen, destino], np.r_[destino, origen], np.r_[pesos, pesos]
+        # Aristas repetidas: solo cuenta la más corta.
+        aristas = pd.DataFrame({'o': origen, 'd': destino, 'w': pesos}).groupby(['o', 'd'], sort=True)['w'].min()
+        self._origenes = aristas.index.get_level_values('o').to_numpy()
+        self._destinos = aristas.index.get_level_values('d').to_numpy()
+        self._pesos = aristas.to_numpy()
+        self._inicios = np.searchsorted(self._origenes, np.arange(len(self.nodos_ids) + 1))
+        self._indice = SpatialIndex(self.lats, self.lons)
+        self.cache_path = cache_path
+        self._conexion = None
+        self._listas = None
+        self._avisado_sin_camino = False  # El aviso de pares sin camino se da una vez por proveedor
+
+    def __getstate__(self):
+        # La conexión SQLite no se puede enviar a otro proceso; se reabre allí al primer uso.
+        estado = self.__dict__.copy()
+        estado['_conexion'], estado['_listas'] = None, None
+        return estado
+
+    def snap(self, lats, lons):
+        """Nodo más cercano a cada punto y la distancia (km) en línea recta hasta él."""
+        lats, lons = np.atleast_1d(np.asarray(lats, dtype=np.float64)), np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        nodos = np.array([self._indice.consultar(lat, lon)[0] for lat, lon in zip(lats, lons)], dtype=np.intp)
+        return nodos, haversine_pairs(lats, lons, self.lats[nodos], self.lons[nodos])
+
+    def _bd(self):
+        if self._conexion is None and self.cache_path:
+            self._conexion = sqlite3.connect(self.cache_path)
+            self._conexion.execute("CREATE TABLE IF NOT EXISTS distancias (red TEXT, origen TEXT, destino TEXT, km REAL, "
+                                   "PRIMARY KEY (red, origen, destino)) WITHOUT ROWID")
+        return self._conexion
+
+    def _dijkstra(self, origen, objetivos):
+        """Distancias desde `origen` a cada nodo de `objetivos`; se detiene al fijar todos."""
+        if self._listas is None:
+            # El bucle es Python puro: las listas se indexan mucho más rápido que los arrays.
+            self._listas = (self._inicios.tolist(), self._destinos.tolist(), self._pesos.tolist())
+        inicios, destinos, pesos = self._listas
+        dist, fijados = {origen: 0.0}, set()
+        pendientes = set(objetivos.tolist())
+        monticulo = [(0.0, origen)]
+        while monticulo and pendientes:
+            d, u = heapq.heappop(monticulo)
+            if u in fijados:
+                continue
+            fijados.add(u)
+            pendientes.discard(u)
+            for e in range(inicios[u], inicios[u + 1]):
+                v, nueva = destinos[e], d + pesos[e]
+                if nueva < dist.get(v, np.inf):
+                    dist[v] = nueva
+                    heapq.heappush(monticulo, (nueva, v))
+        return np.array([dist.get(t, np.inf) for t in objetivos.tolist()])
+
+    def _calcular(self, origenes, objetivos):
+        """Distancias desde cada nodo de `origenes` a los nodos de su array en `objetivos`."""
+        if importlib.util.find_spec('scipy') is not None:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+            n = len(self.nodos_ids)
+            grafo = csr_matrix((self._pesos, (self._origenes, self._destinos)), shape=(n, n))
+            por_llamada = max(1, MAX_CELDAS_DIJKSTRA // max(n, 1))
+            resultado = []
+            for inicio in range(0, len(origenes), por_llamada):
+                filas = dijkstra(grafo, directed=True, indices=origenes[inicio:inicio + por_llamada])
+                resultado += [fila[destinos] for fila, destinos in zip(filas, objetivos[inicio:inicio + por_llamada])]
+            return resultado
+        return [self._dijkstra(int(o), destinos) for o, destinos in zip(origenes, objetivos)]
+
+    def _leer_cache(self, bd, origen, destinos):
+        """Distancias guardadas desde `origen` a `destinos` (ids de nodo); NaN las que faltan."""
+        km = np.full(len(destinos), np.nan)
+        posicion = {destino: i for i, destino in enumerate(destinos)}
+        for inicio in range(0, len(destinos), MAX_PARAMETROS_SQL):
+            parte = destinos[inicio:inicio + MAX_PARAMETROS_SQL]
+            consulta = (f"SELECT destino, km FROM distancias WHERE red = ? AND origen = ? "
+                        f"AND destino IN ({', '.join('?' * len(parte))})")
+            for destino, valor in bd.execute(consulta, (self.clave, origen, *parte)):
+                km[posicion[destino]] = valor
+        return km
+
+    def _distancias_pares(self, origenes, destinos):
+        """
+        Camino mínimo (km) de cada par de nodos `origenes[i]` -> `destinos[i]`. Los pares se
+        agrupan por origen: un Dijkstra por origen distinto, y en la caché solo se leen y guardan
+        los pares pedidos.
+        """
+        n = len(self.nodos_ids)
+        unicos, inversa = np.unique(np.asarray(origenes, dtype=np.int64) * n + destinos, return_inverse=True)
+        nodo_o, nodo_d = np.divmod(unicos, n)
+        km = np.full(len(unicos), np.nan)
+        # `unicos` va ordenado por origen: cada grupo son los pares de un mismo origen.
+        grupos = np.split(np.arange(len(unicos)), np.flatnonzero(np.diff(nodo_o)) + 1) if len(unicos) else []
+        bd = self._bd()
+        if bd is not None:
+            for grupo in grupos:
+                km[grupo] = self._leer_cache(bd, self.nodos_ids[nodo_o[grupo[0]]], self.nodos_ids[nodo_d[grupo]].tolist())
+        faltan = [grupo[np.isnan(km[grupo])] for grupo in grupos]
+        faltan = [grupo for grupo in faltan if len(grupo)]
+        if faltan:
+            calculados = self._calcular(np.array([nodo_o[g[0]] for g in faltan]), [nodo_d[g] for g in faltan])
+            for grupo, valores in zip(faltan, calculados):
+                km[grupo] = valores
+            if bd is not None:
+                pares = np.concatenate(faltan)
+                filas = zip([self.clave] * len(pares), self.nodos_ids[nodo_o[pares]].tolist(),
+                            self.nodos_ids[nodo_d[pares]].tolist(), km[pares].tolist())
+                with bd:
+                    bd.executemany("INSERT OR REPLACE INTO distancias VALUES (?, ?, ?, ?)", filas)
+        return km[inversa]
+
+    def _distancias_nodos(self, origenes, destinos):
+        """Matriz de caminos mínimos (km) entre nodos; cada origen distinto se resuelve una sola vez."""
+        unicos_o, inv_o = np.unique(origenes, return_inverse=True)
+        unicos_d, inv_d = np.unique(destinos, return_inverse=True)
+        bloque = self._distancias_pares(np.repeat(unicos_o, len(unicos_d)), np.tile(unicos_d, len(unicos_o)))
+        return bloque.reshape(len(unicos_o), len(unicos_d))[np.ix_(inv_o, inv_d)]
+
+    def _por_red(self, lats1, lons1, lats2, lons2, por_red):
+        sin_camino = ~np.isfinite(por_red)
+        if sin_camino.any():
+            if not self._avisado_sin_camino:
+                self._avisado_sin_camino = True
+                logger.warning(f"{int(sin_camino.sum())} pares sin camino en la red; se usa la distancia en línea recta (solo se avisa una vez).")
+            por_red = np.where(sin_camino, haversine_pairs(lats1, lons1, lats2, lons2), por_red)
+        return por_red
+
+    def matrix(self, lats1, lons1, lats2=None, lons2=None, dtype=np.float64):
+        cuadrada = lats2 is None
+        if cuadrada:
+            lats2, lons2 = lats1, lons1
+        lats1, lons1 = np.asarray(lats1, dtype=np.float64), np.asarray(lons1, dtype=np.float64)
+        lats2, lons2 = np.asarray(lats2, dtype=np.float64), np.asarray(lons2, dtype=np.float64)
+        nodos1, acceso1 = self.snap(lats1, lons1)
+        nodos2, acceso2 = (nodos1, acceso1) if cuadrada else self.snap(lats2, lons2)
+        por_red = acceso1[:, None] + self._distancias_nodos(nodos1, nodos2) + acceso2[None, :]
+        matriz = self._por_red(lats1[:, None], lons1[:, None], lats2[None, :], lons2[None, :], por_red)
+        if cuadrada:
+            np.fill_diagonal(matriz, 0.0)
+        return matriz.astype(dtype, copy=False)
+
+    def pairs(self, lat1, lon1, lat2, lon2):
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2)))
+        forma = lat1.shape
+        lat1, lon1, lat2, lon2 = (x.ravel() for x in (lat1, lon1, lat2, lon2))
+        nodos1, acceso1 = self.snap(lat1, lon1)
+        nodos2, acceso2 = self.snap(lat2, lon2)
+        por_red = acceso1 + self._distancias_pares(nodos1, nodos2) + acceso2
+        mismo_punto = (lat1 == lat2) & (lon1 == lon2)
+        return np.where(mismo_punto, 0.0, self._por_red(lat1, lon1, lat2, lon2, por_red)).reshape(forma)
+
+    def close(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
@@ -1,25 +1,163 @@
+import codecs
+import csv
+import importlib.util
+import json
+import os
+import numpy as np
 import pandas as pd
-import streamlit as st
 from io import BytesIO
+from utils import get_logger
 
-def safe_read_table(_uploaded_file):
+logger = get_logger()
+
+MUESTRA_BYTES = 64 * 1024  # Bytes iniciales usados para detectar codificación y separador
+SEPARADORES_CSV = ',;\t|'
+COLUMN_MAP = {
+    "pasajeros": "demanda",
+    "nombre": "id"
+}
+COLUMNAS_NUMERICAS = ['lat', 'lon', 'demanda']
+EXTENSIONES_COLUMNARES = ('.parquet', '.arrow', '.feather', '.npz')
+# Campos escalares de cada ruta de `run_optimization`, en el orden en que se guardan.
+CAMPOS_RESULTADO = ['vehiculo_id', 'capacidad', 'total_demanda', 'capacidad_utilizada_pct', 'distancia_km',
+                    'costo_estimado', 'tiempo_estimado_h']
+CAMPOS_SOLVER = ['solver', 'fallback']  # Opcionales: los resultados antiguos no los tienen
+
+def _normalizar_columna(col):
+    col = str(col).lower().strip().replace(' ', '_')
+    return COLUMN_MAP.get(col, col)
+
+def _detectar_formato_csv(muestra):
+    """
+    Detecta codificación, separador y cabecera a partir de los primeros bytes del archivo, en lugar
+    de dejar que el parser de Python lo deduzca recorriendo el archivo completo.
+    """
+    try:
+        # final=False tolera un carácter multibyte cortado al final de la muestra.
+        texto = codecs.getincrementaldecoder('utf-8-sig')().decode(muestra, final=False)
+        encoding = 'utf-8-sig' if muestra.startswith(codecs.BOM_UTF8) else 'utf-8'
+    except UnicodeDecodeError:
+        texto, encoding = muestra.decode('latin-1'), 'latin-1'
+    lineas = texto.splitlines()
+    if len(muestra) == MUESTRA_BYTES and len(lineas) > 1:
+        lineas = lineas[:-1]  # La última línea de la muestra puede estar incompleta
+    lineas = [l for l in lineas if l.strip()][:50]
+    if not lineas:
+        raise ValueError("El archivo está vacío o no se pudo leer.")
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lineas), delimiters=SEPARADORES_CSV).delimiter
+    except csv.Error:
+        sep = max(SEPARADORES_CSV, key=lineas[0].count)
+    cabecera = next(csv.reader([lineas[0]], delimiter=sep))
+    return encoding, sep, cabecera
+
+def _motor_csv():
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+def _rebobinar(fuente):
+    if hasattr(fuente, 'seek'):
+        fuente.seek(0)
+
+def _columnas_binarias(df):
+    """Si alguna columna quedó como bytes: ante bytes no UTF-8 pyarrow no falla, deja la columna sin decodificar."""
+    if df is None:
+        return False
+    for columna in df.columns:
+        valores = df[columna].dropna() if df[columna].dtype == object else ()
+        if len(valores) and isinstance(valores.iloc[0], bytes):
+            return True
+    return False
+
+def _leer_csv(fuente, muestra, chunksize=None, on_warning=None):
+    encoding, sep, cabecera = _detectar_formato_csv(muestra)
+    originales = {_normalizar_columna(c): c for c in cabecera}
+    try:
+        df = _leer_csv_con(fuente, encoding, sep, originales, chunksize, on_warning)
+        if not _columnas_binarias(df):
+            return df
+    except UnicodeDecodeError:
+        pass
+    # Hay bytes no UTF-8 después de la muestra: se relee el archivo completo como latin-1.
+    logger.info("El CSV no es UTF-8 más allá de la muestra inicial; se relee como latin-1.")
+    _rebobinar(fuente)
+    return _leer_csv_con(fuente, 'latin-1', sep, originales, chunksize, on_warning)
+
+def _leer_csv_con(fuente, encoding, sep, originales, chunksize, on_warning):
+    if chunksize:
+        return _leer_csv_por_bloques(fuente, encoding, sep, originales, chunksize, on_warning)
+    # Solo las coordenadas se fuerzan a float; la demanda entera se conserva como entero.
+    dtype = {originales[c]: 'float64' for c in ('lat', 'lon') if c in originales}
+    try:
+        return pd.read_csv(fuente, sep=sep, encoding=encoding, engine=_motor_csv(), dtype=dtype)
+    except UnicodeDecodeError:
+        raise
+    except ValueError:
+        # Algún valor no numérico: se relee sin tipos para que la validación dé un error claro.
+        _rebobinar(fuente)
+        return pd.read_csv(fuente, sep=sep, encoding=encoding, engine='c')
+
+def _leer_csv_por_bloques(fuente, encoding, sep, originales, chunksize, on_warning):
+    """Lee el CSV por bloques con solo las columnas necesarias, descartando filas inválidas al vuelo."""
+    usecols = [originales[c] for c in ['id'] + COLUMNAS_NUMERICAS if c in originales]
+    bloques, descartadas = [], 0
+    for bloque in pd.read_csv(fuente, sep=sep, encoding=encoding, engine='c', usecols=usecols, chunksize=chunksize):
+        bloque.columns = [_normalizar_columna(c) for c in bloque.columns]
+        for col in COLUMNAS_NUMERICAS:
+            if col in bloque.columns:
+                bloque[col] = pd.to_numeric(bloque[col], errors='coerce')
+        validas = bloque[[c for c in COLUMNAS_NUMERICAS if c in bloque.columns]].notna().all(axis=1)
+        descartadas += int((~validas).sum())
+        bloques.append(bloque[validas])
+    if descartadas:
+        aviso = f"Se descartaron {descartadas} filas con 'lat', 'lon' o 'demanda' vacíos o no numéricos."
+        logger.warning(aviso)
+        if on_warning:
+            on_warning(aviso)
+    return pd.concat(bloques, ignore_index=True) if bloques else None
+
+def _leer_npz(fuente):
+    """Tabla de paradas guardada con `np.savez`: un array por columna, con el nombre de la columna."""
+    with np.load(fuente, allow_pickle=False) as datos:
+        return pd.DataFrame({nombre: datos[nombre] for nombre in datos.files})
+
+def _leer_columnar(fuente, file_name):
+    if file_name.endswith('.parquet'):
+        return pd.read_parquet(fuente)
+    if file_name.endswith('.npz'):
+        return _leer_npz(fuente)
+    return pd.read_feather(fuente)
+
+def safe_read_table(_uploaded_file, on_warning=None, chunksize=None):
     """
     Lee un archivo de forma inteligente, detectando separador y mapeando columnas.
     MODIFICADO: Ya no requiere ni genera la columna 'is_depot'.
     El depósito se añade manualmente en la app principal.
+    Los avisos se registran en el logger y, si se pasa, también se envían a `on_warning`
+    (la app usa `st.warning`).
+    Acepta un archivo subido (con `.name` y `.getvalue()`) o una ruta en disco. En los CSV la
+    codificación y el separador se detectan con una muestra inicial y se parsea con el motor
+    rápido (pyarrow o C); con `chunksize` se lee por bloques descartando filas inválidas.
+    También lee tablas columnares (Parquet, Arrow/Feather y NPZ con un array por columna).
     """
-    file_content = BytesIO(_uploaded_file.getvalue())
-    file_name = _uploaded_file.name.lower()
+    if hasattr(_uploaded_file, 'getvalue'):
+        file_name = _uploaded_file.name.lower()
+        datos = _uploaded_file.getvalue()
+        file_content, muestra = BytesIO(datos), datos[:MUESTRA_BYTES]
+    else:
+        file_content = os.fspath(_uploaded_file)
+        file_name = file_content.lower()
+        muestra = None
     df = None
 
-    # --- 1. Leer el archivo de forma robusta (sin cambios) ---
+    # --- 1. Leer el archivo de forma robusta ---
     try:
         if file_name.endswith('.csv'):
-            try:
-                df = pd.read_csv(file_content, sep=None, engine='python', encoding='utf-8')
-            except Exception:
-                file_content.seek(0)
-                df = pd.read_csv(file_content, sep=';', engine='python', encoding='latin-1')
+            if muestra is None:
+                with open(file_content, 'rb') as f:
+                    muestra = f.read(MUESTRA_BYTES)
+            df = _leer_csv(file_content, muestra, chunksize, on_warning)
+        elif file_name.endswith(EXTENSIONES_COLUMNARES):
+            df = _leer_columnar(file_content, file_name)
         elif file_name.endswith(('.xlsx', '.xls')):
             df = pd.read_excel(file_content, engine='openpyxl')
         elif file_name.endswith('.ods'):
@@ -32,13 +170,8 @@ def safe_read_table(_uploaded_file):
     if df is None or df.empty:
         raise ValueError("El archivo está vacío o no se pudo leer.")
 
-    # --- 2. Normalizar y Mapear Columnas (sin cambios) ---
-    df.columns = [str(col).lower().strip().replace(' ', '_') for col in df.columns]
-    column_map = {
-        "pasajeros": "demanda",
-        "nombre": "id"
-    }
-    df.rename(columns=column_map, inplace=True)
+    # --- 2. Normalizar y Mapear Columnas ---
+    df.columns = [_normalizar_columna(col) for col in df.columns]
 
     # --- 3. Validar Columnas Esenciales (sin 'is_depot') ---
     required_final_cols = ['id', 'lat', 'lon', 'demanda']
@@ -47,7 +180,10 @@ def safe_read_table(_uploaded_file):
         raise ValueError(f"Faltan columnas esenciales en el archivo: {', '.join(missing_cols)}")
 
     if 'is_depot' in df.columns:
-        st.warning("La columna 'is_depot' en el archivo será ignorada. El depósito se define en el mapa.")
+        aviso = "La columna 'is_depot' en el archivo será ignorada. El depósito se define en el mapa."
+        logger.warning(aviso)
+        if on_warning:
+            on_warning(aviso)
         df.drop(columns=['is_depot'], inplace=True)
     
     df['is_depot'] = False
@@ -66,3 +202,52 @@ def safe_read_table(_uploaded_file):
     # La validación del depósito se elimina de aquí.
     
     return df
+
+def save_distance_matrix(ruta, matriz, ids):
+    """
+    Guarda una matriz de distancias en `.npy` y sus ids (orden de filas) en `<ruta>.ids.json`,
+    para volver a cargarla mapeada en memoria sin recalcularla.
+    """
+    with open(ruta, 'wb') as f:  # Con un archivo abierto np.save no añade la extensión
+        np.save(f, np.asarray(matriz))
+    with open(f"{ruta}.ids.json", 'w', encoding='utf-8') as f:
+        json.dump([v.item() if isinstance(v, np.generic) else v for v in ids], f, ensure_ascii=False)
+
+def load_distance_matrix(ruta, mmap=True):
+    """Devuelve (matriz, ids) guardados con `save_distance_matrix`; la matriz es de solo lectura si `mmap`."""
+    matriz = np.load(ruta, mmap_mode='r' if mmap else None)
+    with open(f"{ruta}.ids.json", encoding='utf-8') as f:
+        return matriz, json.load(f)
+
+def _ids_a_array(ids):
+    ids = np.asarray(ids)
+    # Ids mixtos (texto y números) quedarían como objetos, que npz no guarda sin pickle.
+    return ids.astype(str) if ids.dtype == object else ids
+
+def save_results(ruta, resultados):
+    """
+    Guarda los resultados de `run_optimization` en un `.npz`: una columna por campo escalar y
+    todas las secuencias concatenadas con sus desplazamientos.
+    """
+    secuencias = [r['secuencia_paradas_ids'] for r in resultados]
+    columnas = {campo: np.asarray([r[campo] for r in resultados]) for campo in CAMPOS_RESULTADO}
+    columnas['vehiculo_id'] = columnas['vehiculo_id'].astype(str)
+    if resultados and all('solver' in r for r in resultados):
+        columnas['solver'] = np.asarray([r['solver'] or '' for r in resultados], dtype=str)
+        columnas['fallback'] = np.asarray([bool(r.get('fallback')) for r in resultados])
+    with open(ruta, 'wb') as f:
+        np.savez(f, **columnas,
+                 secuencias=_ids_a_array([pid for secuencia in secuencias for pid in secuencia]),
+                 desplazamientos=np.cumsum([0] + [len(s) for s in secuencias]))
+
+def load_results(ruta):
+    """Lista de resultados guardada con `save_results`, con la misma forma que `run_optimization`."""
+    with np.load(ruta, allow_pickle=False) as datos:
+        campos = CAMPOS_RESULTADO + [c for c in CAMPOS_SOLVER if c in datos.files]
+        columnas = {campo: datos[campo].tolist() for campo in campos}
+        secuencias, desplazamientos = datos['secuencias'].tolist(), datos['desplazamientos']
+    if 'solver' in columnas:
+        columnas['solver'] = [solver or None for solver in columnas['solver']]
+    return [{**{campo: columnas[campo][i] for campo in campos},
+             'secuencia_paradas_ids': secuencias[desplazamientos[i]:desplazamientos[i + 1]]}
+            for i in range(len(desplazamientos) - 1)]
@@ -0,0 +1,134 @@
+"""
+Trabajos de optimización en segundo plano.
+
+La app envía cada optimización a un `JobManager` (un pool de hilos compartido por todas las
+sesiones) y recibe un id; con él consulta el progreso, las rutas ya resueltas y el resultado, o
+cancela el trabajo. La ejecución no depende de la sesión de Streamlit: un rerun o un widget no la
+interrumpen, y el resultado sigue disponible desde otra pestaña con el mismo id.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from solver import run_optimization
+from utils import Telemetria, get_logger
+
+logger = get_logger()
+
+MAX_TRABAJOS = 20  # Trabajos terminados que se conservan; al superarlo se descartan los más antiguos
+ESTADOS_FINALES = ('completado', 'cancelado', 'error')
+
+class Trabajo:
+    """Estado de un trabajo: 'pendiente', 'en_curso', 'completado', 'cancelado' o 'error'."""
+
+    def __init__(self, parametros, descripcion=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.descripcion = descripcion
+        self.parametros = parametros
+        self.telemetria = parametros.pop('telemetria', None) or Telemetria()
+        self.cancel_event = threading.Event()
+        self.estado, self.resultados, self.error = 'pendiente', None, None
+        self.creado, self.inicio, self.fin = time.time(), None, None
+        self.progreso = {}  # vehiculo_id -> (iteracion, mejor_distancia, transcurrido_s) del solver 'anytime'
+        self._parciales = []
+        self._lock = threading.Lock()
+
+    @property
+    def terminado(self):
+        return self.estado in ESTADOS_FINALES
+
+    def _al_progresar(self, vehiculo_id, iteracion, mejor_distancia, transcurrido_s):
+        with self._lock:
+            self.progreso[vehiculo_id] = (iteracion, mejor_distancia, transcurrido_s)
+
+    def _al_terminar_ruta(self, ruta):
+        with self._lock:
+            self._parciales.append(ruta)
+
+    def parciales(self):
+        """Rutas ya resueltas, en el orden en que terminaron."""
+        with self._lock:
+            return list(self._parciales)
+
+    def resumen(self):
+        """Dict serializable con el estado actual, para mostrar en la UI o consultar desde fuera."""
+        with self._lock:
+            return {"id": self.id, "descripcion": self.descripcion, "estado": self.estado, "error": self.error,
+                    "creado": self.creado, "transcurrido_s": ((self.fin or time.time()) - self.inicio) if self.inicio else 0.0,
+                    "rutas_terminadas": len(self._parciales), "progreso": dict(self.progreso)}
+
+class JobManager:
+    """
+    Ejecuta funciones de optimización en un pool de hilos. La función recibe los parámetros del
+    trabajo más `progress_callback`, `route_callback`, `cancel_event` y `telemetria`, como
+    `solver.run_optimization` (la función por defecto).
+    """
+
+    def __init__(self, max_workers=1, max_trabajos=MAX_TRABAJOS):
+        self.max_trabajos = max_trabajos
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rout2-trabajo')
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, descripcion='', funcion=run_optimization, **parametros):
+        """Encola un trabajo y devuelve su id."""
+        trabajo = Trabajo(parametros, descripcion)
+        with self._lock:
+            self._trabajos[trabajo.id] = trabajo
+            self._purgar()
+        self._executor.submit(self._ejecutar, trabajo, funcion)
+        logger.info(f"Trabajo {trabajo.id} encolado: {descripcion}")
+        return trabajo.id
+
+    def _ejecutar(self, trabajo, funcion):
+        if trabajo.cancel_event.is_set():
+            trabajo.estado, trabajo.fin = 'cancelado', time.time()
+            return
+        trabajo.estado, trabajo.inicio = 'en_curso', time.time()
+        try:
+            resultados = funcion(**trabajo.parametros, progress_callback=trabajo._al_progresar,
+                                 route_callback=trabajo._al_terminar_ruta, cancel_event=trabajo.cancel_event,
+                                 telemetria=trabajo.telemetria)
+            trabajo.resultados = resultados
+            trabajo.estado = 'cancelado' if trabajo.cancel_event.is_set() else 'completado'
+        except Exception as e:
+            logger.error(f"Error en el trabajo {trabajo.id}: {e}", exc_info=True)
+            trabajo.error, trabajo.estado = str(e), 'error'
+        finally:
+            trabajo.fin = time.time()
+        logger.info(f"Trabajo {trabajo.id} {trabajo.estado} en {trabajo.fin - trabajo.inicio:.1f}s.")
+
+    def _purgar(self):
+        terminados = [t.id for t in self._trabajos.values() if t.terminado]
+        for trabajo_id in terminados[:max(len(terminados) - self.max_trabajos, 0)]:
+            del self._trabajos[trabajo_id]
+
+    def get(self, trabajo_id):
+        """El `Trabajo` con ese id, o None si no existe o ya se descartó."""
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def cancel(self, trabajo_id):
+        """
+        Pide cancelar un trabajo. Uno pendiente no llega a ejecutarse; uno en curso termina en
+        cuanto el solver lo note, con las rutas resueltas hasta entonces.
+        """
+        trabajo = self.get(trabajo_id)
+        if trabajo is None or trabajo.terminado:
+            return False
+        trabajo.cancel_event.set()
+        return True
+
+    def list(self):
+        """Resumen de los trabajos conservados, del más reciente al más antiguo."""
+        with self._lock:
+            trabajos = list(self._trabajos.values())
+        return [t.resumen() for t in reversed(trabajos)]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            for trabajo in self._trabajos.values():
+                trabajo.cancel_event.set()
+        self._executor.shutdown(wait=wait)
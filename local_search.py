@@ -0,0 +1,202 @@
+import time
+import numpy as np
+
+VECINOS_CANDIDATOS = 10  # Tamaño de la lista de candidatos por nodo
+EPS_MEJORA = 1e-9  # Mejora mínima (km) para aceptar un movimiento
+MAX_SEGMENTO_OR_OPT = 3
+MAX_ITERACIONES_ILS = 50  # Perturbaciones por defecto cuando no hay presupuesto de tiempo
+
+def tour_length(tour, dist_matrix):
+    tour = np.asarray(tour, dtype=np.intp)
+    return float(dist_matrix[tour, np.roll(tour, -1)].sum())
+
+def es_simetrica(dist_matrix):
+    """
+    Si d[i, j] == d[j, i] para todo par. Un grafo de candidatos lo indica con su atributo `simetrica`;
+    una matriz se compara con su traspuesta (las haversine lo son exactamente).
+    """
+    simetrica = getattr(dist_matrix, 'simetrica', None)
+    if simetrica is not None:
+        return simetrica
+    dist_matrix = np.asarray(dist_matrix)
+    return np.array_equal(dist_matrix, dist_matrix.T)
+
+def _asimetria_acumulada(tour, dist_matrix):
+    """
+    Suma acumulada, en dos vueltas del tour, de d[sig, nodo] - d[nodo, sig] por arista: lo que cambia
+    el costo de un tramo al recorrerlo al revés es la diferencia de dos de estos valores.
+    """
+    siguiente = np.roll(tour, -1)
+    asimetria = dist_matrix[siguiente, tour] - dist_matrix[tour, siguiente]
+    return np.concatenate([[0.0], np.cumsum(np.tile(asimetria, 2))])
+
+def candidate_lists(dist_matrix, k=VECINOS_CANDIDATOS):
+    """
+    Para cada nodo, sus `k` vecinos más cercanos ordenados por distancia. Un grafo de candidatos
+    (`distances.CandidateGraph`, que también puede usarse en lugar de la matriz) ya trae sus listas.
+    """
+    if hasattr(dist_matrix, 'vecinos'):
+        return dist_matrix.vecinos[:, :k]
+    dist_matrix = np.asarray(dist_matrix, dtype=np.float64)
+    n = len(dist_matrix)
+    k = min(k, n - 1)
+    sin_diagonal = dist_matrix.copy()
+    np.fill_diagonal(sin_diagonal, np.inf)
+    vecinos = np.argpartition(sin_diagonal, k - 1, axis=1)[:, :k]
+    orden = np.argsort(np.take_along_axis(sin_diagonal, vecinos, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(vecinos, orden, axis=1)
+
+def _mejor_2opt(tour, pos, dist_matrix, vecinos, acumulada=None):
+    """
+    Mejor movimiento 2-opt entre las aristas (a, sig(a)) y (c, sig(c)) con c candidato de a. Con
+    `acumulada` (ver `_asimetria_acumulada`) la matriz es asimétrica y el delta incluye el cambio de
+    sentido del tramo invertido.
+    """
+    n = len(tour)
+    a, b = tour, np.roll(tour, -1)
+    c = vecinos[a]
+    d = tour[(pos[c] + 1) % n]
+    # Si c es sig(a) o sig(c) es a el delta vale 0, así que no hace falta enmascararlos.
+    if acumulada is None:
+        delta = dist_matrix[a[:, None], c] + dist_matrix[b[:, None], d] - dist_matrix[a, b][:, None] - dist_matrix[c, d]
+    else:
+        # Se invierte el tramo entre las dos aristas: b..c si a va antes que c (a -> c, b -> d), d..a si no (c -> a, d -> b).
+        i, j = np.arange(n)[:, None], pos[c]
+        a_primero = i < j
+        delta = (np.where(a_primero, dist_matrix[a[:, None], c] + dist_matrix[b[:, None], d],
+                          dist_matrix[c, a[:, None]] + dist_matrix[d, b[:, None]])
+                 - dist_matrix[a, b][:, None] - dist_matrix[c, d]
+                 + np.where(a_primero, acumulada[j] - acumulada[i + 1], acumulada[i] - acumulada[j + 1]))
+    mejor = int(np.argmin(delta))
+    if delta.flat[mejor] >= -EPS_MEJORA:
+        return None
+    i, j = mejor // c.shape[1], int(pos[c.flat[mejor]])
+    return min(i, j) + 1, max(i, j)
+
+def _aplicar_2opt(tour, pos, inicio, fin):
+    tour[inicio:fin + 1] = tour[inicio:fin + 1][::-1].copy()
+    pos[tour[inicio:fin + 1]] = np.arange(inicio, fin + 1)
+
+def _mejor_or_opt(tour, pos, dist_matrix, vecinos, acumulada=None):
+    """
+    Mejor movimiento Or-opt: mover un segmento de 1 a 3 nodos junto a un candidato de uno de sus
+    extremos, en cualquiera de las dos orientaciones. Con `acumulada` (matriz asimétrica) insertar el
+    segmento invertido suma además el cambio de sentido de sus aristas internas.
+    """
+    n = len(tour)
+    i = np.arange(n)
+    mejor = None
+    for largo in range(1, MAX_SEGMENTO_OR_OPT + 1):
+        if n < largo + 3:
+            break
+        s1, s2 = tour, tour[(i + largo - 1) % n]
+        p, nx = tour[(i - 1) % n], tour[(i + largo) % n]
+        ganancia = (dist_matrix[p, s1] + dist_matrix[s2, nx] - dist_matrix[p, nx])[:, None]
+        interno = (acumulada[i + largo - 1] - acumulada[i])[:, None] if acumulada is not None else 0.0
+        for extremo, otro in ((s1, s2), (s2, s1)):
+            c = vecinos[extremo]
+            rel = (pos[c] - i[:, None]) % n
+            cn, cp = tour[(pos[c] + 1) % n], tour[(pos[c] - 1) % n]
+            # Insertar después de c (c -> extremo ... otro -> cn) o antes (cp -> otro ... extremo -> c).
+            despues = dist_matrix[c, extremo[:, None]] + dist_matrix[otro[:, None], cn] - dist_matrix[c, cn] - ganancia
+            antes = dist_matrix[cp, otro[:, None]] + dist_matrix[extremo[:, None], c] - dist_matrix[cp, c] - ganancia
+            despues[(rel < largo) | (rel == n - 1)] = np.inf
+            antes[rel <= largo] = np.inf
+            for delta, despues_de_c in ((despues, True), (antes, False)):
+                invertir = (extremo is s1) != despues_de_c
+                if invertir and acumulada is not None:
+                    delta = delta + interno
+                k = int(np.argmin(delta))
+                if delta.flat[k] < -EPS_MEJORA and (mejor is None or delta.flat[k] < mejor[0]):
+                    fila = k // c.shape[1]
+                    mejor = (delta.flat[k], fila, largo, int(c.flat[k]), despues_de_c, invertir)
+    return mejor
+
+def _aplicar_or_opt(tour, movimiento):
+    _, inicio, largo, c, despues_de_c, invertir = movimiento
+    rotado = np.roll(tour, -inicio)
+    segmento, resto = rotado[:largo], rotado[largo:]
+    if invertir:
+        segmento = segmento[::-1]
+    k = int(np.flatnonzero(resto == c)[0]) + (1 if despues_de_c else 0)
+    return np.concatenate([resto[:k], segmento, resto[k:]])
+
+def improve_tour(tour, dist_matrix, vecinos=None, max_iter=None, deadline=None, cancel_event=None, simetrica=None):
+    """
+    Mejora un tour con búsqueda local 2-opt + Or-opt (mejor mejora) usando listas de candidatos.
+    La evaluación de movimientos está vectorizada con NumPy. Con una matriz asimétrica (p. ej. una
+    red vial con sentidos únicos) los deltas cuentan el cambio de sentido de los tramos invertidos;
+    `simetrica` evita comprobarlo (ver `es_simetrica`) cuando ya se sabe.
+    Se detiene antes si se alcanza `deadline` (time.monotonic) o se activa `cancel_event`.
+    Devuelve (tour, distancia).
+    """
+    tour = np.asarray(tour, dtype=np.intp).copy()
+    n = len(tour)
+    if n < 4:
+        return tour.tolist(), tour_length(tour, dist_matrix)
+    if vecinos is None:
+        vecinos = candidate_lists(dist_matrix)
+    if simetrica is None:
+        simetrica = es_simetrica(dist_matrix)
+    pos = np.empty(n, dtype=np.intp)
+    pos[tour] = np.arange(n)
+    iteracion = 0
+    while max_iter is None or iteracion < max_iter:
+        if _debe_parar(deadline, cancel_event):
+            break
+        iteracion += 1
+        acumulada = None if simetrica else _asimetria_acumulada(tour, dist_matrix)
+        movimiento = _mejor_2opt(tour, pos, dist_matrix, vecinos, acumulada)
+        if movimiento is not None:
+            _aplicar_2opt(tour, pos, *movimiento)
+            continue
+        movimiento = _mejor_or_opt(tour, pos, dist_matrix, vecinos, acumulada)
+        if movimiento is None:
+            break
+        tour = _aplicar_or_opt(tour, movimiento)
+        pos[tour] = np.arange(n)
+    return tour.tolist(), tour_length(tour, dist_matrix)
+
+def _debe_parar(deadline, cancel_event):
+    return (deadline is not None and time.monotonic() >= deadline) or \
+           (cancel_event is not None and cancel_event.is_set())
+
+def _double_bridge(tour, rng):
+    """Perturbación clásica double-bridge: corta el tour en 4 tramos y los reordena A C B D."""
+    a, b, c = np.sort(rng.choice(np.arange(1, len(tour)), size=3, replace=False))
+    return np.concatenate([tour[:a], tour[b:c], tour[a:b], tour[c:]])
+
+def anytime_search(tour_inicial, dist_matrix, random_seed, presupuesto_s=None, progress_callback=None,
+                   cancel_event=None, max_iteraciones=None):
+    """
+    Búsqueda local iterada con presupuesto de tiempo: mejora el tour inicial y luego alterna
+    perturbaciones double-bridge con nuevas búsquedas locales, conservando siempre el mejor tour.
+    Termina al agotar `presupuesto_s`, al activarse `cancel_event` o tras `max_iteraciones`
+    perturbaciones (MAX_ITERACIONES_ILS si no hay presupuesto). Tras cada iteración llama a
+    `progress_callback(iteracion, mejor_distancia, transcurrido_s)`.
+    Devuelve (tour, distancia).
+    """
+    inicio = time.monotonic()
+    deadline = inicio + presupuesto_s if presupuesto_s is not None else None
+    if max_iteraciones is None and presupuesto_s is None:
+        max_iteraciones = MAX_ITERACIONES_ILS
+    vecinos = candidate_lists(dist_matrix) if len(tour_inicial) >= 4 else None
+    simetrica = es_simetrica(dist_matrix)
+    mejor, mejor_dist = improve_tour(tour_inicial, dist_matrix, vecinos, deadline=deadline, cancel_event=cancel_event,
+                                     simetrica=simetrica)
+    iteracion = 0
+    if progress_callback:
+        progress_callback(iteracion, mejor_dist, time.monotonic() - inicio)
+    if len(mejor) < 8:
+        return mejor, mejor_dist
+    rng = np.random.default_rng(random_seed)
+    mejor = np.asarray(mejor, dtype=np.intp)
+    while not _debe_parar(deadline, cancel_event) and (max_iteraciones is None or iteracion < max_iteraciones):
+        iteracion += 1
+        candidato, dist = improve_tour(_double_bridge(mejor, rng), dist_matrix, vecinos,
+                                       deadline=deadline, cancel_event=cancel_event, simetrica=simetrica)
+        if dist < mejor_dist - EPS_MEJORA:
+            mejor, mejor_dist = np.asarray(candidato, dtype=np.intp), dist
+        if progress_callback:
+            progress_callback(iteracion, mejor_dist, time.monotonic() - inicio)
+    return mejor.tolist(), mejor_dist
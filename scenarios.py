@@ -0,0 +1,164 @@
+"""
+Barrido de escenarios "¿qué pasaría si...?" sobre una misma tabla de paradas.
+
+`scenario_grid` arma la rejilla de escenarios (número de vehículos, capacidad, costo por km y
+velocidad) y `run_scenarios` los resuelve en un solo lote y devuelve la tabla comparativa (costo,
+distancia, tiempo y utilización por escenario). Lo que no depende del escenario se calcula una vez:
+la tabla de paradas, la matriz de distancias (compartida en memoria con los procesos) y las rutas
+de cada flota, porque el costo y la velocidad no cambian las rutas, solo cómo se valoran.
+"""
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from distances import HAVERSINE
+from solver import ASIGNACIONES_SIN_MATRIZ, ESPERA_CANCELACION_S, DistanceStore, PortfolioSolver, run_optimization
+from stops import StopTable
+from utils import Telemetria, get_logger
+
+logger = get_logger()
+
+MAX_VEHICULOS_ESCENARIO = 20
+COLUMNAS_ESCENARIOS = ['escenario', 'vehiculos', 'capacidad', 'costo_km', 'velocidad_kmh', 'rutas', 'paradas_asignadas',
+                       'paradas_sin_asignar', 'distancia_total_km', 'costo_total', 'tiempo_max_h', 'tiempo_total_h',
+                       'utilizacion_flota_pct', 'utilizacion_media_pct']
+
+def _como_lista(valor):
+    return list(valor) if isinstance(valor, (list, tuple, range, np.ndarray)) else [valor]
+
+def scenario_grid(n_vehiculos, capacidades, costos_km, velocidades_kmh):
+    """
+    Todas las combinaciones de los valores dados (cada argumento es un valor o una lista), como
+    dicts con 'n_vehiculos', 'capacidad', 'costo_km' y 'velocidad_kmh'.
+    """
+    escenarios = [{'n_vehiculos': int(n), 'capacidad': c, 'costo_km': k, 'velocidad_kmh': v}
+                  for n, c, k, v in itertools.product(_como_lista(n_vehiculos), _como_lista(capacidades),
+                                                      _como_lista(costos_km), _como_lista(velocidades_kmh))]
+    for escenario in escenarios:
+        if not 1 <= escenario['n_vehiculos'] <= MAX_VEHICULOS_ESCENARIO:
+            raise ValueError(f"El número de vehículos debe estar entre 1 y {MAX_VEHICULOS_ESCENARIO}.")
+        if escenario['capacidad'] <= 0:
+            raise ValueError("La capacidad de los vehículos debe ser positiva.")
+    return escenarios
+
+def _flota(n_vehiculos, capacidad):
+    return pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': capacidad} for i in range(n_vehiculos)])
+
+def _fila_escenario(numero, escenario, resultados, total_paradas):
+    """Fila de la tabla comparativa; costo y tiempo se recalculan como en `solver._resultado_ruta`."""
+    costo_km, velocidad_kmh = escenario['costo_km'], escenario['velocidad_kmh']
+    distancias = [r['distancia_km'] for r in resultados]
+    distancia_total = float(sum(distancias))
+    asignadas = sum(len(r['secuencia_paradas_ids']) for r in resultados)
+    demanda = sum(r['total_demanda'] for r in resultados)
+    return {'escenario': numero, 'vehiculos': escenario['n_vehiculos'], 'capacidad': escenario['capacidad'],
+            'costo_km': costo_km, 'velocidad_kmh': velocidad_kmh, 'rutas': len(resultados),
+            'paradas_asignadas': asignadas, 'paradas_sin_asignar': total_paradas - asignadas,
+            'distancia_total_km': distancia_total, 'costo_total': distancia_total * costo_km,
+            'tiempo_max_h': max(distancias, default=0.0) / velocidad_kmh if velocidad_kmh > 0 else 0,
+            'tiempo_total_h': distancia_total / velocidad_kmh if velocidad_kmh > 0 else 0,
+            'utilizacion_flota_pct': demanda / (escenario['n_vehiculos'] * escenario['capacidad']) * 100,
+            'utilizacion_media_pct': float(np.mean([r['capacidad_utilizada_pct'] for r in resultados])) if resultados else 0.0}
+
+# --- Resolución en paralelo ---
+# Cada worker abre una sola vez la matriz global (ver `DistanceStore.compartir`) y resuelve flotas enteras.
+_distancias_worker = None
+_parar_worker = None
+
+def _iniciar_worker(evento, argumentos_matriz):
+    global _distancias_worker, _parar_worker
+    _parar_worker = evento
+    _distancias_worker = DistanceStore.adjuntar(*argumentos_matriz) if argumentos_matriz else None
+
+def _resolver_flota_en_worker(tabla, n_vehiculos, capacidad, opciones):
+    return run_optimization(tabla, _flota(n_vehiculos, capacidad), 0.0, 0.0, distancias=_distancias_worker,
+                            cancel_event=_parar_worker, **opciones)
+
+def _resolver_flotas_en_paralelo(tabla, flotas, distancias, opciones, n_workers, al_terminar, cancel_event):
+    """
+    Resuelve cada flota en un proceso; `al_terminar(flota, resultados)` por flota. Al activarse
+    `cancel_event` las flotas pendientes no empiezan y las que corren devuelven sus mejores rutas.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    evento = contexto.Event()  # Lleva la cancelación a los workers
+    with distancias.compartir() if distancias is not None else nullcontext() as argumentos_matriz, \
+            ProcessPoolExecutor(max_workers=min(n_workers, len(flotas)), mp_context=contexto,
+                                initializer=_iniciar_worker, initargs=(evento, argumentos_matriz)) as executor:
+        futuros = {executor.submit(_resolver_flota_en_worker, tabla, *flota, opciones): flota for flota in flotas}
+        pendientes = set(futuros)
+        while pendientes:
+            # Se despierta a menudo para atender la cancelación.
+            hechos, pendientes = wait(pendientes, timeout=ESPERA_CANCELACION_S, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                al_terminar(futuros[futuro], futuro.result())
+            if cancel_event is not None and cancel_event.is_set() and not evento.is_set():
+                evento.set()
+                pendientes = {f for f in pendientes if not f.cancel()}
+
+def run_scenarios(paradas_df, escenarios, random_seed=42, metodo_tsp='local_search', asignacion='greedy',
+                  presupuesto_s=None, n_workers=None, cache=None, proveedor=None, disperso=False, portafolio=None,
+                  progress_callback=None, route_callback=None, cancel_event=None, telemetria=None):
+    """
+    Resuelve los `escenarios` (ver `scenario_grid`) con los mismos parámetros de `run_optimization`
+    y devuelve la tabla comparativa (COLUMNAS_ESCENARIOS), una fila por escenario en su orden.
+    Las paradas se preparan y la matriz de distancias se calcula una sola vez para todos; cada flota
+    distinta (vehículos, capacidad) se resuelve una vez y sus rutas se valoran con el costo y la
+    velocidad de cada escenario. Con `n_workers` > 1 las flotas se resuelven en paralelo en un pool
+    de procesos que lee la matriz desde memoria compartida; cada una se siembra con `random_seed`,
+    así que la tabla es la misma que en modo secuencial. Con una sola flota, o con 'portfolio', los
+    `n_workers` se usan dentro de cada `run_optimization`.
+    `route_callback` recibe cada fila de la tabla en cuanto su flota se resuelve. `cancel_event`
+    detiene el barrido: las flotas pendientes no empiezan y las que están en curso devuelven sus
+    mejores rutas hasta el momento, también en paralelo. En modo secuencial `progress_callback`
+    llega además al solver de cada ruta, como en `run_optimization`.
+    """
+    if metodo_tsp == 'portfolio' and portafolio is None:
+        argumentos = dict(locals())
+        # Un solo pool de procesos para los intentos de todas las rutas de todas las flotas.
+        with PortfolioSolver(n_workers=n_workers) as portafolio:
+            return run_scenarios(**{**argumentos, 'portafolio': portafolio})
+    telemetria = telemetria or Telemetria()
+    proveedor = proveedor or HAVERSINE
+    tabla = StopTable.of(paradas_df)
+    if tabla.depot_pos is None:
+        raise ValueError("La tabla de paradas no tiene depósito.")
+    escenarios = list(escenarios)
+    flotas = list(dict.fromkeys((e['n_vehiculos'], e['capacidad']) for e in escenarios))
+    total_paradas = len(tabla.clientes)
+    filas = {}
+
+    def terminar_flota(flota, resultados):
+        telemetria.contar('flotas_resueltas')
+        for numero, escenario in enumerate(escenarios, start=1):
+            if (escenario['n_vehiculos'], escenario['capacidad']) == flota:
+                filas[numero] = _fila_escenario(numero, escenario, resultados, total_paradas)
+                if route_callback:
+                    route_callback(filas[numero])
+
+    logger.info(f"Barrido de {len(escenarios)} escenarios ({len(flotas)} flotas distintas).")
+    distancias = None
+    if asignacion not in ASIGNACIONES_SIN_MATRIZ and not disperso:
+        with telemetria.fase('matriz'):
+            distancias = DistanceStore(tabla, cache=cache, proveedor=proveedor)
+    opciones = dict(random_seed=random_seed, metodo_tsp=metodo_tsp, asignacion=asignacion, presupuesto_s=presupuesto_s,
+                    cache=cache, proveedor=proveedor, disperso=disperso)
+    paralelo = n_workers and n_workers > 1 and len(flotas) > 1 and metodo_tsp != 'portfolio'
+    with telemetria.fase('escenarios'):
+        if paralelo:
+            logger.info(f"Resolviendo {len(flotas)} flotas en paralelo con {n_workers} procesos.")
+            _resolver_flotas_en_paralelo(tabla, flotas, distancias, opciones, n_workers, terminar_flota, cancel_event)
+        else:
+            for flota in flotas:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                terminar_flota(flota, run_optimization(tabla, _flota(*flota), 0.0, 0.0, n_workers=n_workers,
+                                                       distancias=distancias, portafolio=portafolio,
+                                                       cancel_event=cancel_event, progress_callback=progress_callback,
+                                                       **opciones))
+    telemetria.contar('escenarios', len(filas))
+    logger.info(f"Barrido terminado: {len(filas)} de {len(escenarios)} escenarios resueltos.")
+    return pd.DataFrame([filas[numero] for numero in sorted(filas)], columns=COLUMNAS_ESCENARIOS)
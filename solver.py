@@ -2,113 +2,951 @@ import numpy as np
 import pandas as pd
 import math
 import random
-from python_tsp.heuristics import solve_tsp_simulated_annealing
-from utils import get_logger
+import bisect
+import functools
+import time
+import threading
+import multiprocessing
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from cache import coordinates_fingerprint, instance_fingerprint
+from distances import BLOQUE_FILAS, HAVERSINE, R_TIERRA_KM, CandidateGraph, haversine_matrix
+from local_search import anytime_search, improve_tour, tour_length
+from spatial_index import SpatialIndex, to_unit_xyz
+from stops import StopTable
+from utils import Telemetria, get_logger
 
 logger = get_logger()
 
+MAX_NODOS_BLOQUE = 1000  # Tamaño máximo de cada TSP en la asignación por barrido
+ASIGNACIONES = ('greedy', 'sweep', 'savings')
+ASIGNACIONES_SIN_MATRIZ = ('sweep', 'savings')  # Resuelven cada ruta por bloques, sin la matriz global
+VECINOS_AHORROS = 20  # Vecinos de cada parada entre los que se buscan ahorros de Clarke-Wright
+CANDIDATOS_ASIGNACION = 8  # Vecinos en línea recta re-ordenados por el proveedor de distancias
+CAMPOS_RUTA = ('vehiculo_id', 'capacidad', 'total_demanda', 'capacidad_utilizada_pct', 'distancia_km', 'costo_estimado',
+               'tiempo_estimado_h', 'secuencia_paradas_ids', 'solver', 'fallback')
+
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radio de la Tierra en km
+    R = R_TIERRA_KM
     lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(math.radians, [lat1, lon1, lat2, lon2])
     dlon, dlat = lon2_rad - lon1_rad, lat2_rad - lat1_rad
     a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
     return R * 2 * math.asin(math.sqrt(a))
 
-def create_distance_matrix(paradas_df):
-    paradas_dict = paradas_df.to_dict('records')
-    ids = [p['id'] for p in paradas_dict]
-    n = len(paradas_dict)
-    dist_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(i, n):
-            dist = haversine(paradas_dict[i]['lat'], paradas_dict[i]['lon'], paradas_dict[j]['lat'], paradas_dict[j]['lon'])
-            dist_matrix[i, j] = dist_matrix[j, i] = dist
+def create_distance_matrix(paradas_df, dtype=np.float64, block_size=BLOQUE_FILAS, proveedor=None):
+    """Matriz de distancias (km) entre todas las paradas; haversine salvo que se pase otro `proveedor`."""
+    ids = paradas_df['id'].tolist()
+    lats, lons = np.asarray(paradas_df['lat'], dtype=np.float64), np.asarray(paradas_df['lon'], dtype=np.float64)
+    if proveedor is not None and proveedor is not HAVERSINE:
+        return proveedor.matrix(lats, lons, dtype=dtype), ids
+    dist_matrix = haversine_matrix(lats, lons, dtype=dtype, block_size=block_size)
     return dist_matrix, ids
 
 def nearest_neighbor_solver(dist_matrix):
+    dist_matrix = np.asarray(dist_matrix)
     num_nodos = len(dist_matrix)
     if num_nodos == 0: return [], 0
-    visitados, ruta, distancia_total = [False] * num_nodos, [0], 0
+    visitados, ruta, distancia_total = np.zeros(num_nodos, dtype=bool), [0], 0
     visitados[0], actual = True, 0
     for _ in range(num_nodos - 1):
-        siguiente, dist_min = -1, float('inf')
-        for i in range(num_nodos):
-            if not visitados[i] and dist_matrix[actual][i] < dist_min:
-                dist_min, siguiente = dist_matrix[actual][i], i
-        if siguiente != -1:
+        # Los NaN y los ya visitados nunca se eligen; argmin conserva el primer mínimo como el bucle original.
+        fila = np.where(visitados | np.isnan(dist_matrix[actual]), np.inf, dist_matrix[actual])
+        siguiente = int(np.argmin(fila))
+        if fila[siguiente] < np.inf:
             ruta.append(siguiente)
-            visitados[siguiente], distancia_total, actual = True, distancia_total + dist_min, siguiente
+            visitados[siguiente], distancia_total, actual = True, distancia_total + dist_matrix[actual][siguiente], siguiente
     distancia_total += dist_matrix[actual][0]
     return ruta, distancia_total
 
-def solve_tsp_with_fallback(dist_matrix, random_seed):
+def farthest_insertion_solver(dist_matrix):
+    """
+    Inserción más lejana desde el depósito: agrega la parada más alejada del tour parcial en la
+    posición que menos lo alarga. Da tours de forma distinta a los del vecino más cercano. O(n²).
+    """
+    dist_matrix = np.asarray(dist_matrix, dtype=np.float64)
+    num_nodos = len(dist_matrix)
+    if num_nodos == 0: return [], 0
+    ruta = [0]
+    lejania = np.minimum(dist_matrix[0], dist_matrix[:, 0])  # Distancia de cada parada al tour parcial
+    lejania[0] = -np.inf
+    for _ in range(num_nodos - 1):
+        k = int(np.argmax(lejania))
+        tour = np.asarray(ruta)
+        siguiente = np.roll(tour, -1)
+        aumento = dist_matrix[tour, k] + dist_matrix[k, siguiente] - dist_matrix[tour, siguiente]
+        ruta.insert(int(np.argmin(aumento)) + 1, k)
+        lejania = np.minimum(lejania, np.minimum(dist_matrix[k], dist_matrix[:, k]))
+        lejania[k] = -np.inf
+    return ruta, tour_length(ruta, dist_matrix)
+
+SOLVERS_TSP = ('sa', 'local_search', 'anytime', 'anytime_insercion', 'nn', 'portfolio')
+SOLVERS_DISPERSOS = ('local_search', 'anytime', 'nn')  # Pueden resolver sobre un CandidateGraph en lugar de la matriz
+ESTRATEGIAS_PORTAFOLIO = ('anytime', 'anytime_insercion')
+SOLVERS_ALEATORIOS = ('anytime', 'anytime_insercion', 'sa')
+SEMILLAS_PORTAFOLIO = 4  # Semillas por estrategia aleatoria (SOLVERS_ALEATORIOS) en el portafolio
+ESPERA_PORTAFOLIO_S = 0.2
+
+def solve_tsp_with_fallback(dist_matrix, random_seed, metodo='sa', presupuesto_s=None, progress_callback=None,
+                            cancel_event=None):
+    """
+    Resuelve el TSP de una ruta con el `metodo` indicado:
+    'sa' (simulated annealing de python-tsp), 'local_search' (vecino más cercano + 2-opt/Or-opt),
+    'anytime' (búsqueda local iterada que devuelve el mejor tour al agotar el presupuesto),
+    'anytime_insercion' (lo mismo partiendo de la inserción más lejana en vez del vecino más cercano),
+    'nn' (solo vecino más cercano) o 'portfolio' (el mejor de varios intentos, ver `PortfolioSolver`).
+    Si el solver avanzado falla se usa Nearest Neighbor.
+    `presupuesto_s` limita el tiempo de reloj de todos menos 'nn'. `progress_callback` (iteracion,
+    mejor_distancia, transcurrido_s) solo lo usan los 'anytime'; `cancel_event`, también 'local_search'.
+    """
+    permutation, distance, _ = _resolver_tsp(dist_matrix, random_seed, metodo, presupuesto_s, progress_callback,
+                                             cancel_event)
+    return permutation, distance
+
+def _resolver_tsp(dist_matrix, random_seed, metodo='sa', presupuesto_s=None, progress_callback=None, cancel_event=None,
+                  portafolio=None):
+    """
+    Como `solve_tsp_with_fallback`, devolviendo además el solver que produjo el tour ('nn' si hubo
+    fallback). Con 'portfolio' usa `portafolio` (un PortfolioSolver) o uno secuencial por defecto.
+    """
     num_nodos = len(dist_matrix)
     if num_nodos <= 2:
-        return list(range(num_nodos)), np.sum(dist_matrix) if num_nodos == 2 else 0
+        return list(range(num_nodos)), np.sum(dist_matrix) if num_nodos == 2 else 0, metodo
+    if metodo not in SOLVERS_TSP:
+        raise ValueError(f"Solver TSP desconocido: {metodo}. Opciones: {', '.join(SOLVERS_TSP)}")
+    if metodo == 'nn':
+        return (*nearest_neighbor_solver(dist_matrix), 'nn')
     
     np.random.seed(random_seed)
     random.seed(random_seed)
 
     try:
-        logger.info(f"Intentando solver avanzado para {num_nodos} nodos...")
+        logger.info(f"Intentando solver avanzado ({metodo}) para {num_nodos} nodos...")
         if np.isnan(dist_matrix).any() or np.isinf(dist_matrix).any():
             raise ValueError("Matriz de distancia contiene NaN/Inf.")
         
-        permutation, distance = solve_tsp_simulated_annealing(dist_matrix)
+        if metodo == 'portfolio':
+            permutation, distance = (portafolio or PortfolioSolver()).solve(dist_matrix, random_seed, presupuesto_s,
+                                                                           progress_callback, cancel_event)
+        elif metodo == 'local_search':
+            ruta_inicial, _ = nearest_neighbor_solver(dist_matrix)
+            deadline = time.monotonic() + presupuesto_s if presupuesto_s is not None else None
+            permutation, distance = improve_tour(ruta_inicial, dist_matrix, deadline=deadline, cancel_event=cancel_event)
+        elif metodo in ('anytime', 'anytime_insercion'):
+            construir = nearest_neighbor_solver if metodo == 'anytime' else farthest_insertion_solver
+            ruta_inicial, _ = construir(dist_matrix)
+            permutation, distance = anytime_search(ruta_inicial, dist_matrix, random_seed, presupuesto_s,
+                                                   progress_callback, cancel_event)
+        else:
+            # Import diferido: python-tsp solo se carga si alguien usa 'sa'.
+            from python_tsp.heuristics import solve_tsp_simulated_annealing
+            permutation, distance = solve_tsp_simulated_annealing(dist_matrix, max_processing_time=presupuesto_s)
         
         logger.info("Solver avanzado completado con éxito.")
-        return permutation, distance
+        return permutation, distance, metodo
     except (StopIteration, ValueError) as e:
         logger.warning(f"Solver avanzado falló ({type(e).__name__}). Ejecutando fallback (Nearest Neighbor).")
-        return nearest_neighbor_solver(dist_matrix)
-
-def assign_stops_to_vehicles(paradas_df, vehiculos_df, depot):
-    paradas_pendientes = paradas_df.copy().sort_values('demanda', ascending=False)
-    asignaciones = {v_id: [] for v_id in vehiculos_df['id']}
-    capacidad_restante = {row['id']: row['capacidad'] for _, row in vehiculos_df.iterrows()}
-    for _, vehiculo in vehiculos_df.iterrows():
-        vehiculo_id = vehiculo['id']
-        last_pos = (depot['lat'], depot['lon'])
+        return (*nearest_neighbor_solver(dist_matrix), 'nn')
+
+def cota_inferior_tsp(dist_matrix):
+    """
+    Cota inferior de la longitud del tour (1-árbol): árbol de expansión mínima de los nodos 1..n-1
+    más las dos aristas más cortas del nodo 0. Con distancias asimétricas usa el mínimo de cada par.
+    """
+    m = np.minimum(dist_matrix, np.transpose(dist_matrix))
+    n = len(m)
+    if n < 3:
+        return float(m.sum())
+    resto = m[1:, 1:]
+    en_arbol = np.zeros(n - 1, dtype=bool)
+    en_arbol[0] = True
+    mejor, total = resto[0].astype(np.float64), 0.0
+    for _ in range(n - 2):  # Prim denso, O(n²)
+        mejor[en_arbol] = np.inf
+        j = int(np.argmin(mejor))
+        total += mejor[j]
+        en_arbol[j] = True
+        mejor = np.minimum(mejor, resto[j])
+    return float(total + np.partition(m[0, 1:], 1)[:2].sum())
+
+def _iniciar_worker_portafolio(evento):
+    global _parar_portafolio
+    _parar_portafolio = evento
+
+def _intento_portafolio(dist_matrix, metodo, semilla, limite):
+    """Un intento del portafolio en un proceso worker; `limite` es la hora (time.time) de parada o None."""
+    presupuesto = max(limite - time.time(), 0.0) if limite is not None else None
+    return _resolver_tsp(dist_matrix, semilla, metodo, presupuesto, cancel_event=_parar_portafolio)
+
+class PortfolioSolver:
+    """
+    Resuelve cada TSP con varios intentos y se queda con el tour más corto: `n_semillas` semillas
+    (base + 0..n-1) de cada estrategia aleatoria (SOLVERS_ALEATORIOS) y un intento de cada estrategia
+    determinista. Por defecto combina 'anytime' y 'anytime_insercion': la misma búsqueda desde dos
+    construcciones distintas, que caen en óptimos locales distintos. Con `n_workers` > 1 los intentos corren en un pool de procesos que se reutiliza
+    entre rutas (cerrarlo con `close` o usarlo con `with`).
+    Se detiene antes cuando un intento queda a menos de `gap_objetivo` (fracción) de la cota
+    inferior `cota_inferior_tsp`, o al agotar `presupuesto_s` (tiempo de reloj de toda la ruta);
+    los intentos en curso devuelven entonces su mejor tour. Sin esos cortes el resultado es
+    reproducible para la misma semilla base, en serie o en paralelo: los empates se resuelven
+    por orden de intento.
+    """
+
+    def __init__(self, estrategias=ESTRATEGIAS_PORTAFOLIO, n_semillas=SEMILLAS_PORTAFOLIO, gap_objetivo=None, n_workers=1):
+        if 'portfolio' in estrategias or not set(estrategias) <= set(SOLVERS_TSP):
+            raise ValueError(f"Estrategias de portafolio no válidas: {', '.join(estrategias)}")
+        self.estrategias, self.n_semillas, self.gap_objetivo = tuple(estrategias), n_semillas, gap_objetivo
+        self.n_workers = n_workers or 1
+        self._executor = self._evento = None
+        self._lock = threading.Lock()  # El pool y su evento de parada atienden una ruta a la vez
+
+    @property
+    def clave(self):
+        return f"portfolio-{'+'.join(self.estrategias)}-{self.n_semillas}-{self.gap_objetivo}"
+
+    def candidatos(self, random_seed):
+        """(método, semilla) de cada intento, en orden."""
+        return [(metodo, random_seed + k) for metodo in self.estrategias
+                for k in range(self.n_semillas if metodo in SOLVERS_ALEATORIOS else 1)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = self._evento = None
+
+    def _pool(self):
+        if self._executor is None:
+            contexto = multiprocessing.get_context('spawn')
+            self._evento = contexto.Event()
+            self._executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=contexto,
+                                                 initializer=_iniciar_worker_portafolio, initargs=(self._evento,))
+        return self._executor
+
+    def _objetivo_alcanzado(self, distancia, cota):
+        return self.gap_objetivo is not None and cota > 0 and (distancia - cota) / cota <= self.gap_objetivo
+
+    def _resolver_en_pool(self, dist_matrix, candidatos, limite, registrar, cancel_event):
+        pool = self._pool()
+        self._evento.clear()
+        futuros = {pool.submit(_intento_portafolio, dist_matrix, metodo, semilla, limite): i
+                   for i, (metodo, semilla) in enumerate(candidatos)}
+        pendientes = set(futuros)
+        while pendientes:
+            # Se despierta a menudo para atender la cancelación y el límite de tiempo.
+            espera = ESPERA_PORTAFOLIO_S if limite is None else min(max(limite - time.time(), 0.0), ESPERA_PORTAFOLIO_S)
+            hechos, pendientes = wait(pendientes, timeout=espera, return_when=FIRST_COMPLETED)
+            parar = any([registrar(futuros[f], f.result()) for f in hechos])
+            cancelado = cancel_event is not None and cancel_event.is_set()
+            if parar or cancelado or (limite is not None and time.time() >= limite):
+                # Los pendientes no empiezan; los que corren devuelven su mejor tour y también cuentan.
+                self._evento.set()
+                pendientes = {f for f in pendientes if not f.cancel()}
+
+    def solve(self, dist_matrix, random_seed, presupuesto_s=None, progress_callback=None, cancel_event=None):
+        """Devuelve (permutación, distancia) del mejor intento."""
+        inicio = time.time()
+        limite = inicio + presupuesto_s if presupuesto_s is not None else None
+        cota = cota_inferior_tsp(dist_matrix) if self.gap_objetivo is not None else 0.0
+        candidatos = self.candidatos(random_seed)
+        resultados = {}
+
+        def registrar(i, solucion):
+            resultados[i] = solucion
+            mejor = min(d for _, d, _ in resultados.values())
+            if progress_callback:
+                progress_callback(len(resultados), mejor, time.time() - inicio)
+            return self._objetivo_alcanzado(mejor, cota)
+
+        if self.n_workers > 1 and len(candidatos) > 1:
+            with self._lock:
+                self._resolver_en_pool(dist_matrix, candidatos, limite, registrar, cancel_event)
+        else:
+            for i, (metodo, semilla) in enumerate(candidatos):
+                presupuesto = max(limite - time.time(), 0.0) if limite is not None else None
+                if i and ((presupuesto is not None and presupuesto <= 0) or (cancel_event is not None and cancel_event.is_set())):
+                    break
+                if registrar(i, _resolver_tsp(dist_matrix, semilla, metodo, presupuesto, cancel_event=cancel_event)):
+                    break
+        ganador = min(resultados, key=lambda i: (resultados[i][1], i))
+        permutation, distance, _ = resultados[ganador]
+        logger.info(f"Portafolio: mejor intento {candidatos[ganador][0]} (semilla {candidatos[ganador][1]}) "
+                    f"de {len(resultados)}/{len(candidatos)}, {distance:.2f} km.")
+        return permutation, distance
+
+class DistanceStore:
+    """Matriz de distancias compartida por toda una optimización, indexada por posición de parada."""
+
+    def __init__(self, paradas_df, dtype=np.float64, cache=None, proveedor=None):
+        self.ids = paradas_df['id'].tolist()
+        clave = f"matriz-{coordinates_fingerprint(paradas_df)}-{np.dtype(dtype).name}" if cache is not None else None
+        if clave and proveedor is not None and proveedor is not HAVERSINE:
+            clave += f"-{proveedor.clave}"
+        self.matrix = cache.get_matrix(clave) if cache is not None else None
+        if self.matrix is None:
+            self.matrix, _ = create_distance_matrix(paradas_df, dtype=dtype, proveedor=proveedor)
+            if cache is not None:
+                cache.put_matrix(clave, self.matrix)
+
+    @classmethod
+    def from_matrix(cls, ids, matrix):
+        """Envuelve una matriz ya calculada (p. ej. en memoria compartida) sin copiarla."""
+        distancias = cls.__new__(cls)
+        distancias.ids, distancias.matrix = list(ids), matrix
+        return distancias
+
+    @contextmanager
+    def compartir(self):
+        """
+        Copia la matriz a memoria compartida mientras dura el `with` y da los argumentos con que cada
+        proceso worker la abre sin copiarla (`DistanceStore.adjuntar(*argumentos)`). Al salir la libera.
+        """
+        memoria = shared_memory.SharedMemory(create=True, size=max(self.matrix.nbytes, 1))
+        try:
+            matriz = np.ndarray(self.matrix.shape, dtype=self.matrix.dtype, buffer=memoria.buf)
+            matriz[:] = self.matrix
+            del matriz
+            yield memoria.name, self.matrix.shape, self.matrix.dtype.str, self.ids
+        finally:
+            memoria.close()
+            memoria.unlink()
+
+    @classmethod
+    def adjuntar(cls, nombre_memoria, forma, dtype, ids):
+        """En un worker: la matriz publicada con `compartir`, leída directamente de la memoria compartida."""
+        memoria = shared_memory.SharedMemory(name=nombre_memoria)
+        distancias = cls.from_matrix(ids, np.ndarray(forma, dtype=dtype, buffer=memoria.buf))
+        distancias._memoria = memoria  # El segmento sigue abierto mientras viva la matriz
+        return distancias
+
+    def __len__(self):
+        return len(self.ids)
+
+    def submatrix(self, posiciones):
+        posiciones = np.asarray(posiciones, dtype=np.intp)
+        return self.matrix[np.ix_(posiciones, posiciones)]
+
+    def desde(self, origen, destinos):
+        return self.matrix[origen, destinos]
+
+def _asignar_por_posicion(lats, lons, demandas, depot_pos, clientes_pos, vehiculos, distancia=None):
+    """
+    Asignación greedy (la parada más cercana que cabe) sobre posiciones de parada.
+    Usa un SpatialIndex para la búsqueda del vecino más cercano filtrado por capacidad restante.
+    Con `distancia(origen, destinos)` (posiciones) se toman los CANDIDATOS_ASIGNACION más
+    cercanos en línea recta y se elige el más cercano según esa distancia (p. ej. por carretera).
+    """
+    k = 1 if distancia is None else CANDIDATOS_ASIGNACION
+    orden = clientes_pos[np.argsort(-demandas[clientes_pos], kind='stable')]
+    indice = SpatialIndex(lats[orden], lons[orden], demandas[orden])
+    depot_xyz = to_unit_xyz([lats[depot_pos]], [lons[depot_pos]])[0]
+    asignaciones = {}
+    for vehiculo_id, capacidad in vehiculos:
+        asignaciones[vehiculo_id] = []
+        capacidad_restante, last_xyz, last_pos = capacidad, depot_xyz, depot_pos
         while True:
-            paradas_que_caben = paradas_pendientes[paradas_pendientes['demanda'] <= capacidad_restante[vehiculo_id]].copy()
-            if paradas_que_caben.empty: break
-            paradas_que_caben['dist_a_last'] = paradas_que_caben.apply(lambda r: haversine(last_pos[0], last_pos[1], r['lat'], r['lon']), axis=1)
-            mejor_parada = paradas_que_caben.sort_values('dist_a_last').iloc[0]
-            asignaciones[vehiculo_id].append(mejor_parada['id'])
-            capacidad_restante[vehiculo_id] -= mejor_parada['demanda']
-            paradas_pendientes = paradas_pendientes.drop(mejor_parada.name)
-            last_pos = (mejor_parada['lat'], mejor_parada['lon'])
+            mejor = indice.consultar_xyz(last_xyz, k=k, demanda_max=capacidad_restante)
+            if mejor.size == 0: break
+            if distancia is not None and mejor.size > 1:
+                mejor = mejor[[int(np.argmin(distancia(last_pos, orden[mejor])))]]
+            indice.eliminar(mejor[0])
+            last_xyz = indice.xyz[mejor[0]]
+            last_pos = int(orden[mejor[0]])
+            asignaciones[vehiculo_id].append(last_pos)
+            capacidad_restante -= demandas[last_pos]
     return asignaciones
 
-def run_optimization(paradas_df, vehiculos_df, costo_km, velocidad_kmh, random_seed, force_fallback=False):
-    logger.info("Iniciando optimización de rutas.")
-    depot = paradas_df[paradas_df['is_depot']].iloc[0].to_dict()
-    paradas_clientes_df = paradas_df[~paradas_df['is_depot']]
-    asignaciones = assign_stops_to_vehicles(paradas_clientes_df, vehiculos_df, depot)
-    resultados = []
-    paradas_dict = {p['id']: p for _, p in paradas_df.iterrows()}
-    for vehiculo_id, parada_ids in asignaciones.items():
-        if not parada_ids: continue
-        nodos_ruta_ids = [depot['id']] + parada_ids
-        nodos_ruta_df = paradas_df[paradas_df['id'].isin(nodos_ruta_ids)].set_index('id').loc[nodos_ruta_ids].reset_index()
-        dist_matrix, ordered_ids = create_distance_matrix(nodos_ruta_df)
+def _orden_barrido(lats, lons, depot_pos, posiciones):
+    """Posiciones ordenadas por ángulo polar alrededor del depósito, empezando tras el mayor hueco angular."""
+    if len(posiciones) == 0:
+        return posiciones
+    dy = lats[posiciones] - lats[depot_pos]
+    dx = (lons[posiciones] - lons[depot_pos]) * np.cos(np.radians(lats[depot_pos]))
+    angulos = np.arctan2(dy, dx)
+    orden = np.argsort(angulos, kind='stable')
+    # Empezar tras el mayor hueco evita partir en dos un grupo de paradas que cruza el ángulo ±π.
+    huecos = np.diff(np.r_[angulos[orden], angulos[orden[0]] + 2 * np.pi])
+    return posiciones[np.roll(orden, -(int(np.argmax(huecos)) + 1))]
+
+def _asignar_por_barrido(lats, lons, demandas, depot_pos, clientes_pos, vehiculos):
+    """
+    Asignación por barrido (sweep): recorre las paradas por ángulo polar alrededor del depósito y
+    llena cada vehículo con paradas consecutivas hasta su capacidad. Las paradas que no caben en
+    ningún vehículo, o las que sobran al agotar la flota, quedan sin asignar como en la greedy.
+    """
+    vehiculos = list(vehiculos)
+    capacidad_max = max((capacidad for _, capacidad in vehiculos), default=0)
+    orden = _orden_barrido(lats, lons, depot_pos, clientes_pos[demandas[clientes_pos] <= capacidad_max])
+    acumulada = np.cumsum(demandas[orden])
+    asignaciones, inicio = {}, 0
+    for vehiculo_id, capacidad in vehiculos:
+        base = acumulada[inicio - 1] if inicio else 0.0
+        fin = int(np.searchsorted(acumulada, base + capacidad, side='right'))
+        asignaciones[vehiculo_id] = orden[inicio:fin].tolist()
+        inicio = fin
+    return asignaciones
+
+def _pares_ahorro(lats, lons, k):
+    """Pares (i, j) con i < j en los que uno está entre los `k` vecinos más cercanos del otro."""
+    n = len(lats)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    vecinos = SpatialIndex(lats, lons, puntos_por_celda=max(k, 4)).vecinos_cercanos(k)
+    pares = np.unique(np.sort(np.column_stack([np.repeat(np.arange(n), k), vecinos.ravel()]), axis=1), axis=0)
+    return pares[:, 0], pares[:, 1]
+
+def _asignar_por_ahorros(lats, lons, demandas, depot_pos, clientes_pos, vehiculos, proveedor=HAVERSINE,
+                         k=VECINOS_AHORROS):
+    """
+    Asignación por ahorros de Clarke-Wright: cada parada empieza en su propia ruta y se unen rutas
+    por el extremo, en orden de ahorro d(0,i) + d(0,j) - d(i,j) decreciente, mientras la carga quepa
+    en el vehículo más grande. Solo se consideran los pares de vecinos cercanos (`k` por parada), así
+    que la lista de ahorros y la memoria crecen linealmente con las paradas. Un union-find con la
+    carga en la raíz hace que cada comprobación de capacidad sea O(1). Después cada vehículo, del más
+    grande al más pequeño, toma la ruta más cargada que le cabe. Las rutas que sobran (hay más rutas
+    que vehículos) se añaden enteras, o parada a parada si no caben, al vehículo con más capacidad
+    libre; lo que no cabe en ninguno queda sin asignar. Las posiciones salen en el orden de su ruta.
+    """
+    vehiculos = list(vehiculos)
+    capacidad_max = max((capacidad for _, capacidad in vehiculos), default=0)
+    clientes = clientes_pos[demandas[clientes_pos] <= capacidad_max]
+    m = len(clientes)
+    lats_c, lons_c = lats[clientes], lons[clientes]
+    al_deposito = proveedor.pairs(np.full(m, lats[depot_pos]), np.full(m, lons[depot_pos]), lats_c, lons_c)
+    origen, destino = _pares_ahorro(lats_c, lons_c, k)
+    ahorros = al_deposito[origen] + al_deposito[destino] - proveedor.pairs(lats_c[origen], lons_c[origen],
+                                                                           lats_c[destino], lons_c[destino])
+    orden = np.lexsort((destino, origen, -ahorros))
+
+    padre, carga = list(range(m)), demandas[clientes].tolist()
+    vecino_a, vecino_b = [-1] * m, [-1] * m  # Hasta dos vecinos por parada: la ruta es un camino
+
+    def raiz(i):
+        while padre[i] != i:
+            padre[i] = padre[padre[i]]
+            i = padre[i]
+        return i
+
+    for i, j in zip(origen[orden].tolist(), destino[orden].tolist()):
+        # Solo se unen extremos (paradas con menos de dos vecinos) de rutas distintas.
+        if vecino_b[i] != -1 or vecino_b[j] != -1:
+            continue
+        ri, rj = raiz(i), raiz(j)
+        if ri == rj or carga[ri] + carga[rj] > capacidad_max:
+            continue
+        for a, b in ((i, j), (j, i)):
+            if vecino_a[a] == -1:
+                vecino_a[a] = b
+            else:
+                vecino_b[a] = b
+        padre[rj] = ri
+        carga[ri] += carga[rj]
+
+    rutas, visitada = [], [False] * m
+    for inicio in range(m):
+        if visitada[inicio] or vecino_b[inicio] != -1:
+            continue
+        ruta, anterior, actual = [], -1, inicio
+        while actual != -1:
+            visitada[actual] = True
+            ruta.append(int(clientes[actual]))
+            anterior, actual = actual, vecino_b[actual] if vecino_a[actual] == anterior else vecino_a[actual]
+        rutas.append((carga[raiz(inicio)], ruta))
+    # Rutas por carga creciente (las de igual carga en orden de creación) para buscar con bisect.
+    rutas.sort(key=lambda r: r[0])
+    cargas = [c for c, _ in rutas]
+    asignaciones = {vehiculo_id: [] for vehiculo_id, _ in vehiculos}
+    libre = dict(vehiculos)
+    if not libre:
+        return asignaciones
+    for vehiculo_id, capacidad in sorted(vehiculos, key=lambda v: -v[1]):
+        pos = bisect.bisect_right(cargas, capacidad) - 1
+        if pos < 0:
+            continue
+        asignaciones[vehiculo_id] = rutas.pop(pos)[1]
+        libre[vehiculo_id] -= cargas.pop(pos)
+    for carga_ruta, ruta in reversed(rutas):
+        # La ruta entera si cabe en algún vehículo; si no, sus paradas una a una.
+        partes = [(ruta, carga_ruta)] if carga_ruta <= max(libre.values()) else [([p], demandas[p]) for p in ruta]
+        for parte, carga_parte in partes:
+            vehiculo_id = max(libre, key=libre.get)
+            if carga_parte <= libre[vehiculo_id]:
+                asignaciones[vehiculo_id].extend(parte)
+                libre[vehiculo_id] -= carga_parte
+    return asignaciones
+
+def assign_stops_to_vehicles(paradas_df, vehiculos_df, depot, asignacion='greedy', proveedor=None):
+    """
+    Ids de parada de cada vehículo con la estrategia `asignacion` ('greedy', 'sweep' o 'savings').
+    Con un `proveedor` de distancias la greedy elige la parada más cercana según ese proveedor y
+    'savings' calcula los ahorros con él.
+    """
+    if asignacion not in ASIGNACIONES:
+        raise ValueError(f"Asignación desconocida: {asignacion}. Opciones: {', '.join(ASIGNACIONES)}")
+    asignar = {'greedy': _asignar_por_posicion, 'sweep': _asignar_por_barrido, 'savings': _asignar_por_ahorros}[asignacion]
+    nodos_df = pd.concat([pd.DataFrame([depot])[['id', 'lat', 'lon']], paradas_df[['id', 'lat', 'lon']]], ignore_index=True)
+    demandas = np.concatenate([[0], paradas_df['demanda'].to_numpy(dtype=np.float64)])
+    vehiculos = zip(vehiculos_df['id'], vehiculos_df['capacidad'])
+    lats, lons = nodos_df['lat'].to_numpy(dtype=np.float64), nodos_df['lon'].to_numpy(dtype=np.float64)
+    opciones = {}
+    if asignacion == 'greedy' and proveedor is not None and proveedor is not HAVERSINE:
+        opciones['distancia'] = lambda origen, destinos: proveedor.pairs(lats[origen], lons[origen], lats[destinos], lons[destinos])
+    elif asignacion == 'savings' and proveedor is not None:
+        opciones['proveedor'] = proveedor
+    asignaciones = asignar(lats, lons, demandas, 0, np.arange(1, len(nodos_df)), vehiculos, **opciones)
+    ids = nodos_df['id'].to_numpy()
+    return {v_id: [ids[p] for p in posiciones] for v_id, posiciones in asignaciones.items()}
+
+def _resolver_ruta(dist_matrix, random_seed, force_fallback, vehiculo_id, metodo_tsp='sa', **opciones):
+    """Devuelve (permutación, distancia, info) con el solver usado, si hubo fallback, el tiempo y los nodos."""
+    inicio = time.perf_counter()
+    if force_fallback:
+        logger.info(f"Forzando fallback para vehículo {vehiculo_id}.")
+        permutation, distance, usado = (*nearest_neighbor_solver(dist_matrix), 'nn')
+    else:
+        permutation, distance, usado = _resolver_tsp(dist_matrix, random_seed, metodo_tsp, **opciones)
+    info = {"solver": usado, "fallback": force_fallback or usado != metodo_tsp,
+            "tiempo_s": time.perf_counter() - inicio, "nodos": len(dist_matrix)}
+    return permutation, distance, info
+
+def _resolver_ruta_dispersa(lats, lons, random_seed, force_fallback, vehiculo_id, metodo_tsp='local_search',
+                            presupuesto_s=None, proveedor=HAVERSINE, progress_callback=None, cancel_event=None):
+    """
+    Resuelve una ruta sobre un `CandidateGraph` en lugar de una matriz: el tour inicial es el del
+    vecino más cercano (con el índice espacial) y 'local_search' o 'anytime' lo mejoran con las
+    distancias calculadas bajo demanda. Devuelve (permutación, distancia, info) como `_resolver_ruta`.
+    """
+    inicio = time.perf_counter()
+    grafo = CandidateGraph(lats, lons, proveedor=proveedor)
+    n = len(grafo)
+    distancia = grafo.desde if grafo.proveedor is not HAVERSINE else None
+    tour = np.r_[0, _asignar_por_posicion(grafo.lats, grafo.lons, np.zeros(n), 0, np.arange(1, n), [(None, np.inf)],
+                                          distancia)[None]].astype(np.intp)
+    if force_fallback or metodo_tsp == 'nn':
         if force_fallback:
             logger.info(f"Forzando fallback para vehículo {vehiculo_id}.")
-            permutation, dist_km = nearest_neighbor_solver(dist_matrix)
-        else:
-            permutation, dist_km = solve_tsp_with_fallback(dist_matrix, random_seed)
-        nodos_ordenados = [ordered_ids[i] for i in permutation]
-        start_idx = nodos_ordenados.index(depot['id'])
-        secuencia_final_ids = nodos_ordenados[start_idx:] + nodos_ordenados[:start_idx]
-        total_demanda = paradas_clientes_df[paradas_clientes_df['id'].isin(parada_ids)]['demanda'].sum()
-        vehiculo_info = vehiculos_df[vehiculos_df['id'] == vehiculo_id].iloc[0]
-        resultados.append({
-            "vehiculo_id": vehiculo_id, "capacidad": int(vehiculo_info['capacidad']), "total_demanda": int(total_demanda),
-            "capacidad_utilizada_pct": (total_demanda / vehiculo_info['capacidad']) * 100, "distancia_km": dist_km,
-            "costo_estimado": dist_km * costo_km, "tiempo_estimado_h": dist_km / velocidad_kmh if velocidad_kmh > 0 else 0,
-            "secuencia_paradas_ids": [pid for pid in secuencia_final_ids if pid != depot['id']]
-        })
-    logger.info(f"Optimización finalizada. Se generaron {len(resultados)} rutas.")
+        permutation, distance, usado = tour.tolist(), tour_length(tour, grafo), 'nn'
+    elif metodo_tsp == 'anytime':
+        permutation, distance = anytime_search(tour, grafo, random_seed, presupuesto_s, progress_callback, cancel_event)
+        usado = metodo_tsp
+    else:
+        deadline = time.monotonic() + presupuesto_s if presupuesto_s is not None else None
+        permutation, distance = improve_tour(tour, grafo, deadline=deadline, cancel_event=cancel_event)
+        usado = metodo_tsp
+    info = {"solver": usado, "fallback": force_fallback or usado != metodo_tsp,
+            "tiempo_s": time.perf_counter() - inicio, "nodos": n}
+    return permutation, distance, info
+
+def _abrir_ciclo(tour, lats, lons, desde, proveedor=HAVERSINE):
+    """
+    Convierte el ciclo `tour` en un camino que empieza en la parada más cercana a `desde`,
+    recorrido en el sentido que elimina la más larga de sus dos aristas.
+    """
+    inicio = int(np.argmin(proveedor.pairs(lats[desde], lons[desde], lats[tour], lons[tour])))
+    tour = np.roll(tour, -inicio)
+    if len(tour) > 2 and (proveedor.pairs(lats[tour[0]], lons[tour[0]], lats[tour[1]], lons[tour[1]]) >
+                          proveedor.pairs(lats[tour[0]], lons[tour[0]], lats[tour[-1]], lons[tour[-1]])):
+        tour = np.r_[tour[:1], tour[1:][::-1]]
+    return tour
+
+def _resolver_ruta_por_bloques(lats, lons, random_seed, force_fallback, vehiculo_id, metodo_tsp='sa',
+                               max_nodos=MAX_NODOS_BLOQUE, presupuesto_s=None, proveedor=HAVERSINE, disperso=False,
+                               **opciones):
+    """
+    Resuelve una ruta sin matriz global; `lats`/`lons` son los del depósito (posición 0) y sus
+    paradas. Hasta `max_nodos` nodos se resuelve un único TSP con su propia matriz. Si no, las
+    paradas se parten por ángulo polar en bloques de a lo sumo `max_nodos`, cada bloque se resuelve
+    por separado y se encadenan en orden de barrido, así que el coste crece linealmente con la ruta.
+    Con `disperso` y un solver de SOLVERS_DISPERSOS cada bloque se resuelve sobre un CandidateGraph
+    (ver `_resolver_ruta_dispersa`) en lugar de su matriz.
+    Devuelve (permutación, distancia, info) como `_resolver_ruta`.
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+
+    def resolver(posiciones, presupuesto):
+        if disperso and metodo_tsp in SOLVERS_DISPERSOS:
+            return _resolver_ruta_dispersa(lats[posiciones], lons[posiciones], random_seed, force_fallback, vehiculo_id,
+                                           metodo_tsp, presupuesto, proveedor, **opciones)
+        return _resolver_ruta(proveedor.matrix(lats[posiciones], lons[posiciones]), random_seed, force_fallback,
+                              vehiculo_id, metodo_tsp, presupuesto_s=presupuesto, **opciones)
+
+    if n <= max_nodos:
+        return resolver(np.arange(n), presupuesto_s)
+    orden = _orden_barrido(lats, lons, 0, np.arange(1, n))
+    recorrido = [np.zeros(1, dtype=np.intp)]
+    info = {"solver": metodo_tsp, "fallback": False, "tiempo_s": 0.0, "nodos": n, "bloques": 0}
+    for bloque in np.array_split(orden, math.ceil((n - 1) / max_nodos)):
+        presupuesto_bloque = presupuesto_s * len(bloque) / (n - 1) if presupuesto_s is not None else None
+        permutation, _, info_bloque = resolver(bloque, presupuesto_bloque)
+        recorrido.append(_abrir_ciclo(bloque[np.asarray(permutation, dtype=np.intp)], lats, lons, recorrido[-1][-1], proveedor))
+        info["fallback"] |= info_bloque["fallback"]
+        info["tiempo_s"] += info_bloque["tiempo_s"]
+        info["bloques"] += 1
+    if info["fallback"]:
+        info["solver"] = 'nn'
+    recorrido = np.concatenate(recorrido)
+    siguiente = np.roll(recorrido, -1)
+    distancia = float(proveedor.pairs(lats[recorrido], lons[recorrido], lats[siguiente], lons[siguiente]).sum())
+    return recorrido.tolist(), distancia, info
+
+# --- Resolución en paralelo ---
+# Los workers leen la matriz global desde memoria compartida (`DistanceStore.compartir`) en lugar de
+# recibir una copia por ruta, y la cancelación les llega por un evento del pool.
+ESPERA_CANCELACION_S = 0.2  # Cada cuánto se revisa la cancelación mientras los workers resuelven
+_distancias_worker = None
+_parar_worker = None
+
+def _iniciar_worker(evento, argumentos_matriz=None):
+    global _distancias_worker, _parar_worker
+    _parar_worker = evento
+    _distancias_worker = DistanceStore.adjuntar(*argumentos_matriz) if argumentos_matriz else None
+
+def _resolver_ruta_en_worker(vehiculo_id, nodos_ruta, random_seed, force_fallback, metodo_tsp, presupuesto_s):
+    return _resolver_ruta(_distancias_worker.submatrix(nodos_ruta), random_seed, force_fallback, vehiculo_id, metodo_tsp,
+                          presupuesto_s=presupuesto_s, cancel_event=_parar_worker)
+
+def _resolver_ruta_por_bloques_en_worker(*argumentos):
+    return _resolver_ruta_por_bloques(*argumentos, cancel_event=_parar_worker)
+
+def _esperar_rutas(futuros, evento, al_terminar, cancel_event):
+    """
+    Llama a `al_terminar(v_id, solución)` por cada ruta terminada. Al activarse `cancel_event` las
+    rutas pendientes no empiezan y las que corren devuelven su mejor tour hasta el momento.
+    """
+    pendientes = set(futuros)
+    while pendientes:
+        # Se despierta a menudo para atender la cancelación.
+        hechos, pendientes = wait(pendientes, timeout=ESPERA_CANCELACION_S, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            al_terminar(futuros[futuro], futuro.result())
+        if cancel_event is not None and cancel_event.is_set() and not evento.is_set():
+            evento.set()
+            pendientes = {f for f in pendientes if not f.cancel()}
+
+def _resolver_rutas_en_paralelo(distancias, rutas, random_seed, force_fallback, metodo_tsp, presupuestos, n_workers,
+                                al_terminar, cancel_event=None):
+    """Resuelve las rutas en procesos con la matriz en memoria compartida; `al_terminar(v_id, solución)` por ruta."""
+    # 'spawn' evita hacer fork de un proceso con hilos (p. ej. el servidor de Streamlit).
+    contexto = multiprocessing.get_context('spawn')
+    evento = contexto.Event()
+    with distancias.compartir() as argumentos_matriz, \
+            ProcessPoolExecutor(max_workers=min(n_workers, len(rutas)), mp_context=contexto,
+                                initializer=_iniciar_worker, initargs=(evento, argumentos_matriz)) as executor:
+        futuros = {executor.submit(_resolver_ruta_en_worker, v_id, nodos, random_seed, force_fallback,
+                                   metodo_tsp, presupuestos[v_id]): v_id
+                   for v_id, nodos in rutas.items()}
+        _esperar_rutas(futuros, evento, al_terminar, cancel_event)
+
+def _resolver_rutas_por_bloques_en_paralelo(lats, lons, rutas, random_seed, force_fallback, metodo_tsp, presupuestos,
+                                            n_workers, max_nodos, proveedor, disperso, al_terminar, cancel_event=None):
+    # Sin matriz global: cada worker recibe solo las coordenadas de su ruta.
+    contexto = multiprocessing.get_context('spawn')
+    evento = contexto.Event()
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(rutas)), mp_context=contexto,
+                             initializer=_iniciar_worker, initargs=(evento,)) as executor:
+        futuros = {executor.submit(_resolver_ruta_por_bloques_en_worker, lats[nodos], lons[nodos], random_seed,
+                                   force_fallback, v_id, metodo_tsp, max_nodos, presupuestos[v_id], proveedor,
+                                   disperso): v_id
+                   for v_id, nodos in rutas.items()}
+        _esperar_rutas(futuros, evento, al_terminar, cancel_event)
+
+def _repartir_presupuesto(rutas, presupuesto_s, presupuesto_por_ruta):
+    """Presupuesto de cada ruta: el mismo para todas o el total repartido según su número de paradas."""
+    if presupuesto_s is None or presupuesto_por_ruta:
+        return {v_id: presupuesto_s for v_id in rutas}
+    total_paradas = sum(len(nodos) - 1 for nodos in rutas.values())
+    return {v_id: presupuesto_s * (len(nodos) - 1) / total_paradas for v_id, nodos in rutas.items()}
+
+class RouteResult(Mapping):
+    """
+    Resultado de una ruta con `__slots__`: se lee como el dict de antes (`r['distancia_km']`,
+    `r.get(...)`, `dict(r)`, `pd.DataFrame(resultados)`) pero sin un diccionario por ruta.
+    """
+
+    __slots__ = CAMPOS_RUTA
+
+    def __init__(self, **campos):
+        for campo in CAMPOS_RUTA:
+            setattr(self, campo, campos.get(campo))
+
+    def __getitem__(self, campo):
+        if campo not in CAMPOS_RUTA:
+            raise KeyError(campo)
+        return getattr(self, campo)
+
+    def __iter__(self):
+        return iter(CAMPOS_RUTA)
+
+    def __len__(self):
+        return len(CAMPOS_RUTA)
+
+    def __repr__(self):
+        return f"RouteResult({dict(self)!r})"
+
+def _resultado_ruta(vehiculo_id, capacidad, total_demanda, dist_km, costo_km, velocidad_kmh, secuencia_ids,
+                    solver=None, fallback=False):
+    return RouteResult(
+        vehiculo_id=vehiculo_id, capacidad=int(capacidad), total_demanda=int(total_demanda),
+        capacidad_utilizada_pct=(total_demanda / capacidad) * 100, distancia_km=dist_km,
+        costo_estimado=dist_km * costo_km, tiempo_estimado_h=dist_km / velocidad_kmh if velocidad_kmh > 0 else 0,
+        secuencia_paradas_ids=secuencia_ids, solver=solver, fallback=bool(fallback)
+    )
+
+def _depende_del_reloj(metodo_tsp, presupuesto_s, portafolio):
+    """Si el tour puede depender del tiempo de reloj (presupuesto o corte del portafolio por gap)."""
+    return ((presupuesto_s is not None and metodo_tsp != 'nn')
+            or (metodo_tsp == 'portfolio' and portafolio.gap_objetivo is not None))
+
+def _ordenar_resultados(resultados):
     # --- LÍNEA CORREGIDA ---
     # Se cambia el split de '_' a ' ' para que coincida con el formato "Vehículo 1"
     return sorted(resultados, key=lambda x: int(x['vehiculo_id'].split(' ')[-1]))
+
+def run_optimization(paradas_df, vehiculos_df, costo_km, velocidad_kmh, random_seed, force_fallback=False, n_workers=None,
+                     metodo_tsp='sa', presupuesto_s=None, presupuesto_por_ruta=False, progress_callback=None,
+                     cancel_event=None, cache=None, asignacion='greedy', max_nodos_ruta=MAX_NODOS_BLOQUE, proveedor=None,
+                     telemetria=None, route_callback=None, portafolio=None, disperso=False, distancias=None):
+    """
+    `metodo_tsp` elige el solver de cada ruta (ver `solve_tsp_with_fallback`).
+    `asignacion` elige cómo se reparten las paradas: 'greedy' (la más cercana que cabe, con la
+    matriz de distancias global), 'sweep' (barrido por ángulo polar) o 'savings' (ahorros de
+    Clarke-Wright sobre pares de vecinos cercanos, ver `_asignar_por_ahorros`). Con 'sweep' y
+    'savings' cada ruta se resuelve en bloques de a lo sumo `max_nodos_ruta` nodos sin construir la
+    matriz global, para instancias de decenas de miles de paradas.
+    Con `disperso` ningún paso construye una matriz n×n: la greedy no usa la matriz global y cada
+    ruta (o bloque) se resuelve sobre un `distances.CandidateGraph` de k vecinos con distancias
+    exactas bajo demanda si el solver está en SOLVERS_DISPERSOS ('local_search', 'anytime', 'nn'); los
+    demás resuelven por bloques con su propia matriz. La memoria crece linealmente con las paradas.
+    `proveedor` es el proveedor de distancias (ver `distances`); por defecto, haversine.
+    `n_workers` > 1 resuelve las rutas de cada vehículo en un pool de procesos. Cada ruta se
+    siembra con `random_seed`, así que el resultado es el mismo que en modo secuencial.
+    `presupuesto_s` es el tiempo de reloj total de la ejecución, repartido entre rutas según su
+    tamaño, o el de cada ruta si `presupuesto_por_ruta`. En modo secuencial, `progress_callback`
+    recibe (vehiculo_id, iteracion, mejor_distancia, transcurrido_s). `cancel_event` hace que cada
+    ruta devuelva su mejor tour hasta el momento ('local_search' y los 'anytime'); en paralelo llega a
+    los workers y las rutas que aún no empezaron se descartan.
+    `route_callback` recibe cada ruta del resultado en cuanto se resuelve, también en paralelo.
+    Con metodo_tsp='portfolio' las rutas se resuelven una tras otra y los `n_workers` procesos se
+    usan para los intentos de cada ruta; `portafolio` (un PortfolioSolver) configura semillas,
+    estrategias y gap objetivo.
+    Con `cache` (un SolutionCache) una instancia ya resuelta con los mismos datos y parámetros
+    se devuelve sin recalcular. Las ejecuciones cuyo resultado depende del reloj (con `presupuesto_s`
+    o un portafolio con gap objetivo) no se guardan ni se leen: otra ejecución con el mismo
+    presupuesto puede encontrar otro tour; solo se reutiliza su matriz de distancias.
+    `distancias` (un DistanceStore de estas mismas paradas) evita recalcular la matriz global;
+    `scenarios.run_scenarios` lo usa para compartirla entre escenarios.
+    Con `telemetria` (un `utils.Telemetria`) se registran los tiempos de las fases 'cache',
+    'matriz', 'asignacion' y 'tsp', los contadores y el solver, tiempo y fallback de cada ruta.
+    Cada ruta del resultado indica además qué 'solver' la resolvió y si hubo 'fallback'.
+    """
+    if metodo_tsp == 'portfolio' and portafolio is None:
+        argumentos = dict(locals())
+        # Un solo pool de procesos para los intentos de todas las rutas de la ejecución.
+        with PortfolioSolver(n_workers=n_workers) as portafolio:
+            return run_optimization(**{**argumentos, 'portafolio': portafolio})
+    logger.info("Iniciando optimización de rutas.")
+    telemetria = telemetria or Telemetria()
+    if asignacion not in ASIGNACIONES:
+        raise ValueError(f"Asignación desconocida: {asignacion}. Opciones: {', '.join(ASIGNACIONES)}")
+    proveedor = proveedor or HAVERSINE
+    tabla = StopTable.of(paradas_df)
+    if tabla.depot_pos is None:
+        raise ValueError("La tabla de paradas no tiene depósito.")
+    reutilizar = cache is not None and not _depende_del_reloj(metodo_tsp, presupuesto_s, portafolio)
+    if reutilizar:
+        clave = instance_fingerprint(tabla, vehiculos_df, costo_km=costo_km, velocidad_kmh=velocidad_kmh,
+                                     random_seed=random_seed, force_fallback=force_fallback, metodo_tsp=metodo_tsp,
+                                     presupuesto_s=presupuesto_s, presupuesto_por_ruta=presupuesto_por_ruta,
+                                     asignacion=asignacion, max_nodos_ruta=max_nodos_ruta, distancias=proveedor.clave,
+                                     **({'portafolio': portafolio.clave} if metodo_tsp == 'portfolio' else {}),
+                                     **({'disperso': True} if disperso else {}))
+        with telemetria.fase('cache'):
+            resultados = cache.get(clave)
+        if resultados is not None:
+            logger.info(f"Resultado recuperado de la caché ({len(resultados)} rutas).")
+            telemetria.contar('cache_hits')
+            if route_callback:
+                for ruta in resultados:
+                    route_callback(ruta)
+            return resultados
+        telemetria.contar('cache_misses')
+    es_depot, depot_pos, ids, lats, lons = tabla.es_depot, tabla.depot_pos, tabla.ids, tabla.lat, tabla.lon
+    demandas = tabla.demanda.astype(np.float64, copy=False)
+    capacidades = dict(zip(vehiculos_df['id'], vehiculos_df['capacidad']))
+    if asignacion == 'sweep':
+        with telemetria.fase('asignacion'):
+            asignaciones = _asignar_por_barrido(lats, lons, demandas, depot_pos, np.flatnonzero(~es_depot), capacidades.items())
+    elif asignacion == 'savings':
+        with telemetria.fase('asignacion'):
+            asignaciones = _asignar_por_ahorros(lats, lons, demandas, depot_pos, np.flatnonzero(~es_depot),
+                                                capacidades.items(), proveedor)
+    elif disperso:
+        distancia = (lambda origen, destinos: proveedor.pairs(lats[origen], lons[origen], lats[destinos], lons[destinos])
+                     if proveedor is not HAVERSINE else None)
+        with telemetria.fase('asignacion'):
+            asignaciones = _asignar_por_posicion(lats, lons, demandas, depot_pos, np.flatnonzero(~es_depot),
+                                                 capacidades.items(), distancia)
+    else:
+        # Cada distancia se calcula una sola vez por ejecución; la asignación y cada ruta la leen de aquí.
+        if distancias is None:
+            with telemetria.fase('matriz'):
+                distancias = DistanceStore(tabla, cache=cache, proveedor=proveedor)
+        distancia = distancias.desde if proveedor is not HAVERSINE else None
+        with telemetria.fase('asignacion'):
+            asignaciones = _asignar_por_posicion(lats, lons, demandas, depot_pos, np.flatnonzero(~es_depot),
+                                                 capacidades.items(), distancia)
+    rutas = {v_id: np.array([depot_pos] + posiciones, dtype=np.intp) for v_id, posiciones in asignaciones.items() if posiciones}
+    presupuestos = _repartir_presupuesto(rutas, presupuesto_s, presupuesto_por_ruta)
+    paralelo = n_workers and n_workers > 1 and len(rutas) > 1 and metodo_tsp != 'portfolio'
+    opciones_tsp = {'portafolio': portafolio} if metodo_tsp == 'portfolio' else {}
+    if paralelo and progress_callback:
+        logger.info("El progreso por iteración no está disponible en modo paralelo; solo se informa cada ruta terminada.")
+    resultados = []
+
+    def terminar_ruta(vehiculo_id, solucion):
+        permutation, dist_km, info = solucion
+        nodos_ruta = rutas[vehiculo_id]
+        permutation = list(permutation)
+        start_idx = permutation.index(0)
+        secuencia_final = nodos_ruta[permutation[start_idx:] + permutation[:start_idx]]
+        resultados.append(_resultado_ruta(vehiculo_id, capacidades[vehiculo_id], demandas[nodos_ruta[1:]].sum(), dist_km,
+                                          costo_km, velocidad_kmh, [ids[p] for p in secuencia_final if p != depot_pos],
+                                          info['solver'], info['fallback']))
+        telemetria.registrar_ruta(vehiculo_id, **info)
+        telemetria.contar('fallbacks', int(info['fallback']))
+        if route_callback:
+            route_callback(resultados[-1])
+
+    with telemetria.fase('tsp'):
+        if asignacion in ASIGNACIONES_SIN_MATRIZ or disperso:
+            if paralelo:
+                logger.info(f"Resolviendo {len(rutas)} rutas por bloques en paralelo con {n_workers} procesos.")
+                _resolver_rutas_por_bloques_en_paralelo(lats, lons, rutas, random_seed, force_fallback, metodo_tsp,
+                                                        presupuestos, n_workers, max_nodos_ruta, proveedor, disperso,
+                                                        terminar_ruta, cancel_event)
+            else:
+                for v_id, nodos in rutas.items():
+                    callback_ruta = functools.partial(progress_callback, v_id) if progress_callback else None
+                    terminar_ruta(v_id, _resolver_ruta_por_bloques(lats[nodos], lons[nodos], random_seed, force_fallback,
+                                                                   v_id, metodo_tsp, max_nodos_ruta, presupuestos[v_id],
+                                                                   proveedor, disperso, progress_callback=callback_ruta,
+                                                                   cancel_event=cancel_event, **opciones_tsp))
+        else:
+            if paralelo:
+                logger.info(f"Resolviendo {len(rutas)} rutas en paralelo con {n_workers} procesos.")
+                _resolver_rutas_en_paralelo(distancias, rutas, random_seed, force_fallback, metodo_tsp, presupuestos,
+                                            n_workers, terminar_ruta, cancel_event)
+            else:
+                for v_id, nodos in rutas.items():
+                    callback_ruta = functools.partial(progress_callback, v_id) if progress_callback else None
+                    terminar_ruta(v_id, _resolver_ruta(distancias.submatrix(nodos), random_seed, force_fallback, v_id,
+                                                       metodo_tsp, presupuesto_s=presupuestos[v_id],
+                                                       progress_callback=callback_ruta, cancel_event=cancel_event,
+                                                       **opciones_tsp))
+    telemetria.contar('rutas', len(resultados))
+    telemetria.contar('paradas', int((~es_depot).sum()))
+    logger.info(f"Optimización finalizada. Se generaron {len(resultados)} rutas "
+                f"({telemetria.contadores['fallbacks']} con fallback); tiempos: "
+                + ", ".join(f"{fase}={t:.2f}s" for fase, t in telemetria.fases.items()))
+    resultados = _ordenar_resultados(resultados)
+    # Una ejecución cancelada no es reproducible, así que no se guarda.
+    if reutilizar and not (cancel_event is not None and cancel_event.is_set()):
+        cache.put(clave, resultados)
+    return resultados
+
+# --- Re-optimización incremental ---
+
+def _mejor_insercion(lats, lons, ruta, parada, proveedor=HAVERSINE):
+    """(coste, posición) de la inserción más barata de `parada` en el ciclo `ruta` (posiciones, depósito primero)."""
+    siguiente = np.roll(ruta, -1)
+    delta = (proveedor.pairs(lats[ruta], lons[ruta], lats[parada], lons[parada]) +
+             proveedor.pairs(lats[parada], lons[parada], lats[siguiente], lons[siguiente]) -
+             proveedor.pairs(lats[ruta], lons[ruta], lats[siguiente], lons[siguiente]))
+    k = int(np.argmin(delta))
+    return float(delta[k]), k + 1
+
+def _reoptimizar_ruta(lats, lons, ruta, max_iter=None, proveedor=HAVERSINE):
+    """Mejora una ruta con 2-opt/Or-opt sobre su propia matriz; devuelve (ruta empezando en el depósito, distancia)."""
+    tour, dist_km = improve_tour(np.arange(len(ruta)), proveedor.matrix(lats[ruta], lons[ruta]), max_iter=max_iter)
+    inicio = tour.index(0)
+    return ruta[tour[inicio:] + tour[:inicio]], dist_km
+
+def update_routes(resultados, paradas_df, vehiculos_df, costo_km, velocidad_kmh, nuevas_paradas=None, eliminadas=(),
+                  max_iter=None, proveedor=None):
+    """
+    Repara una solución existente tras añadir y/o cancelar paradas, sin resolver todo de nuevo.
+    `paradas_df` es la tabla (DataFrame o StopTable) usada para obtener `resultados` (con el depósito), `nuevas_paradas`
+    un DataFrame con las paradas a añadir ('id', 'lat', 'lon', 'demanda') y `eliminadas` los ids
+    a quitar. Cada parada nueva (de mayor a menor demanda) se inserta donde menos distancia añade,
+    entre los vehículos con capacidad restante suficiente, incluidos los que no tenían ruta.
+    Solo las rutas afectadas se re-optimizan con 2-opt/Or-opt (`max_iter` limita las pasadas).
+    `proveedor` es el proveedor de distancias (por defecto, haversine). Un id nuevo repetido o que ya
+    está en la tabla (y no se elimina) lanza ValueError.
+    Devuelve (resultados, StopTable actualizada, ids de paradas nuevas que no cupieron).
+    """
+    proveedor = proveedor or HAVERSINE
+    eliminadas = set(eliminadas)
+    tabla = StopTable.of(paradas_df).without_ids(eliminadas)
+    if nuevas_paradas is not None and len(nuevas_paradas):
+        nuevos_ids = nuevas_paradas['id']
+        repetidos = sorted({str(pid) for pid in nuevos_ids[nuevos_ids.duplicated()]} |
+                           {str(pid) for pid in nuevos_ids if pid in tabla.posicion})
+        if repetidos:
+            raise ValueError(f"Ids de paradas nuevas repetidos o ya existentes: {', '.join(repetidos)}")
+        tabla = tabla.concat(StopTable.from_dataframe(nuevas_paradas.assign(is_depot=False)))
+    depot_pos, ids, lats, lons = tabla.depot_pos, tabla.ids, tabla.lat, tabla.lon
+    demandas = tabla.demanda.astype(np.float64, copy=False)
+    posicion = tabla.posicion
+
+    capacidades = dict(zip(vehiculos_df['id'], vehiculos_df['capacidad']))
+    anteriores = {r['vehiculo_id']: r for r in resultados}
+    rutas, afectadas = {}, set()
+    for vehiculo_id in capacidades:
+        secuencia = anteriores[vehiculo_id]['secuencia_paradas_ids'] if vehiculo_id in anteriores else []
+        restantes = [posicion[pid] for pid in secuencia if pid not in eliminadas]
+        if len(restantes) != len(secuencia):
+            afectadas.add(vehiculo_id)
+        rutas[vehiculo_id] = np.array([depot_pos] + restantes, dtype=np.intp)
+    cargas = {v_id: demandas[ruta[1:]].sum() for v_id, ruta in rutas.items()}
+
+    sin_asignar = []
+    if nuevas_paradas is not None and len(nuevas_paradas):
+        nuevas_pos = np.array([posicion[pid] for pid in nuevas_paradas['id']], dtype=np.intp)
+        for parada in nuevas_pos[np.argsort(-demandas[nuevas_pos], kind='stable')]:
+            mejor = None
+            for vehiculo_id, ruta in rutas.items():
+                if cargas[vehiculo_id] + demandas[parada] > capacidades[vehiculo_id]:
+                    continue
+                coste, k = _mejor_insercion(lats, lons, ruta, parada, proveedor)
+                if mejor is None or coste < mejor[0]:
+                    mejor = (coste, vehiculo_id, k)
+            if mejor is None:
+                sin_asignar.append(ids[parada])
+                continue
+            _, vehiculo_id, k = mejor
+            rutas[vehiculo_id] = np.insert(rutas[vehiculo_id], k, parada)
+            cargas[vehiculo_id] += demandas[parada]
+            afectadas.add(vehiculo_id)
+    if sin_asignar:
+        logger.warning(f"{len(sin_asignar)} paradas nuevas no caben en ningún vehículo: {', '.join(map(str, sin_asignar))}")
+
+    nuevos = []
+    for vehiculo_id, ruta in rutas.items():
+        if len(ruta) == 1:
+            continue
+        if vehiculo_id not in afectadas:
+            nuevos.append(anteriores[vehiculo_id])
+            continue
+        ruta, dist_km = _reoptimizar_ruta(lats, lons, ruta, max_iter, proveedor)
+        nuevos.append(_resultado_ruta(vehiculo_id, capacidades[vehiculo_id], cargas[vehiculo_id], dist_km, costo_km,
+                                      velocidad_kmh, [ids[p] for p in ruta[1:]], 'local_search'))
+    logger.info(f"Rutas actualizadas: {len(afectadas)} re-optimizadas, {len(sin_asignar)} paradas sin asignar.")
+    return _ordenar_resultados(nuevos), tabla, sin_asignar
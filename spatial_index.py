@@ -0,0 +1,140 @@
+import numpy as np
+
+def to_unit_xyz(lats, lons):
+    """Convierte lat/lon en grados a coordenadas cartesianas sobre la esfera unitaria."""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+class SpatialIndex:
+    """
+    Índice espacial en rejilla uniforme sobre coordenadas 3D de la esfera unitaria.
+    Admite borrar puntos y consultar los k más cercanos cuya demanda cabe en una capacidad dada.
+    La distancia de cuerda en 3D es monótona con la distancia haversine, así que el orden de
+    vecinos es el mismo. Los empates se resuelven por el índice del punto (el menor gana).
+    """
+    MAX_ANILLOS = 6  # Anillos de celdas a explorar antes de pasar a fuerza bruta
+    BLOQUE_DISTANCIAS = 1 << 18  # Distancias por bloque en `vecinos_cercanos`, para acotar la memoria temporal
+
+    def __init__(self, lats, lons, demandas=None, puntos_por_celda=4):
+        self.xyz = to_unit_xyz(lats, lons)
+        n = len(self.xyz)
+        self.demandas = np.zeros(n) if demandas is None else np.asarray(demandas, dtype=np.float64)
+        self.vivos = np.ones(n, dtype=bool)
+        self.n_vivos = n
+        self.origen = self.xyz.min(axis=0) if n else np.zeros(3)
+        extension = max(float(np.ptp(self.xyz, axis=0).max()) if n else 0.0, 1e-9)
+        # Los puntos están sobre una superficie, así que la celda se dimensiona como para un área.
+        self.lado = extension / max(np.sqrt(n / puntos_por_celda), 1.0)
+        celdas = self._celda(self.xyz)
+        self.dims = celdas.max(axis=0) + 1 if n else np.ones(3, dtype=np.int64)
+        claves = self._clave(celdas)
+        self.orden = np.argsort(claves, kind='stable')
+        self.claves, self.inicios = np.unique(claves[self.orden], return_index=True)
+        self.fines = np.r_[self.inicios[1:], n]
+        self._por_demanda = np.argsort(self.demandas, kind='stable')
+        self._cursor_demanda = 0
+        self._desplazamientos = {}
+
+    def __len__(self):
+        return self.n_vivos
+
+    def _celda(self, xyz):
+        return np.floor((xyz - self.origen) / self.lado).astype(np.int64)
+
+    def _clave(self, celdas):
+        return (celdas[:, 0] * self.dims[1] + celdas[:, 1]) * self.dims[2] + celdas[:, 2]
+
+    def _anillo(self, r):
+        """Desplazamientos de celda a distancia de Chebyshev exactamente r."""
+        if r not in self._desplazamientos:
+            cubo = np.indices((2 * r + 1,) * 3).reshape(3, -1).T - r
+            self._desplazamientos[r] = cubo[np.abs(cubo).max(axis=1) == r]
+        return self._desplazamientos[r]
+
+    def _candidatos(self, celda, r):
+        celdas = celda + self._anillo(r)
+        celdas = celdas[np.all((celdas >= 0) & (celdas < self.dims), axis=1)]
+        if len(celdas) == 0:
+            return np.empty(0, dtype=np.intp)
+        claves = self._clave(celdas)
+        pos = np.minimum(np.searchsorted(self.claves, claves), len(self.claves) - 1)
+        pos = pos[self.claves[pos] == claves]
+        if len(pos) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self.orden[self.inicios[p]:self.fines[p]] for p in pos])
+
+    def demanda_minima(self):
+        """Menor demanda entre los puntos vivos (inf si no queda ninguno)."""
+        while self._cursor_demanda < len(self._por_demanda) and not self.vivos[self._por_demanda[self._cursor_demanda]]:
+            self._cursor_demanda += 1
+        if self._cursor_demanda == len(self._por_demanda):
+            return np.inf
+        return self.demandas[self._por_demanda[self._cursor_demanda]]
+
+    def eliminar(self, indice):
+        if self.vivos[indice]:
+            self.vivos[indice] = False
+            self.n_vivos -= 1
+
+    def consultar(self, lat, lon, k=1, demanda_max=np.inf):
+        """Índices de hasta `k` puntos vivos con demanda <= `demanda_max`, del más cercano al más lejano."""
+        return self.consultar_xyz(to_unit_xyz([lat], [lon])[0], k, demanda_max)
+
+    def consultar_xyz(self, q, k=1, demanda_max=np.inf):
+        """Como `consultar`, con el punto de consulta ya en coordenadas de la esfera unitaria."""
+        if self.n_vivos == 0 or self.demanda_minima() > demanda_max:
+            return np.empty(0, dtype=np.intp)
+        celda = np.floor((q - self.origen) / self.lado).astype(np.int64)
+        mejores, mejores_d = np.empty(0, dtype=np.intp), np.empty(0)
+        for r in range(self.MAX_ANILLOS + 1):
+            cand = self._candidatos(celda, r)
+            cand = cand[self.vivos[cand] & (self.demandas[cand] <= demanda_max)]
+            if cand.size:
+                mejores = np.concatenate([mejores, cand])
+                mejores_d = np.concatenate([mejores_d, np.sum((self.xyz[cand] - q) ** 2, axis=1)])
+                sel = np.lexsort((mejores, mejores_d))[:k]
+                mejores, mejores_d = mejores[sel], mejores_d[sel]
+            # Todo punto no explorado está al menos a r celdas de distancia.
+            if len(mejores) == k and mejores_d[-1] <= (r * self.lado) ** 2:
+                return mejores
+        cand = np.flatnonzero(self.vivos & (self.demandas <= demanda_max))
+        d = np.sum((self.xyz[cand] - q) ** 2, axis=1)
+        return cand[np.lexsort((cand, d))[:k]]
+
+    def vecinos_cercanos(self, k):
+        """
+        Matriz (n, k) con los `k` vecinos más cercanos de cada punto (sin él mismo), del más cercano al
+        más lejano. Ignora bajas y demandas. Cada celda
+        se resuelve de una vez contra su celda y las adyacentes; los puntos cuyo k-ésimo vecino podría
+        estar más lejos se consultan uno a uno.
+        """
+        n = len(self.xyz)
+        k = max(min(k, n - 1), 0)
+        vecinos = np.empty((n, k), dtype=np.intp)
+        if k == 0:
+            return vecinos
+        celdas = self._celda(self.xyz)
+        pendientes = []
+        for p in range(len(self.claves)):
+            puntos = self.orden[self.inicios[p]:self.fines[p]]
+            cand = np.sort(np.concatenate([self._candidatos(celdas[puntos[0]], r) for r in (0, 1)]))
+            if len(cand) <= k:
+                pendientes.extend(puntos.tolist())
+                continue
+            paso = max(self.BLOQUE_DISTANCIAS // len(cand), 1)
+            for inicio in range(0, len(puntos), paso):
+                sub = puntos[inicio:inicio + paso]
+                d = np.sum((self.xyz[sub, None, :] - self.xyz[None, cand, :]) ** 2, axis=2)
+                d[sub[:, None] == cand[None, :]] = np.inf
+                orden = np.argpartition(d, k - 1, axis=1)[:, :k]
+                orden = np.take_along_axis(orden, np.argsort(np.take_along_axis(d, orden, axis=1), axis=1, kind='stable'), axis=1)
+                vecinos[sub] = cand[orden]
+                # Todo punto fuera de las celdas adyacentes está al menos a un lado de celda.
+                lejanos = np.take_along_axis(d, orden[:, -1:], axis=1)[:, 0] > self.lado ** 2
+                pendientes.extend(sub[lejanos].tolist())
+        for i in pendientes:
+            cercanos = self.consultar_xyz(self.xyz[i], k=k + 1)
+            vecinos[i] = cercanos[cercanos != i][:k]
+        return vecinos
@@ -0,0 +1,104 @@
+"""
+Tabla compacta de paradas compartida por solver y visualización.
+
+`StopTable` guarda las paradas de una ejecución en arrays contiguos de NumPy (ids, lat, lon,
+demanda, es_depot) con un mapa id -> posición que se construye una sola vez. Se crea al lanzar la
+optimización y la reciben `run_optimization`, el mapa y los informes, en lugar de que cada capa
+vuelva a extraer columnas, indexar por id o filtrar el DataFrame por vehículo.
+"""
+import numpy as np
+import pandas as pd
+
+COLUMNAS = ('id', 'lat', 'lon', 'demanda', 'is_depot')
+
+class StopTable:
+    """Paradas en arrays contiguos; `tabla['lat']` devuelve el array de la columna como en un DataFrame."""
+
+    __slots__ = ('ids', 'lat', 'lon', 'demanda', 'es_depot', '_posicion')
+
+    def __init__(self, ids, lat, lon, demanda, es_depot=None):
+        self.ids = np.asarray(ids)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        demanda = np.asarray(demanda)
+        # Se conserva la demanda entera tal cual (los informes la muestran sin decimales).
+        self.demanda = demanda if demanda.dtype.kind in 'iuf' else demanda.astype(np.float64)
+        self.es_depot = np.zeros(len(self.ids), dtype=bool) if es_depot is None else np.asarray(es_depot, dtype=bool)
+        self._posicion = None
+
+    @classmethod
+    def from_dataframe(cls, paradas_df):
+        es_depot = paradas_df['is_depot'].to_numpy(dtype=bool) if 'is_depot' in paradas_df else None
+        return cls(paradas_df['id'].to_numpy(), paradas_df['lat'].to_numpy(dtype=np.float64),
+                   paradas_df['lon'].to_numpy(dtype=np.float64), paradas_df['demanda'].to_numpy(), es_depot)
+
+    @classmethod
+    def of(cls, paradas):
+        """La misma tabla si ya es una `StopTable`; si no, la construye desde un DataFrame."""
+        return paradas if isinstance(paradas, cls) else cls.from_dataframe(paradas)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, columna):
+        if columna not in COLUMNAS:
+            raise KeyError(columna)
+        return self.ids if columna == 'id' else self.es_depot if columna == 'is_depot' else getattr(self, columna)
+
+    def __contains__(self, columna):
+        return columna in COLUMNAS
+
+    @property
+    def empty(self):
+        return len(self.ids) == 0
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ids, self.lat, self.lon, self.demanda, self.es_depot))
+
+    @property
+    def depot_pos(self):
+        depositos = np.flatnonzero(self.es_depot)
+        return int(depositos[0]) if len(depositos) else None
+
+    @property
+    def clientes(self):
+        """Posiciones de las paradas que no son depósito."""
+        return np.flatnonzero(~self.es_depot)
+
+    @property
+    def posicion(self):
+        """Mapa id -> posición (la primera si un id se repite), construido una sola vez."""
+        if self._posicion is None:
+            n = len(self.ids)
+            self._posicion = dict(zip(self.ids[::-1].tolist(), range(n - 1, -1, -1)))
+        return self._posicion
+
+    def posiciones(self, ids, faltante=None):
+        """Posiciones de `ids` en orden; los que no están se omiten o, con `faltante`, se devuelven con ese valor."""
+        posicion = self.posicion
+        if faltante is None:
+            return np.fromiter((posicion[pid] for pid in ids if pid in posicion), dtype=np.intp)
+        return np.fromiter((posicion.get(pid, faltante) for pid in ids), dtype=np.intp)
+
+    def take(self, posiciones):
+        posiciones = np.asarray(posiciones, dtype=np.intp)
+        return StopTable(self.ids[posiciones], self.lat[posiciones], self.lon[posiciones], self.demanda[posiciones],
+                         self.es_depot[posiciones])
+
+    def without_ids(self, ids):
+        """Tabla sin las paradas con esos ids (todas sus apariciones)."""
+        ids = set(ids)
+        if not ids:
+            return self
+        return self.take(np.flatnonzero([pid not in ids for pid in self.ids.tolist()]))
+
+    def concat(self, otra):
+        otra = StopTable.of(otra)
+        return StopTable(np.concatenate([self.ids, otra.ids]), np.concatenate([self.lat, otra.lat]),
+                         np.concatenate([self.lon, otra.lon]), np.concatenate([self.demanda, otra.demanda]),
+                         np.concatenate([self.es_depot, otra.es_depot]))
+
+    def to_dataframe(self):
+        return pd.DataFrame({'id': self.ids, 'lat': self.lat, 'lon': self.lon, 'demanda': self.demanda,
+                             'is_depot': self.es_depot})
@@ -1,11 +1,17 @@
+import hashlib
+import os
 import streamlit as st
+import numpy as np
 import pandas as pd
-from utils import init_session_state, get_logger
+from utils import Telemetria, init_session_state, install_streamlit_log_handler
 from io_parser import safe_read_table
-from solver import run_optimization
-from visualization import render_map, render_results_section
-import folium
-from streamlit_folium import st_folium
+from cache import SolutionCache
+from solver import SEMILLAS_PORTAFOLIO, PortfolioSolver
+from scenarios import MAX_VEHICULOS_ESCENARIO, run_scenarios, scenario_grid
+from stops import StopTable
+from jobs import JobManager
+from visualization import (render_depot_picker, render_job_progress, render_map, render_results_section,
+                           render_scenario_comparison, render_telemetry)
 
 # --- Configuración de la Página y Estilos ---
 st.set_page_config(
@@ -34,18 +40,72 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+MAX_ARCHIVOS_SUBIDOS = 8  # Archivos de paradas ya leídos que se conservan (LRU)
+
 # --- Inicializar Estado y Logger ---
 init_session_state()
-logger = get_logger()
+logger = install_streamlit_log_handler()
+
+@st.cache_resource
+def obtener_cache_soluciones():
+    """Caché en disco compartida por todas las sesiones: repetir una instancia no recalcula nada."""
+    return SolutionCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rout2_cache"), guardar_matrices=True)
+
+@st.cache_data(max_entries=MAX_ARCHIVOS_SUBIDOS, show_spinner=False)
+def leer_paradas_subidas(huella, extension, _archivo):
+    """
+    Paradas de un archivo subido. Solo `huella` (hash del contenido) y `extension` (decide el formato)
+    forman la clave: volver a un archivo reciente no lo re-parsea, un archivo editado con el mismo
+    nombre sí. Los avisos de la lectura se repiten en cada acierto. Al llenarse se descarta el
+    archivo usado hace más tiempo.
+    """
+    return safe_read_table(_archivo, on_warning=st.warning)
+
+@st.cache_resource
+def obtener_portafolio(n_semillas, gap_objetivo, n_workers):
+    """Portafolio por configuración; su pool de procesos se reutiliza entre ejecuciones."""
+    return PortfolioSolver(n_semillas=n_semillas, gap_objetivo=gap_objetivo, n_workers=n_workers)
+
+@st.cache_resource
+def obtener_gestor_trabajos():
+    """Trabajos de optimización compartidos por todas las sesiones; siguen corriendo entre reruns y pestañas."""
+    return JobManager(max_workers=2)
+
+def tabla_con_deposito(paradas_df):
+    """Tabla compacta (depósito + paradas) compartida por el solver, el mapa y los informes."""
+    depot = StopTable(np.array(['depot'], dtype=object), [st.session_state.depot_lat], [st.session_state.depot_lon],
+                      [0], [True])
+    return depot.concat(StopTable.from_dataframe(paradas_df))
+
+def nueva_telemetria():
+    """La lectura del archivo se hizo al subirlo; se conserva su tiempo en la nueva telemetría."""
+    telemetria = Telemetria()
+    if st.session_state.telemetria is not None and 'lectura' in st.session_state.telemetria.fases:
+        telemetria.fases['lectura'] = st.session_state.telemetria.fases['lectura']
+    return telemetria
+
+def leer_valores(texto):
+    """Valores numéricos de una lista separada por comas (p. ej. '50, 80, 120')."""
+    valores = [valor.strip() for valor in texto.replace(';', ',').split(',') if valor.strip()]
+    try:
+        return [float(valor) for valor in valores]
+    except ValueError:
+        raise ValueError(f"'{texto}' debe ser una lista de números separados por comas.") from None
 
 # Novedades en el estado de sesión
 if 'depot_lat' not in st.session_state:
     st.session_state.depot_lat = 4.4389
 if 'depot_lon' not in st.session_state:
     st.session_state.depot_lon = -76.1951
-# Variable para controlar el procesamiento del archivo
-if 'last_uploaded_filename' not in st.session_state:
-    st.session_state.last_uploaded_filename = None
+# Subida ya procesada (file_id de Streamlit, nuevo en cada subida) y hash del contenido cargado
+if 'archivo_cargado' not in st.session_state:
+    st.session_state.archivo_cargado = None
+if 'huella_paradas' not in st.session_state:
+    st.session_state.huella_paradas = None
+if 'trabajo_id' not in st.session_state:
+    st.session_state.trabajo_id = st.query_params.get('trabajo')
+if 'comparacion_escenarios' not in st.session_state:
+    st.session_state.comparacion_escenarios = None
 
 # --- Header ---
 st.markdown(
@@ -72,42 +132,35 @@ with tab_config:
         st.subheader("1. Cargar Datos de Paradas (Clientes)")
         uploaded_file = st.file_uploader(
             "Sube un archivo (.csv, .xlsx, .ods) SIN la fila del depósito.",
-            type=['csv', 'xlsx', 'ods']
+            type=['csv', 'xlsx', 'ods', 'parquet', 'arrow', 'feather', 'npz']
         )
         
-        # --- LÓGICA DE CORRECCIÓN CLAVE ---
-        # Solo procesamos el archivo si es uno nuevo.
-        if uploaded_file is not None and uploaded_file.name != st.session_state.last_uploaded_filename:
+        # Cada subida se procesa una vez; la lectura se cachea por contenido (ver `leer_paradas_subidas`).
+        if uploaded_file is not None and uploaded_file.file_id != st.session_state.archivo_cargado:
             try:
-                st.session_state.last_uploaded_filename = uploaded_file.name
-                paradas_df = safe_read_table(uploaded_file)
+                st.session_state.archivo_cargado = uploaded_file.file_id
+                huella = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+                telemetria_lectura = Telemetria()
+                with telemetria_lectura.fase('lectura'):
+                    paradas_df = leer_paradas_subidas(huella, os.path.splitext(uploaded_file.name)[1].lower(), uploaded_file)
+                if huella != st.session_state.huella_paradas:
+                    st.session_state.resultados = None # Limpiar resultados al cargar NUEVOS datos
+                    st.session_state.comparacion_escenarios = None
                 st.session_state.paradas_df = paradas_df
-                st.session_state.resultados = None # Limpiar resultados al cargar NUEVOS datos
+                st.session_state.huella_paradas = huella
+                st.session_state.telemetria = telemetria_lectura
                 st.success(f"Archivo '{uploaded_file.name}' cargado con {len(paradas_df)} paradas.")
             except Exception as e:
                 st.error(f"Error al procesar: {e}")
                 st.session_state.paradas_df = None
-                st.session_state.last_uploaded_filename = None # Resetear en caso de error
+                st.session_state.huella_paradas = None
+                st.session_state.archivo_cargado = None # Resetear en caso de error
 
         st.subheader("2. Definir Ubicación del Depósito")
         st.info("Haz clic en el mapa para establecer el punto de partida y regreso.")
 
-        map_center = [st.session_state.depot_lat, st.session_state.depot_lon]
-        if st.session_state.get('paradas_df') is not None and not st.session_state.paradas_df.empty:
-            map_center = [st.session_state.paradas_df['lat'].mean(), st.session_state.paradas_df['lon'].mean()]
-
-        m_config = folium.Map(location=map_center, zoom_start=12, tiles="cartodbpositron")
-        folium.Marker(
-            [st.session_state.depot_lat, st.session_state.depot_lon],
-            popup="Depósito Actual", tooltip="Depósito",
-            icon=folium.Icon(color="red", icon="warehouse", prefix='fa')
-        ).add_to(m_config)
-
-        if st.session_state.get('paradas_df') is not None:
-            for _, row in st.session_state.paradas_df.iterrows():
-                folium.Marker([row['lat'], row['lon']], tooltip=row.get('id', 'Parada')).add_to(m_config)
-
-        map_data = st_folium(m_config, width='100%', height=400, key="depot_map")
+        map_data = render_depot_picker(st.session_state.get('paradas_df'), st.session_state.depot_lat,
+                                       st.session_state.depot_lon, key="depot_map")
         if map_data and map_data["last_clicked"]:
             st.session_state.depot_lat = map_data["last_clicked"]["lat"]
             st.session_state.depot_lon = map_data["last_clicked"]["lng"]
@@ -126,6 +179,30 @@ with tab_config:
         st.subheader("4. Parámetros de Simulación")
         costo_km = st.number_input("Costo por KM ($)", value=1500.0, format="%.2f", key="costo_km")
         velocidad_kmh = st.number_input("Velocidad (km/h)", value=60.0, format="%.1f", key="velocidad_kmh")
+        metodo_tsp = st.selectbox(
+            "Solver de rutas", options=["local_search", "anytime", "anytime_insercion", "portfolio", "sa", "nn"], key="metodo_tsp",
+            format_func=lambda m: {"local_search": "Búsqueda local 2-opt/Or-opt (rápido)",
+                                   "anytime": "Búsqueda local iterada con límite de tiempo",
+                                   "anytime_insercion": "Búsqueda local iterada desde inserción más lejana",
+                                   "portfolio": "Portafolio: varias semillas en paralelo, el mejor tour",
+                                   "sa": "Simulated Annealing (python-tsp)", "nn": "Vecino más cercano"}[m]
+        )
+        presupuesto_s = None
+        if metodo_tsp in ("anytime", "anytime_insercion", "portfolio"):
+            presupuesto_s = st.number_input("Tiempo máximo de optimización (s)", min_value=1.0, value=10.0,
+                                            format="%.0f", key="presupuesto_s")
+        if metodo_tsp == "portfolio":
+            n_semillas = st.slider("Semillas por estrategia", 1, 16, SEMILLAS_PORTAFOLIO, key="n_semillas")
+            gap_pct = st.number_input("Gap objetivo (%)", min_value=0.0, value=0.0, format="%.1f", key="gap_pct",
+                                      help="Detiene la ruta cuando un intento queda a menos de este % de la cota inferior. 0 = sin corte.")
+        asignacion = st.selectbox(
+            "Asignación de paradas", options=["greedy", "sweep", "savings"], key="asignacion",
+            format_func=lambda a: {"greedy": "Parada más cercana que cabe",
+                                   "sweep": "Barrido angular por bloques (instancias muy grandes)",
+                                   "savings": "Ahorros de Clarke-Wright (rutas y asignación en una pasada)"}[a]
+        )
+        n_workers = st.number_input("Procesos en paralelo", min_value=1, max_value=os.cpu_count() or 1, value=1,
+                                    key="n_workers", help="Con más de 1 proceso las rutas de cada vehículo se resuelven en paralelo.")
 
     st.divider()
     if st.button("🚀 Optimizar Rutas", type="primary", use_container_width=True):
@@ -133,41 +210,110 @@ with tab_config:
         if paradas_df is None or paradas_df.empty:
             st.warning("Por favor, carga primero un archivo de paradas.")
         else:
-            with st.spinner("Calculando las mejores rutas..."):
-                try:
-                    depot_df = pd.DataFrame([{
-                        'id': 'depot', 'lat': st.session_state.depot_lat, 'lon': st.session_state.depot_lon,
-                        'demanda': 0, 'is_depot': True
-                    }])
-                    full_paradas_df = pd.concat([depot_df, paradas_df], ignore_index=True)
-
-                    resultados = run_optimization(
-                        paradas_df=full_paradas_df,
-                        vehiculos_df=st.session_state.vehiculos_df,
-                        costo_km=st.session_state.costo_km,
-                        velocidad_kmh=st.session_state.velocidad_kmh,
-                        random_seed=42
-                    )
-                    st.session_state.resultados = resultados
-                    st.session_state.full_paradas_df = full_paradas_df
-                    st.success("¡Optimización completada!")
-                    st.toast("Resultados listos en la pestaña 'Resultados'.", icon="🎉")
-                except Exception as e:
-                    st.error(f"Error en la optimización: {e}")
-                    logger.error(f"Error detallado de optimización: {e}", exc_info=True)
-                    st.session_state.resultados = None
+            # La optimización corre en segundo plano: los reruns y widgets no la interrumpen.
+            trabajo_id = obtener_gestor_trabajos().submit(
+                descripcion=f"{len(paradas_df)} paradas, {len(st.session_state.vehiculos_df)} vehículos, {metodo_tsp}",
+                paradas_df=tabla_con_deposito(paradas_df),
+                vehiculos_df=st.session_state.vehiculos_df,
+                costo_km=st.session_state.costo_km,
+                velocidad_kmh=st.session_state.velocidad_kmh,
+                random_seed=42,
+                n_workers=st.session_state.n_workers,
+                asignacion=st.session_state.asignacion,
+                metodo_tsp=st.session_state.metodo_tsp,
+                presupuesto_s=presupuesto_s,
+                cache=obtener_cache_soluciones(),
+                telemetria=nueva_telemetria(),
+                portafolio=obtener_portafolio(st.session_state.n_semillas, st.session_state.gap_pct / 100 or None,
+                                              st.session_state.n_workers) if metodo_tsp == "portfolio" else None
+            )
+            st.session_state.trabajo_id = trabajo_id
+            st.session_state.resultados = None
+            # Con el id en la URL, otra pestaña o una recarga recuperan el mismo trabajo.
+            st.query_params['trabajo'] = trabajo_id
+
+    with st.expander("🔀 Comparar escenarios (¿qué pasaría si...?)"):
+        st.caption("Resuelve en un solo lote todas las combinaciones de flota, costo y velocidad. La matriz de "
+                   "distancias se calcula una vez y cada flota se resuelve una sola vez para todos sus costos y velocidades.")
+        rango_vehiculos = st.slider("Rango de vehículos", 1, MAX_VEHICULOS_ESCENARIO, (1, num_vehiculos), key="esc_vehiculos")
+        paso_vehiculos = st.number_input("Paso entre flotas", min_value=1, max_value=MAX_VEHICULOS_ESCENARIO - 1, value=1,
+                                         key="esc_paso")
+        capacidades_txt = st.text_input("Capacidades (separadas por comas)", value=f"{capacidad_general}", key="esc_capacidades")
+        costos_txt = st.text_input("Costos por KM ($)", value=f"{costo_km:g}", key="esc_costos")
+        velocidades_txt = st.text_input("Velocidades (km/h)", value=f"{velocidad_kmh:g}", key="esc_velocidades")
+        if st.button("🔀 Comparar Escenarios", use_container_width=True):
+            paradas_df = st.session_state.get('paradas_df')
+            try:
+                escenarios = scenario_grid(range(rango_vehiculos[0], rango_vehiculos[1] + 1, paso_vehiculos),
+                                           leer_valores(capacidades_txt), leer_valores(costos_txt),
+                                           leer_valores(velocidades_txt))
+            except ValueError as e:
+                st.error(f"Escenarios no válidos: {e}")
+                escenarios = []
+            if paradas_df is None or paradas_df.empty:
+                st.warning("Por favor, carga primero un archivo de paradas.")
+            elif escenarios:
+                trabajo_id = obtener_gestor_trabajos().submit(
+                    descripcion=f"{len(paradas_df)} paradas, {len(escenarios)} escenarios, {metodo_tsp}",
+                    funcion=run_scenarios,
+                    paradas_df=tabla_con_deposito(paradas_df),
+                    escenarios=escenarios,
+                    random_seed=42,
+                    n_workers=st.session_state.n_workers,
+                    asignacion=st.session_state.asignacion,
+                    metodo_tsp=st.session_state.metodo_tsp,
+                    presupuesto_s=presupuesto_s,
+                    cache=obtener_cache_soluciones(),
+                    telemetria=nueva_telemetria(),
+                    portafolio=obtener_portafolio(st.session_state.n_semillas, st.session_state.gap_pct / 100 or None,
+                                                  st.session_state.n_workers) if metodo_tsp == "portfolio" else None
+                )
+                st.session_state.trabajo_id = trabajo_id
+                st.session_state.comparacion_escenarios = None
+                st.query_params['trabajo'] = trabajo_id
+
+    trabajo = obtener_gestor_trabajos().get(st.session_state.trabajo_id) if st.session_state.trabajo_id else None
+    if trabajo is not None and not trabajo.terminado:
+        render_job_progress(obtener_gestor_trabajos(), trabajo.id)
+    elif trabajo is not None and st.session_state.get('trabajo_cargado') != trabajo.id:
+        st.session_state.trabajo_cargado = trabajo.id
+        if trabajo.estado == 'error':
+            st.error(f"Error en la optimización: {trabajo.error}")
+            st.session_state.resultados = None
+        elif 'escenarios' in trabajo.parametros:
+            st.session_state.comparacion_escenarios = trabajo.resultados
+            st.session_state.telemetria = trabajo.telemetria
+            if trabajo.estado == 'cancelado':
+                st.warning("Comparación cancelada: se muestran los escenarios resueltos hasta el momento.")
+            else:
+                st.success("¡Comparación de escenarios completada!")
+                st.toast("Comparación lista en la pestaña 'Resultados'.", icon="🎉")
+        else:
+            st.session_state.resultados = trabajo.resultados
+            st.session_state.telemetria = trabajo.telemetria
+            st.session_state.tabla_paradas = trabajo.parametros['paradas_df']
+            if trabajo.estado == 'cancelado':
+                st.warning("Optimización cancelada: se muestran las mejores rutas encontradas hasta el momento.")
+            else:
+                st.success("¡Optimización completada!")
+                st.toast("Resultados listos en la pestaña 'Resultados'.", icon="🎉")
 
 # --- Pestaña de Resultados ---
 with tab_results:
     st.header("Análisis de la Solución Optimizada")
+    if st.session_state.get('comparacion_escenarios') is not None:
+        render_scenario_comparison(st.session_state.comparacion_escenarios)
+        st.divider()
     if st.session_state.get('resultados') is not None:
-        if st.session_state.get('full_paradas_df') is not None:
+        if st.session_state.get('tabla_paradas') is not None:
             st.subheader("🗺️ Visualización de Rutas Optimizadas")
-            render_map(st.session_state.full_paradas_df, st.session_state.resultados)
-            render_results_section(st.session_state.resultados, st.session_state.full_paradas_df)
+            render_map(st.session_state.tabla_paradas, st.session_state.resultados)
+            render_results_section(st.session_state.resultados, st.session_state.tabla_paradas,
+                                   st.session_state.telemetria)
+            render_telemetry(st.session_state.telemetria)
         else:
             st.warning("No se encontraron datos de paradas para visualizar.")
-    else:
+    elif st.session_state.get('comparacion_escenarios') is None:
         st.info("Completa y ejecuta la configuración para ver los resultados.")
 
 # --- Pestaña "Acerca de" ---
@@ -0,0 +1,34 @@
+import json
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmark import generate_instance, generate_fleet, main
+
+def test_generator_is_seeded_and_fleet_fits_demand():
+    for tipo in ('clustered', 'uniform'):
+        a, b = generate_instance(100, tipo, seed=3), generate_instance(100, tipo, seed=3)
+        assert a.equals(b)
+        assert len(a) == 101 and a['is_depot'].sum() == 1 and bool(a.loc[0, 'is_depot'])
+        flota = generate_fleet(a, n_vehiculos=4)
+        assert flota['capacidad'].sum() >= a['demanda'].sum()
+    assert not generate_instance(100, seed=3).equals(generate_instance(100, seed=4))
+
+def test_benchmark_writes_json_report(tmp_path):
+    salida = tmp_path / "bench.json"
+    main(["--tamanos", "30", "--tipos", "uniform", "--solvers", "local_search", "nn", "--salida", str(salida)])
+    informe = json.loads(salida.read_text(encoding="utf-8"))
+    etapas = informe["resultados"][0]["etapas"]
+    assert {"create_distance_matrix", "assign_stops_to_vehicles", "tsp_local_search", "tsp_nn",
+            "run_optimization_local_search"} <= set(etapas)
+    assert etapas["run_optimization_local_search"]["paradas_sin_asignar"] == 0
+
+def test_cold_import_does_not_load_heavy_dependencies():
+    from benchmark import medir_importaciones
+    informe = medir_importaciones(repeticiones=1)
+    assert informe["solver"]["dependencias_pesadas"] == []
+    assert informe["io_parser"]["dependencias_pesadas"] == []
+    assert informe["cli"]["dependencias_pesadas"] == []
+    # visualization es parte de la UI y necesita streamlit, pero no folium hasta dibujar un mapa.
+    assert informe["visualization"]["dependencias_pesadas"] == ["streamlit"]
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import SolutionCache, instance_fingerprint
+
+def _instancia():
+    import pandas as pd
+    paradas_df = pd.DataFrame({
+        'id': ['depot', 'a', 'b', 'c'], 'lat': [4.44, 4.45, 4.47, 4.40], 'lon': [-76.2, -76.21, -76.15, -76.25],
+        'demanda': [0, 3, 4, 5], 'is_depot': [True, False, False, False]
+    })
+    vehiculos_df = pd.DataFrame([{'id': 'Vehículo 1', 'capacidad': 10}, {'id': 'Vehículo 2', 'capacidad': 10}])
+    return paradas_df, vehiculos_df
+
+def test_fingerprint_changes_with_any_input():
+    paradas_df, vehiculos_df = _instancia()
+    base = instance_fingerprint(paradas_df, vehiculos_df, costo_km=1500, random_seed=42)
+    assert base == instance_fingerprint(paradas_df.copy(), vehiculos_df.copy(), random_seed=42, costo_km=1500)
+    assert base != instance_fingerprint(paradas_df, vehiculos_df, costo_km=1500, random_seed=43)
+    modificado = paradas_df.copy()
+    modificado.loc[2, 'demanda'] = 5
+    assert base != instance_fingerprint(modificado, vehiculos_df, costo_km=1500, random_seed=42)
+    flota = vehiculos_df.copy()
+    flota.loc[1, 'capacidad'] = 11
+    assert base != instance_fingerprint(paradas_df, flota, costo_km=1500, random_seed=42)
+
+def test_lru_eviction_by_size(tmp_path):
+    cache = SolutionCache(str(tmp_path), max_bytes=2500)
+    for clave in ('a', 'b'):
+        cache.put(clave, b'x' * 1000)
+    os.utime(tmp_path / 'a.pkl', (1, 1))
+    os.utime(tmp_path / 'b.pkl', (2, 2))
+    assert cache.get('a') == b'x' * 1000  # El acierto renueva 'a'
+    cache.put('c', b'x' * 1000)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+def test_run_optimization_uses_cache(tmp_path):
+    from solver import run_optimization
+    paradas_df, vehiculos_df = _instancia()
+    cache = SolutionCache(str(tmp_path), guardar_matrices=True)
+    resultados = run_optimization(paradas_df, vehiculos_df, 1000, 60, 42, metodo_tsp='local_search', cache=cache)
+    assert any(nombre.endswith('.npy') for nombre in os.listdir(tmp_path))
+    assert run_optimization(paradas_df, vehiculos_df, 1000, 60, 42, metodo_tsp='local_search', cache=cache) == resultados
+    otro = run_optimization(paradas_df, vehiculos_df, 2000, 60, 42, metodo_tsp='local_search', cache=cache)
+    assert otro[0]['costo_estimado'] == 2 * resultados[0]['costo_estimado']
+
+def test_run_optimization_does_not_cache_time_budgeted_runs(tmp_path):
+    from solver import run_optimization
+    from utils import Telemetria
+    paradas_df, vehiculos_df = _instancia()
+    cache = SolutionCache(str(tmp_path))
+    for _ in range(2):
+        telemetria = Telemetria()
+        run_optimization(paradas_df, vehiculos_df, 1000, 60, 42, metodo_tsp='anytime', presupuesto_s=0.05, cache=cache,
+                         telemetria=telemetria)
+        assert 'cache_hits' not in telemetria.contadores
+    assert not any(nombre.endswith('.pkl') for nombre in os.listdir(tmp_path))
@@ -0,0 +1,37 @@
+import json
+import subprocess
+
+import sys
+import os
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, RAIZ)
+
+from cli import main
+
+def test_batch_writes_one_jsonl_line_per_file(tmp_path):
+    (tmp_path / "a.csv").write_text("id,lat,lon,demanda\ns1,4.45,-76.20,3\ns2,4.46,-76.18,4\ns3,4.42,-76.21,2\n")
+    (tmp_path / "b.csv").write_text("nombre;lat;lon;pasajeros\nx1;4.40;-76.19;5\nx2;4.41;-76.17;1\n")
+    (tmp_path / "roto.csv").write_text("sin,columnas\n1,2\n")
+    salida = tmp_path / "out.jsonl"
+    main(["--depot-lat", "4.4389", "--depot-lon", "-76.1951", "--capacidad", "20", str(tmp_path),
+          "--salida", str(salida)])
+    lineas = [json.loads(l) for l in salida.read_text(encoding="utf-8").splitlines()]
+    por_archivo = {os.path.basename(l["archivo"]): l for l in lineas}
+    assert set(por_archivo) == {"a.csv", "b.csv", "roto.csv"}
+    assert por_archivo["roto.csv"]["estado"] == "error"
+    assert por_archivo["a.csv"]["estado"] == "ok" and por_archivo["a.csv"]["paradas_sin_asignar"] == 0
+    assert sorted(por_archivo["b.csv"]["rutas"][0]["secuencia_paradas_ids"]) == ["x1", "x2"]
+
+def test_core_modules_do_not_import_streamlit():
+    codigo = "import sys, solver, io_parser, cli; print('streamlit' in sys.modules)"
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, capture_output=True, text=True, check=True)
+    assert salida.stdout.strip() == "False"
+
+def test_batch_output_includes_phase_timings(tmp_path):
+    (tmp_path / "a.csv").write_text("id,lat,lon,demanda\ns1,4.45,-76.20,3\ns2,4.46,-76.18,4\n")
+    salida = tmp_path / "out.jsonl"
+    main(["--depot-lat", "4.4389", "--depot-lon", "-76.1951", str(tmp_path / "a.csv"), "--salida", str(salida),
+          "--npz-dir", str(tmp_path / "npz")])
+    telemetria = json.loads(salida.read_text(encoding="utf-8"))["telemetria"]
+    assert {'lectura', 'asignacion', 'tsp', 'exportacion'} <= set(telemetria["fases"])
+    assert telemetria["contadores"]["paradas"] == 2
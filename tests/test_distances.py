@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# Añadir la ruta del proyecto para que pytest encuentre los módulos
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from distances import HAVERSINE, CandidateGraph, RoadNetworkProvider, haversine_matrix
+
+def _red_en_rejilla(tmp_path, n=12, paso=0.01):
+    """Red vial en rejilla de n x n nodos con aristas a los 4 vecinos."""
+    filas, columnas = np.divmod(np.arange(n * n), n)
+    nodos = pd.DataFrame({'id': np.arange(n * n), 'lat': 4.4 + filas * paso, 'lon': -76.3 + columnas * paso})
+    derecha = nodos['id'][columnas < n - 1]
+    arriba = nodos['id'][filas < n - 1]
+    aristas = pd.DataFrame({'origen': np.r_[derecha, arriba], 'destino': np.r_[derecha + 1, arriba + n]})
+    nodos.to_csv(tmp_path / "nodos.csv", index=False)
+    aristas.to_csv(tmp_path / "aristas.csv", index=False)
+    return str(tmp_path / "nodos.csv"), str(tmp_path / "aristas.csv")
+
+def test_road_matrix_follows_grid_and_is_cached(tmp_path, monkeypatch):
+    nodos, aristas = _red_en_rejilla(tmp_path)
+    cache_path = str(tmp_path / "distancias.sqlite")
+    red = RoadNetworkProvider(nodos, aristas, cache_path=cache_path)
+    lats, lons = np.array([4.4, 4.45, 4.5, 4.4]), np.array([-76.3, -76.25, -76.2, -76.2])
+    matriz = red.matrix(lats, lons)
+    recta = haversine_matrix(lats, lons)
+    assert np.allclose(np.diag(matriz), 0) and np.allclose(matriz, matriz.T)
+    assert (matriz >= recta - 1e-9).all()
+    # Esquina a esquina por la rejilla: suma de los dos catetos.
+    assert matriz[0, 2] == pytest.approx(recta[0, 3] + recta[3, 2], rel=1e-3)
+    np.testing.assert_allclose(red.pairs(lats[:2], lons[:2], lats[2:], lons[2:]), [matriz[0, 2], matriz[1, 3]])
+    red.close()
+
+    otra = RoadNetworkProvider(nodos, aristas, cache_path=cache_path)
+    monkeypatch.setattr(otra, '_calcular', lambda *args: pytest.fail("Distancia recalculada pese a estar en caché"))
+    np.testing.assert_allclose(otra.matrix(lats, lons), matriz)
+    otra.close()
+
+def test_road_pairs_cache_only_requested_pairs(tmp_path):
+    import sqlite3
+    nodos, aristas = _red_en_rejilla(tmp_path)
+    cache_path = str(tmp_path / "distancias.sqlite")
+    red = RoadNetworkProvider(nodos, aristas, cache_path=cache_path)
+    lats, lons = 4.4 + np.arange(12) * 0.01, np.full(12, -76.3)
+    # 12 pares con 3 orígenes distintos: antes se guardaba el bloque 3 x 12.
+    origenes = np.repeat([0, 5, 11], 4)
+    destinos = np.arange(12)
+    calculos = []
+    calcular = red._calcular
+    red._calcular = lambda o, d: calculos.append(len(o)) or calcular(o, d)
+    km = red.pairs(lats[origenes], lons[origenes], lats[destinos], lons[destinos])
+    red.close()
+    assert calculos == [3]
+    with sqlite3.connect(cache_path) as bd:
+        assert bd.execute("SELECT COUNT(*) FROM distancias").fetchone()[0] == len(set(zip(origenes, destinos)))
+    otra = RoadNetworkProvider(nodos, aristas, cache_path=cache_path)
+    otra._calcular = lambda *args: pytest.fail("Distancia recalculada pese a estar en caché")
+    np.testing.assert_allclose(otra.pairs(lats[origenes], lons[origenes], lats[destinos], lons[destinos]), km)
+    otra.close()
+
+def test_road_warns_once_about_pairs_without_path(tmp_path, caplog):
+    nodos, aristas = _red_en_rejilla(tmp_path)
+    pd.DataFrame({'id': [999], 'lat': [5.0], 'lon': [-75.0]}).to_csv(nodos, mode='a', header=False, index=False)
+    red = RoadNetworkProvider(nodos, aristas)
+    for _ in range(3):
+        red.pairs([4.4], [-76.3], [5.0], [-75.0])
+    assert sum('sin camino' in r.getMessage() for r in caplog.records) == 1
+
+def test_run_optimization_with_road_provider(tmp_path):
+    from benchmark import generate_fleet
+    from solver import run_optimization
+    red = RoadNetworkProvider(*_red_en_rejilla(tmp_path))
+    rng = np.random.default_rng(0)
+    paradas_df = pd.DataFrame({'id': ['depot'] + [f"p{i}" for i in range(40)],
+                               'lat': np.r_[4.45, rng.uniform(4.4, 4.5, 40)], 'lon': np.r_[-76.25, rng.uniform(-76.3, -76.2, 40)],
+                               'demanda': np.r_[0, rng.integers(1, 5, 40)], 'is_depot': [True] + [False] * 40})
+    vehiculos_df = generate_fleet(paradas_df, 3)
+    por_red = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 0, metodo_tsp='local_search', proveedor=red)
+    en_recta = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 0, metodo_tsp='local_search', proveedor=HAVERSINE)
+    assert sorted(pid for r in por_red for pid in r['secuencia_paradas_ids']) == sorted(paradas_df['id'][1:])
+    assert sum(r['distancia_km'] for r in por_red) > sum(r['distancia_km'] for r in en_recta)
+
+def test_candidate_graph_computes_exact_distances_on_demand(tmp_path):
+    rng = np.random.default_rng(2)
+    lats, lons = rng.uniform(4.4, 4.5, 60), rng.uniform(-76.3, -76.2, 60)
+    grafo = CandidateGraph(lats, lons, k=5)
+    matriz = haversine_matrix(lats, lons)
+    filas, columnas = rng.integers(0, 60, (7, 1)), rng.integers(0, 60, (1, 9))
+    assert np.allclose(grafo[filas, columnas], matriz[filas, columnas])
+    assert grafo.vecinos.shape == (60, 5) and np.allclose(grafo.desde(3, grafo.vecinos[3]), np.sort(np.delete(matriz[3], 3))[:5])
+    red = RoadNetworkProvider(*_red_en_rejilla(tmp_path))
+    grafo_red = CandidateGraph(lats, lons, k=5, proveedor=red, max_cache=50)
+    assert np.allclose(grafo_red[filas, columnas], red.matrix(lats, lons)[filas, columnas])
+    assert len(grafo_red._cache) == 50
+    assert grafo.simetrica and grafo_red.simetrica
+    assert not CandidateGraph(lats, lons, k=5, proveedor=RoadNetworkProvider(*_red_en_rejilla(tmp_path), dirigido=True)).simetrica
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from io import BytesIO
 import pytest
@@ -8,7 +9,7 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from io_parser import safe_read_table
+from io_parser import load_distance_matrix, load_results, safe_read_table, save_distance_matrix, save_results
 
 def create_mock_file(content, name):
     """Crea un objeto de archivo simulado para los tests."""
@@ -54,3 +55,67 @@ def test_no_depot_raises_error():
     mock_file = create_mock_file(csv_content, "no_depot.csv")
     with pytest.raises(ValueError, match="Debe haber exactamente un depósito"):
         safe_read_table(mock_file)
+
+def test_csv_latin1_with_semicolon_is_detected():
+    contenido = "Nombre;Lat;Lon;Pasajeros\nJosé;4.5;-74.1;3\nMaría;4.6;-74.2;10\n".encode('latin-1')
+    mock_file = MagicMock()
+    mock_file.name = "latin1.csv"
+    mock_file.getvalue.return_value = contenido
+    df = safe_read_table(mock_file)
+    assert list(df['id']) == ['José', 'María']
+    assert df['lat'].dtype == 'float64'
+    assert df['demanda'].tolist() == [3, 10]
+
+def test_csv_non_utf8_byte_after_sample_is_reread_as_latin1():
+    from io_parser import MUESTRA_BYTES
+    filas = ["id,lat,lon,demanda"] + [f"p{i},4.5,-74.1,3" for i in range(MUESTRA_BYTES // 16 + 200)] + ["José,4.6,-74.2,10"]
+    contenido = ("\n".join(filas) + "\n").encode('latin-1')
+    assert contenido.index('é'.encode('latin-1')) > MUESTRA_BYTES
+    mock_file = MagicMock()
+    mock_file.name = "latin1_tardio.csv"
+    mock_file.getvalue.return_value = contenido
+    for chunksize in (None, 1000):
+        df = safe_read_table(mock_file, chunksize=chunksize)
+        assert df['id'].iloc[0] == 'p0' and df['id'].iloc[-1] == 'José'
+        assert df['demanda'].dtype == 'int64' and df['lat'].dtype == 'float64'
+
+def test_read_csv_from_path(tmp_path):
+    ruta = tmp_path / "paradas.csv"
+    ruta.write_text("id,lat,lon,demanda\nstop1,4.6,-74.2,10\nstop2,4.7,-74.3,5\n", encoding='utf-8')
+    df = safe_read_table(str(ruta))
+    assert len(df) == 2
+    assert not df['is_depot'].any()
+
+def test_chunked_read_drops_invalid_rows_and_warns():
+    csv_content = "id,lat,lon,demanda,extra\nstop1,4.6,-74.2,10,a\nstop2,x,-74.3,5,b\nstop3,4.8,,2,c\nstop4,4.9,-74.5,1,d"
+    avisos = []
+    df = safe_read_table(create_mock_file(csv_content, "bloques.csv"), on_warning=avisos.append, chunksize=2)
+    assert list(df['id']) == ['stop1', 'stop4']
+    assert 'extra' not in df.columns
+    assert any("2 filas" in aviso for aviso in avisos)
+
+def test_read_parquet_and_npz(tmp_path):
+    paradas = pd.DataFrame({'Nombre': ['stop1', 'stop2'], 'Lat': [4.6, 4.7], 'Lon': [-74.2, -74.3], 'Pasajeros': [10, 5]})
+    paradas.to_parquet(tmp_path / "paradas.parquet")
+    np.savez(tmp_path / "paradas.npz", **{c: paradas[c].to_numpy(dtype=str if c == 'Nombre' else None) for c in paradas})
+    for nombre in ("paradas.parquet", "paradas.npz"):
+        df = safe_read_table(str(tmp_path / nombre))
+        assert list(df['id']) == ['stop1', 'stop2']
+        assert df['demanda'].tolist() == [10, 5]
+
+def test_distance_matrix_and_results_roundtrip(tmp_path):
+    matriz = np.array([[0.0, 1.5], [1.5, 0.0]])
+    ruta_matriz = str(tmp_path / "matriz.npy")
+    save_distance_matrix(ruta_matriz, matriz, ['depot', 7])
+    cargada, ids = load_distance_matrix(ruta_matriz)
+    assert np.array_equal(cargada, matriz) and ids == ['depot', 7]
+
+    resultados = [
+        {'vehiculo_id': 'Vehículo 1', 'capacidad': 20, 'total_demanda': 15, 'capacidad_utilizada_pct': 75.0,
+         'distancia_km': 12.5, 'costo_estimado': 100.0, 'tiempo_estimado_h': 0.5, 'secuencia_paradas_ids': ['a', 'b']},
+        {'vehiculo_id': 'Vehículo 2', 'capacidad': 20, 'total_demanda': 3, 'capacidad_utilizada_pct': 15.0,
+         'distancia_km': 4.0, 'costo_estimado': 32.0, 'tiempo_estimado_h': 0.1, 'secuencia_paradas_ids': ['c']},
+    ]
+    ruta_resultados = str(tmp_path / "rutas.npz")
+    save_results(ruta_resultados, resultados)
+    assert load_results(ruta_resultados) == resultados
@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from jobs import JobManager
+
+def _esperar(gestor, trabajo_id, timeout=30):
+    limite = time.monotonic() + timeout
+    while not gestor.get(trabajo_id).terminado:
+        assert time.monotonic() < limite, "El trabajo no terminó a tiempo"
+        time.sleep(0.01)
+    return gestor.get(trabajo_id)
+
+def _instancia(n=30, seed=0):
+    rng = np.random.default_rng(seed)
+    paradas_df = pd.DataFrame({
+        'id': ['depot'] + [f"p{i}" for i in range(n)],
+        'lat': np.r_[4.44, rng.uniform(4.3, 4.6, n)], 'lon': np.r_[-76.2, rng.uniform(-76.4, -76.0, n)],
+        'demanda': np.r_[0, rng.integers(1, 10, n)], 'is_depot': [True] + [False] * n
+    })
+    vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': 60} for i in range(3)])
+    return paradas_df, vehiculos_df
+
+def test_job_runs_optimization_and_exposes_partial_routes():
+    gestor = JobManager()
+    paradas_df, vehiculos_df = _instancia()
+    trabajo_id = gestor.submit("prueba", paradas_df=paradas_df, vehiculos_df=vehiculos_df, costo_km=1.0,
+                               velocidad_kmh=60.0, random_seed=42, metodo_tsp='local_search')
+    trabajo = _esperar(gestor, trabajo_id)
+    assert trabajo.estado == 'completado' and trabajo.error is None
+    assert sorted(r['vehiculo_id'] for r in trabajo.parciales()) == [r['vehiculo_id'] for r in trabajo.resultados]
+    assert 'tsp' in trabajo.telemetria.fases
+    assert gestor.list()[0]['id'] == trabajo_id
+    gestor.shutdown()
+
+def test_cancel_stops_running_job_and_skips_pending_ones():
+    def esperar_cancelacion(cancel_event, **_):
+        assert cancel_event.wait(10)
+        return []
+
+    gestor = JobManager(max_workers=1)
+    en_curso = gestor.submit(funcion=esperar_cancelacion)
+    pendiente = gestor.submit(funcion=esperar_cancelacion)
+    assert gestor.cancel(pendiente) and gestor.cancel(en_curso)
+    assert _esperar(gestor, en_curso).estado == 'cancelado'
+    assert _esperar(gestor, pendiente).estado == 'cancelado'
+    assert not gestor.cancel(en_curso)
+    gestor.shutdown()
+
+def test_cancel_reaches_parallel_workers():
+    from solver import ESPERA_CANCELACION_S
+    gestor = JobManager()
+    paradas_df, vehiculos_df = _instancia(n=300)
+    vehiculos_df['capacidad'] = 600
+    trabajo_id = gestor.submit("paralelo", paradas_df=paradas_df, vehiculos_df=vehiculos_df, costo_km=1.0,
+                               velocidad_kmh=60.0, random_seed=42, metodo_tsp='anytime', presupuesto_s=60.0,
+                               presupuesto_por_ruta=True, n_workers=2)
+    time.sleep(4)  # Los workers ya arrancaron y están optimizando
+    assert not gestor.get(trabajo_id).terminado
+    inicio = time.monotonic()
+    gestor.cancel(trabajo_id)
+    trabajo = _esperar(gestor, trabajo_id)
+    # Sin la cancelación cada ruta agotaría su minuto de presupuesto.
+    assert time.monotonic() - inicio < ESPERA_CANCELACION_S + 2
+    assert trabajo.estado == 'cancelado' and trabajo.resultados
+    gestor.shutdown()
+
+def test_error_is_reported_and_old_jobs_are_purged():
+    def fallar(**_):
+        raise ValueError("datos inválidos")
+
+    gestor = JobManager(max_trabajos=2)
+    ids = [gestor.submit(funcion=fallar) for _ in range(3)]
+    for trabajo_id in ids:
+        trabajo = _esperar(gestor, trabajo_id)
+        assert trabajo.estado == 'error' and "datos inválidos" in trabajo.error
+    gestor.submit(funcion=fallar)
+    assert gestor.get(ids[0]) is None
+    gestor.shutdown()
@@ -0,0 +1,70 @@
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from local_search import improve_tour, tour_length, candidate_lists
+from solver import haversine_matrix, nearest_neighbor_solver
+
+def test_two_opt_removes_crossing():
+    # Cuadrado unitario recorrido en "X": 0 -> 2 -> 1 -> 3 cruza sus diagonales.
+    puntos = np.array([[0, 0], [0, 1], [1, 1], [1, 0]], dtype=float)
+    dist_matrix = np.linalg.norm(puntos[:, None] - puntos[None, :], axis=2)
+    tour, dist = improve_tour([0, 2, 1, 3], dist_matrix)
+    assert dist == 4.0
+    assert sorted(tour) == [0, 1, 2, 3]
+
+def test_improves_nearest_neighbor_and_keeps_permutation():
+    rng = np.random.default_rng(7)
+    dist_matrix = haversine_matrix(rng.uniform(4.3, 4.6, 150), rng.uniform(-76.4, -76.0, 150))
+    ruta_nn, dist_nn = nearest_neighbor_solver(dist_matrix)
+    tour, dist = improve_tour(ruta_nn, dist_matrix)
+    assert sorted(tour) == list(range(150))
+    assert dist == tour_length(tour, dist_matrix)
+    assert dist < dist_nn
+
+def test_candidate_lists_are_sorted_nearest():
+    rng = np.random.default_rng(1)
+    dist_matrix = haversine_matrix(rng.uniform(4.3, 4.6, 30), rng.uniform(-76.4, -76.0, 30))
+    vecinos = candidate_lists(dist_matrix, k=5)
+    for i in range(30):
+        orden = [j for j in np.argsort(dist_matrix[i], kind='stable') if j != i][:5]
+        assert list(vecinos[i]) == orden
+
+def test_anytime_search_honours_budget_and_cancellation():
+    import threading
+    import time
+    from local_search import anytime_search
+    rng = np.random.default_rng(11)
+    dist_matrix = haversine_matrix(rng.uniform(4.3, 4.6, 120), rng.uniform(-76.4, -76.0, 120))
+    ruta_nn, dist_nn = nearest_neighbor_solver(dist_matrix)
+    progreso = []
+    inicio = time.monotonic()
+    tour, dist = anytime_search(ruta_nn, dist_matrix, 42, presupuesto_s=0.5,
+                                progress_callback=lambda *args: progreso.append(args))
+    assert time.monotonic() - inicio < 1.5
+    assert sorted(tour) == list(range(120)) and dist < dist_nn
+    assert [p[1] for p in progreso] == sorted((p[1] for p in progreso), reverse=True)
+
+    cancelado = threading.Event()
+    cancelado.set()
+    tour, dist = anytime_search(ruta_nn, dist_matrix, 42, cancel_event=cancelado)
+    assert sorted(tour) == list(range(120))
+    assert dist == tour_length(tour, dist_matrix)
+
+def test_moves_improve_asymmetric_tours():
+    # Red con sentidos únicos: invertir un tramo cambia su costo, y cada movimiento aceptado debe acortar el tour.
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        dist_matrix = rng.uniform(1, 10, (25, 25))
+        np.fill_diagonal(dist_matrix, 0)
+        tour, dist = list(rng.permutation(25)), None
+        anterior = tour_length(tour, dist_matrix)
+        for _ in range(200):
+            tour, dist = improve_tour(tour, dist_matrix, max_iter=1)
+            assert dist <= anterior + 1e-9
+            if dist == anterior:
+                break
+            anterior = dist
+        assert sorted(tour) == list(range(25))
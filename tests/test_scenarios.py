@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import scenarios
+import solver
+from scenarios import COLUMNAS_ESCENARIOS, run_scenarios, scenario_grid
+from solver import run_optimization
+
+def _paradas(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': ['depot'] + [f"p{i}" for i in range(n)],
+        'lat': np.r_[4.44, rng.uniform(4.3, 4.6, n)], 'lon': np.r_[-76.2, rng.uniform(-76.4, -76.0, n)],
+        'demanda': np.r_[0, rng.integers(1, 10, n)], 'is_depot': [True] + [False] * n
+    })
+
+def test_scenario_grid_builds_every_combination():
+    escenarios = scenario_grid(range(1, 4), [50, 80], 1500.0, [40.0, 60.0])
+    assert len(escenarios) == 3 * 2 * 1 * 2
+    assert escenarios[0] == {'n_vehiculos': 1, 'capacidad': 50, 'costo_km': 1500.0, 'velocidad_kmh': 40.0}
+    with pytest.raises(ValueError):
+        scenario_grid([0, 21], 50, 1500.0, 60.0)
+
+def test_run_scenarios_shares_matrix_and_fleet_routes(monkeypatch):
+    paradas_df = _paradas()
+    llamadas = {'matriz': 0, 'flotas': 0}
+    crear_matriz, optimizar = solver.create_distance_matrix, scenarios.run_optimization
+
+    def contar_matriz(*args, **kwargs):
+        llamadas['matriz'] += 1
+        return crear_matriz(*args, **kwargs)
+
+    def contar_flotas(*args, **kwargs):
+        llamadas['flotas'] += 1
+        return optimizar(*args, **kwargs)
+
+    monkeypatch.setattr(solver, 'create_distance_matrix', contar_matriz)
+    monkeypatch.setattr(scenarios, 'run_optimization', contar_flotas)
+    filas = []
+    escenarios = scenario_grid([2, 3], 100, [1000.0, 2000.0], [40.0, 80.0])
+    comparacion = run_scenarios(paradas_df, escenarios, metodo_tsp='local_search', route_callback=filas.append)
+
+    # Una matriz para todo el barrido y una resolución por flota, no por escenario.
+    assert llamadas == {'matriz': 1, 'flotas': 2}
+    assert list(comparacion.columns) == COLUMNAS_ESCENARIOS
+    assert list(comparacion['escenario']) == list(range(1, 9)) and len(filas) == 8
+    for escenario, fila in zip(escenarios, comparacion.to_dict('records')):
+        vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': 100} for i in range(escenario['n_vehiculos'])])
+        directo = run_optimization(paradas_df, vehiculos_df, escenario['costo_km'], escenario['velocidad_kmh'], 42,
+                                   metodo_tsp='local_search')
+        assert fila['distancia_total_km'] == pytest.approx(sum(r['distancia_km'] for r in directo))
+        assert fila['costo_total'] == pytest.approx(sum(r['costo_estimado'] for r in directo))
+        assert fila['tiempo_total_h'] == pytest.approx(sum(r['tiempo_estimado_h'] for r in directo))
+        assert fila['paradas_asignadas'] + fila['paradas_sin_asignar'] == 40
+        demanda = sum(r['total_demanda'] for r in directo)
+        assert fila['utilizacion_flota_pct'] == pytest.approx(demanda / (escenario['n_vehiculos'] * 100) * 100)
+
+def test_run_scenarios_parallel_matches_sequential():
+    paradas_df = _paradas(seed=1)
+    escenarios = scenario_grid([1, 2, 3], [60, 120], 1500.0, 60.0)
+    secuencial = run_scenarios(paradas_df, escenarios, metodo_tsp='local_search')
+    paralelo = run_scenarios(paradas_df, escenarios, metodo_tsp='local_search', n_workers=2)
+    pd.testing.assert_frame_equal(secuencial, paralelo)
+
+def test_run_scenarios_passes_workers_to_a_single_fleet(monkeypatch):
+    recibidos = []
+    optimizar = scenarios.run_optimization
+    monkeypatch.setattr(scenarios, 'run_optimization',
+                        lambda *args, **kwargs: recibidos.append(kwargs['n_workers']) or optimizar(*args, **kwargs))
+    run_scenarios(_paradas(), scenario_grid(2, 100, [1000.0, 2000.0], 60.0), metodo_tsp='nn', n_workers=3)
+    assert recibidos == [3]
+
+def test_run_scenarios_parallel_cancellation_stops_running_fleets():
+    import threading
+    import time
+    cancelar = threading.Event()
+    threading.Timer(2.0, cancelar.set).start()
+    escenarios = scenario_grid([1, 2, 3, 4], 400, 1500.0, 60.0)
+    inicio = time.monotonic()
+    comparacion = run_scenarios(_paradas(n=300), escenarios, metodo_tsp='anytime', presupuesto_s=60.0, n_workers=2,
+                                cancel_event=cancelar)
+    # Sin la cancelación cada flota agotaría su minuto de presupuesto.
+    assert time.monotonic() - inicio < 20
+    assert len(comparacion) <= len(escenarios)
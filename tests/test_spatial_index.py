@@ -0,0 +1,45 @@
+import numpy as np
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from spatial_index import SpatialIndex
+from solver import haversine_matrix
+
+def test_nearest_matches_brute_force_with_capacity_and_deletions():
+    rng = np.random.default_rng(3)
+    lats, lons = rng.uniform(4.3, 4.6, 500), rng.uniform(-76.4, -76.0, 500)
+    demandas = rng.integers(1, 10, 500)
+    indice = SpatialIndex(lats, lons, demandas)
+    vivos = np.ones(500, dtype=bool)
+    for paso in range(200):
+        lat, lon = rng.uniform(4.2, 4.7), rng.uniform(-76.5, -75.9)
+        capacidad = rng.integers(1, 10)
+        cand = np.flatnonzero(vivos & (demandas <= capacidad))
+        esperado = cand[np.argsort(haversine_matrix([lat], [lon], lats[cand], lons[cand])[0], kind='stable')[:3]]
+        obtenido = indice.consultar(lat, lon, k=3, demanda_max=capacidad)
+        assert list(obtenido) == list(esperado)
+        if len(obtenido):
+            indice.eliminar(obtenido[0])
+            vivos[obtenido[0]] = False
+    assert len(indice) == vivos.sum()
+
+def test_empty_when_nothing_fits():
+    indice = SpatialIndex([4.5, 4.6], [-76.1, -76.2], [5, 8])
+    assert indice.consultar(4.5, -76.1, demanda_max=4).size == 0
+    indice.eliminar(0)
+    assert indice.consultar(4.5, -76.1, demanda_max=6).size == 0
+    assert list(indice.consultar(4.5, -76.1)) == [1]
+
+def test_k_nearest_for_all_points_matches_brute_force():
+    rng = np.random.default_rng(5)
+    # Dos grupos densos y puntos dispersos: hay celdas llenas y celdas casi vacías.
+    lats = np.r_[rng.normal(4.4, 0.002, 300), rng.normal(4.5, 0.01, 200), rng.uniform(4.0, 5.0, 50)]
+    lons = np.r_[rng.normal(-76.2, 0.002, 300), rng.normal(-76.1, 0.01, 200), rng.uniform(-77.0, -76.0, 50)]
+    vecinos = SpatialIndex(lats, lons, puntos_por_celda=8).vecinos_cercanos(8)
+    distancias = haversine_matrix(lats, lons)
+    np.fill_diagonal(distancias, np.inf)
+    assert vecinos.shape == (550, 8) and not (vecinos == np.arange(550)[:, None]).any()
+    assert np.allclose(np.take_along_axis(distancias, vecinos, axis=1), np.sort(distancias, axis=1)[:, :8])
+    assert SpatialIndex([4.5, 4.6], [-76.1, -76.2]).vecinos_cercanos(5).tolist() == [[1], [0]]
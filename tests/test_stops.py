@@ -0,0 +1,37 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import instance_fingerprint
+from solver import CAMPOS_RUTA, RouteResult
+from stops import StopTable
+
+def _paradas():
+    return pd.DataFrame({'id': ['depot', 'a', 'b', 'c'], 'lat': [4.0, 4.1, 4.2, 4.3], 'lon': [-76.0] * 4,
+                         'demanda': [0, 1, 2, 3], 'is_depot': [True, False, False, False]})
+
+def test_stop_table_positions_filters_and_concat():
+    tabla = StopTable.from_dataframe(_paradas())
+    assert tabla.depot_pos == 0 and tabla.clientes.tolist() == [1, 2, 3]
+    assert tabla.posiciones(['c', 'x', 'a']).tolist() == [3, 1]
+    assert tabla.posiciones(['c', 'x'], faltante=-1).tolist() == [3, -1]
+    sin_b = tabla.without_ids({'b'}).concat(StopTable(np.array(['d'], dtype=object), [4.4], [-76.0], [5]))
+    assert sin_b['id'].tolist() == ['depot', 'a', 'c', 'd'] and sin_b.posicion['d'] == 3
+    assert sin_b['is_depot'].tolist() == [True, False, False, False]
+    assert sin_b.to_dataframe()['demanda'].tolist() == [0, 1, 3, 5]
+
+def test_stop_table_fingerprint_matches_dataframe():
+    paradas_df = _paradas()
+    vehiculos_df = pd.DataFrame([{'id': 'Vehículo 1', 'capacidad': 10}])
+    assert instance_fingerprint(StopTable.of(paradas_df), vehiculos_df) == instance_fingerprint(paradas_df, vehiculos_df)
+
+def test_route_result_behaves_like_a_dict():
+    ruta = RouteResult(**{campo: i for i, campo in enumerate(CAMPOS_RUTA)})
+    assert list(ruta) == list(CAMPOS_RUTA) and dict(ruta)['distancia_km'] == ruta['distancia_km']
+    assert pickle.loads(pickle.dumps(ruta)) == ruta
+    assert pd.DataFrame([ruta]).columns.tolist() == list(CAMPOS_RUTA)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+# Añadir la ruta del proyecto para que pytest encuentre los módulos
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmark import generate_instance
+from stops import StopTable
+from visualization import build_route_map, route_stops_table, simplificar_ruta, to_excel
+
+def test_simplificar_ruta_drops_collinear_points_and_keeps_ends():
+    lons = np.linspace(-76.2, -76.1, 51)
+    lats = 4.5 + 0.02 * (1 - np.abs(np.linspace(-1, 1, 51)))  # Dos tramos rectos con vértice en el centro
+    nuevas_lats, nuevas_lons = simplificar_ruta(lats, lons)
+    assert len(nuevas_lats) == 3
+    assert (nuevas_lons[[0, -1]] == lons[[0, -1]]).all()
+    assert nuevas_lats[1] == lats[25]
+
+def test_route_map_clusters_stops_above_threshold():
+    paradas_df = generate_instance(60, seed=3)
+    resultados = [{'vehiculo_id': 'Vehículo 1', 'distancia_km': 10.0,
+                   'secuencia_paradas_ids': paradas_df['id'].iloc[1:].tolist()}]
+    pequeno = build_route_map(paradas_df, resultados, umbral=100).get_root().render()
+    agrupado = build_route_map(paradas_df, resultados, umbral=10).get_root().render()
+    assert "markerClusterGroup" not in pequeno and pequeno.count("L.marker(") == 61
+    assert "markerClusterGroup" in agrupado and agrupado.count("L.marker(") <= 2
+    assert "L.polyline(" in agrupado
+
+def test_route_stops_table_follows_sequences():
+    paradas_df = pd.DataFrame({'id': ['depot', 'a', 'b', 'c'], 'lat': [4.0, 4.1, 4.2, 4.3], 'lon': [-76.0] * 4,
+                               'demanda': [0, 1, 2, 3], 'is_depot': [True, False, False, False]})
+    resultados = [{'vehiculo_id': 'Vehículo 1', 'secuencia_paradas_ids': ['c', 'a', 'desconocida']},
+                  {'vehiculo_id': 'Vehículo 2', 'secuencia_paradas_ids': ['b']}]
+    tabla = route_stops_table(resultados, paradas_df)
+    assert tabla['id'].tolist() == ['c', 'a', 'b']
+    assert tabla['vehiculo_id'].tolist() == ['Vehículo 1', 'Vehículo 1', 'Vehículo 2']
+    assert tabla['orden'].tolist() == [1, 2, 1]
+    assert tabla['demanda'].tolist() == [3, 1, 2]
+    assert route_stops_table(resultados, StopTable.of(paradas_df)).equals(tabla)
+
+def test_to_excel_roundtrip():
+    hojas = {"Resumen": pd.DataFrame({'vehiculo_id': ['Vehículo 1'], 'distancia_km': [12.5]}),
+             "Ruta Vehículo 1": pd.DataFrame({'id': ['a', 'b'], 'demanda': [1, 2]})}
+    leidas = pd.read_excel(to_excel(hojas), sheet_name=None)
+    assert list(leidas) == list(hojas)
+    for nombre, df in hojas.items():
+        pd.testing.assert_frame_equal(leidas[nombre], df, check_dtype=False)
@@ -33,3 +33,188 @@ def test_solver_handles_nan_matrix_by_fallback():
     with pytest.raises(ValueError):
          # El wrapper debería lanzar un error antes de llamar al fallback si hay NaN
          solve_tsp_with_fallback(dist_matrix, 42)
+
+def test_distance_matrix_matches_scalar_haversine():
+    import pandas as pd
+    from solver import create_distance_matrix, haversine
+    rng = np.random.default_rng(0)
+    paradas_df = pd.DataFrame({
+        'id': [f"p{i}" for i in range(40)],
+        'lat': rng.uniform(4.0, 5.0, 40), 'lon': rng.uniform(-76.5, -75.5, 40)
+    })
+    dist_matrix, ids = create_distance_matrix(paradas_df, block_size=7)
+    assert ids == paradas_df['id'].tolist()
+    assert dist_matrix.shape == (40, 40)
+    assert np.array_equal(dist_matrix, dist_matrix.T)
+    assert np.all(np.diag(dist_matrix) == 0)
+    esperado = haversine(paradas_df['lat'][3], paradas_df['lon'][3], paradas_df['lat'][17], paradas_df['lon'][17])
+    assert dist_matrix[3, 17] == pytest.approx(esperado, rel=1e-12)
+
+    dist_f32, _ = create_distance_matrix(paradas_df, dtype=np.float32, block_size=None)
+    assert dist_f32.dtype == np.float32
+    assert np.allclose(dist_f32, dist_matrix, rtol=1e-5)
+
+def _instancia_aleatoria(n=60, seed=0):
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    paradas_df = pd.DataFrame({
+        'id': ['depot'] + [f"p{i}" for i in range(n)],
+        'lat': np.r_[4.44, rng.uniform(4.3, 4.6, n)], 'lon': np.r_[-76.2, rng.uniform(-76.4, -76.0, n)],
+        'demanda': np.r_[0, rng.integers(1, 10, n)], 'is_depot': [True] + [False] * n
+    })
+    vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': 80} for i in range(4)])
+    return paradas_df, vehiculos_df
+
+def test_run_optimization_respects_assignment_and_capacity():
+    from solver import run_optimization, assign_stops_to_vehicles
+    paradas_df, vehiculos_df = _instancia_aleatoria()
+    depot = paradas_df.iloc[0].to_dict()
+    asignaciones = assign_stops_to_vehicles(paradas_df.iloc[1:], vehiculos_df, depot)
+    resultados = run_optimization(paradas_df, vehiculos_df, 1000, 60, 42, force_fallback=True)
+    demandas = dict(zip(paradas_df['id'], paradas_df['demanda']))
+    for ruta in resultados:
+        assert sorted(ruta['secuencia_paradas_ids']) == sorted(asignaciones[ruta['vehiculo_id']])
+        assert sum(demandas[pid] for pid in ruta['secuencia_paradas_ids']) <= ruta['capacidad']
+
+def test_parallel_routes_match_sequential():
+    from solver import run_optimization
+    paradas_df, vehiculos_df = _instancia_aleatoria(n=40, seed=5)
+    secuencial = run_optimization(paradas_df, vehiculos_df, 1000, 60, 42)
+    paralelo = run_optimization(paradas_df, vehiculos_df, 1000, 60, 42, n_workers=2)
+    assert paralelo == secuencial
+
+def test_sweep_assignment_respects_capacity_and_bounds_blocks():
+    import pandas as pd
+    from solver import haversine, run_optimization
+    paradas_df, _ = _instancia_aleatoria(400, seed=7)
+    vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': 500} for i in range(3)])
+    resultados = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search',
+                                  asignacion='sweep', max_nodos_ruta=30)
+    capacidades = dict(zip(vehiculos_df['id'], vehiculos_df['capacidad']))
+    demandas = dict(zip(paradas_df['id'], paradas_df['demanda']))
+    visitadas = [pid for r in resultados for pid in r['secuencia_paradas_ids']]
+    assert len(visitadas) == len(set(visitadas))
+    assert max(len(r['secuencia_paradas_ids']) for r in resultados) > 30
+    for r in resultados:
+        assert sum(demandas[pid] for pid in r['secuencia_paradas_ids']) <= capacidades[r['vehiculo_id']]
+        # La distancia informada es la del recorrido completo depósito -> paradas -> depósito.
+        posiciones = [0] + [paradas_df.index[paradas_df['id'] == pid][0] for pid in r['secuencia_paradas_ids']] + [0]
+        esperada = sum(haversine(paradas_df.loc[a, 'lat'], paradas_df.loc[a, 'lon'], paradas_df.loc[b, 'lat'], paradas_df.loc[b, 'lon'])
+                       for a, b in zip(posiciones, posiciones[1:]))
+        assert abs(r['distancia_km'] - esperada) < 1e-6
+
+def test_savings_assignment_covers_stops_within_capacity():
+    import pandas as pd
+    from solver import assign_stops_to_vehicles, run_optimization
+    paradas_df, _ = _instancia_aleatoria(200, seed=3)
+    paradas_df.loc[5, 'demanda'] = 1000  # No cabe en ningún vehículo
+    vehiculos_df = pd.DataFrame([{'id': f'Vehículo {i+1}', 'capacidad': c} for i, c in enumerate([400, 400, 300, 200])])
+    asignaciones = assign_stops_to_vehicles(paradas_df.iloc[1:], vehiculos_df, paradas_df.iloc[0].to_dict(), 'savings')
+    capacidades = dict(zip(vehiculos_df['id'], vehiculos_df['capacidad']))
+    demandas = dict(zip(paradas_df['id'], paradas_df['demanda']))
+    asignadas = [pid for ids in asignaciones.values() for pid in ids]
+    assert sorted(asignadas) == sorted(set(paradas_df['id'].iloc[1:]) - {paradas_df.loc[5, 'id']})
+    for v_id, ids in asignaciones.items():
+        assert sum(demandas[pid] for pid in ids) <= capacidades[v_id]
+    ahorros = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search', asignacion='savings')
+    greedy = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search')
+    assert sum(r['distancia_km'] for r in ahorros) < sum(r['distancia_km'] for r in greedy)
+
+def test_sparse_mode_matches_dense_routes_without_global_matrix(monkeypatch):
+    import solver
+    paradas_df, vehiculos_df = _instancia_aleatoria(150, seed=9)
+    vehiculos_df['capacidad'] = 300
+    densos = solver.run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search')
+    monkeypatch.setattr(solver, 'DistanceStore', None)  # El modo disperso no debe construir la matriz global
+    dispersos = solver.run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search',
+                                        disperso=True, max_nodos_ruta=40)
+    assert [sorted(r['secuencia_paradas_ids']) for r in dispersos] == [sorted(r['secuencia_paradas_ids']) for r in densos]
+    assert all(r['solver'] == 'local_search' and not r['fallback'] for r in dispersos)
+    total_denso = sum(r['distancia_km'] for r in densos)
+    assert sum(r['distancia_km'] for r in dispersos) < total_denso * 1.1
+
+def test_update_routes_inserts_and_removes_only_affected_routes():
+    import pandas as pd
+    from solver import run_optimization, update_routes
+    paradas_df, vehiculos_df = _instancia_aleatoria(60, seed=11)
+    vehiculos_df['capacidad'] = 120
+    resultados = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search')
+    eliminada = resultados[0]['secuencia_paradas_ids'][0]
+    nuevas = pd.DataFrame({'id': ['n1', 'n2'], 'lat': [4.45, 4.5], 'lon': [-76.1, -76.3], 'demanda': [3, 500]})
+
+    nuevos, tabla, sin_asignar = update_routes(resultados, paradas_df, vehiculos_df, 1.0, 60.0, nuevas, [eliminada])
+    assert sin_asignar == ['n2']  # Ninguna capacidad admite 500
+    assert eliminada not in set(tabla['id']) and 'n1' in set(tabla['id'])
+    visitadas = [pid for r in nuevos for pid in r['secuencia_paradas_ids']]
+    esperadas = {pid for r in resultados for pid in r['secuencia_paradas_ids']} - {eliminada} | {'n1'}
+    assert sorted(visitadas) == sorted(esperadas)
+    demandas = dict(zip(tabla['id'], tabla['demanda']))
+    antes = {r['vehiculo_id']: r for r in resultados}
+    for r in nuevos:
+        assert r['total_demanda'] == sum(demandas[pid] for pid in r['secuencia_paradas_ids']) <= r['capacidad']
+        if eliminada not in antes[r['vehiculo_id']]['secuencia_paradas_ids'] and 'n1' not in r['secuencia_paradas_ids']:
+            assert r == antes[r['vehiculo_id']]
+
+def test_update_routes_rejects_duplicate_new_ids():
+    import pandas as pd
+    from solver import run_optimization, update_routes
+    paradas_df, vehiculos_df = _instancia_aleatoria(20, seed=5)
+    resultados = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='nn')
+    existente = resultados[0]['secuencia_paradas_ids'][0]
+    for ids in ([existente], ['n1', 'n1']):
+        nuevas = pd.DataFrame({'id': ids, 'lat': 4.45, 'lon': -76.1, 'demanda': 1})
+        with pytest.raises(ValueError):
+            update_routes(resultados, paradas_df, vehiculos_df, 1.0, 60.0, nuevas)
+    # Un id que se elimina en la misma llamada puede volver a usarse (parada reubicada).
+    nuevas = pd.DataFrame({'id': [existente], 'lat': [4.45], 'lon': [-76.1], 'demanda': [1]})
+    _, tabla, _ = update_routes(resultados, paradas_df, vehiculos_df, 1.0, 60.0, nuevas, [existente])
+    assert list(tabla['id']).count(existente) == 1
+
+def test_run_optimization_reports_solver_fallback_and_phase_timings():
+    from solver import run_optimization
+    from utils import Telemetria
+    paradas_df, vehiculos_df = _instancia_aleatoria(40, seed=3)
+    telemetria = Telemetria()
+    resultados = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, metodo_tsp='local_search', telemetria=telemetria)
+    assert all(r['solver'] == 'local_search' and not r['fallback'] for r in resultados)
+    assert {'matriz', 'asignacion', 'tsp'} <= set(telemetria.fases)
+    assert telemetria.contadores['rutas'] == len(resultados) and telemetria.contadores['fallbacks'] == 0
+    assert set(telemetria.rutas) == {r['vehiculo_id'] for r in resultados}
+
+    telemetria = Telemetria()
+    forzados = run_optimization(paradas_df, vehiculos_df, 1.0, 60.0, 42, force_fallback=True, asignacion='sweep',
+                                telemetria=telemetria)
+    assert all(r['solver'] == 'nn' and r['fallback'] for r in forzados)
+    assert telemetria.contadores['fallbacks'] == len(forzados)
+
+def test_portfolio_keeps_best_attempt_and_is_reproducible():
+    from solver import PortfolioSolver, create_distance_matrix, cota_inferior_tsp, solve_tsp_with_fallback
+    paradas_df, _ = _instancia_aleatoria(80, seed=2)
+    dist_matrix, _ = create_distance_matrix(paradas_df)
+    portafolio = PortfolioSolver(estrategias=('anytime', 'anytime_insercion'), n_semillas=2)
+    tour, distancia = portafolio.solve(dist_matrix, 42)
+    intentos = [solve_tsp_with_fallback(dist_matrix, semilla, metodo)[1] for metodo, semilla in portafolio.candidatos(42)]
+    assert len(intentos) == 4 and distancia == min(intentos)
+    assert {metodo for metodo, _ in portafolio.candidatos(42)} == {'anytime', 'anytime_insercion'}
+    assert sorted(tour) == list(range(len(dist_matrix)))
+    assert cota_inferior_tsp(dist_matrix) <= distancia
+    with PortfolioSolver(estrategias=('anytime', 'anytime_insercion'), n_semillas=2, n_workers=2) as paralelo:
+        assert paralelo.solve(dist_matrix, 42) == (tour, distancia)
+
+def test_farthest_insertion_builds_a_full_tour_from_the_depot():
+    from solver import create_distance_matrix, farthest_insertion_solver, nearest_neighbor_solver
+    from local_search import tour_length
+    paradas_df, _ = _instancia_aleatoria(50, seed=5)
+    dist_matrix, _ = create_distance_matrix(paradas_df)
+    ruta, distancia = farthest_insertion_solver(dist_matrix)
+    assert ruta[0] == 0 and sorted(ruta) == list(range(len(dist_matrix)))
+    assert distancia == pytest.approx(tour_length(ruta, dist_matrix))
+    assert ruta != nearest_neighbor_solver(dist_matrix)[0]
+
+def test_portfolio_stops_at_target_gap():
+    from solver import PortfolioSolver, create_distance_matrix
+    paradas_df, _ = _instancia_aleatoria(60, seed=4)
+    dist_matrix, _ = create_distance_matrix(paradas_df)
+    intentos = []
+    PortfolioSolver(n_semillas=4, gap_objetivo=10.0).solve(dist_matrix, 1, progress_callback=lambda *a: intentos.append(a))
+    assert len(intentos) == 1
@@ -1,29 +1,89 @@
-import streamlit as st
 import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LOGGER_NAME = "Rout2App"
+MAX_LOGS = 500  # Entradas de log que se conservan por sesión; las más antiguas se descartan
+
+class Telemetria:
+    """
+    Tiempos por fase, contadores y datos por ruta de una ejecución, en un dict serializable.
+
+        telemetria = Telemetria()
+        with telemetria.fase('lectura'):
+            ...
+        telemetria.contar('fallbacks')
+    """
+
+    def __init__(self):
+        self.fases, self.contadores, self.rutas = {}, {}, {}
+
+    @contextmanager
+    def fase(self, nombre):
+        # Una fase repetida acumula su tiempo.
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nombre] = self.fases.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def registrar_ruta(self, vehiculo_id, **datos):
+        self.rutas.setdefault(vehiculo_id, {}).update(datos)
+
+    def como_dict(self):
+        return {"fases": dict(self.fases), "contadores": dict(self.contadores),
+                "rutas": {v_id: dict(datos) for v_id, datos in self.rutas.items()}}
 
 def init_session_state():
     """Inicializa las variables necesarias en el st.session_state."""
+    import streamlit as st
     if 'paradas_df' not in st.session_state:
         st.session_state.paradas_df = None
     if 'vehiculos_df' not in st.session_state:
         st.session_state.vehiculos_df = None
     if 'resultados' not in st.session_state:
         st.session_state.resultados = None
-    if 'logs' not in st.session_state:
-        st.session_state.logs = []
+    if 'logs' not in st.session_state or not isinstance(st.session_state.logs, deque):
+        st.session_state.logs = deque(st.session_state.get('logs', ()), maxlen=MAX_LOGS)
+    if 'telemetria' not in st.session_state:
+        st.session_state.telemetria = None
 
 def get_logger():
-    """Configura y devuelve un logger que escribe en st.session_state."""
-    logger = logging.getLogger("Rout2App")
-    
-    if not logger.handlers:
+    """
+    Devuelve el logger de la aplicación. Es un logger estándar de `logging`, sin dependencia de
+    Streamlit, para que solver e io_parser funcionen en scripts y procesos worker.
+    La app añade su handler con `install_streamlit_log_handler`.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.level == logging.NOTSET:
         logger.setLevel(logging.INFO)
-        
+    return logger
+
+def install_streamlit_log_handler():
+    """Añade (una sola vez por proceso) un handler que escribe los logs en st.session_state."""
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    logger = get_logger()
+
+    if not any(getattr(h, 'es_streamlit', False) for h in logger.handlers):
         class StreamlitLogHandler(logging.Handler):
+            es_streamlit = True
+
             def emit(self, record):
+                # Sin sesión de Streamlit (un proceso worker o un hilo de `jobs`) no hay dónde escribir
+                if get_script_run_ctx(suppress_warning=True) is None:
+                    return
+                try:
+                    logs = st.session_state.logs
+                except (AttributeError, KeyError):
+                    return
                 log_entry = self.format(record)
-                # Prepend to show newest first
-                st.session_state.logs.insert(0, log_entry)
+                # Prepend to show newest first; con maxlen se descarta la más antigua
+                logs.appendleft(log_entry)
 
         handler = StreamlitLogHandler()
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%H:%M:%S')
@@ -34,6 +94,7 @@ def get_logger():
 
 def display_logs():
     """Muestra los logs acumulados en un expander en la UI."""
+    import streamlit as st
     with st.expander("📋 Ver Logs de la Sesión"):
         if st.session_state.logs:
             log_text = "\n".join(st.session_state.logs)
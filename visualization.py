@@ -1,21 +1,69 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import folium
-from streamlit_folium import st_folium
 from io import BytesIO
 import json
-import streamlit.components.v1 as components
+from contextlib import nullcontext
+from cache import results_fingerprint
+from stops import StopTable
+# folium, streamlit_folium y streamlit.components se importan dentro de las funciones que los usan:
+# son las dependencias más pesadas y no hacen falta hasta dibujar un mapa o el botón de PDF.
+
+UMBRAL_AGRUPAR_PARADAS = 500  # Por encima se dibujan las paradas en una sola capa agrupada
+ZOOM_INICIAL = 12
+METROS_POR_GRADO = 111320.0
+METROS_POR_PIXEL_ZOOM_0 = 156543.03  # Resolución de las teselas web mercator en el ecuador
+TOLERANCIA_PIXELES = 1.0  # Error máximo admitido al simplificar una ruta, en píxeles
+COLORES_RUTAS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
+# Crea cada marcador en el navegador a partir de [lat, lon, tooltip].
+CALLBACK_MARCADOR = """function (fila) {
+    var marcador = L.marker(new L.LatLng(fila[0], fila[1]));
+    marcador.bindTooltip(fila[2]);
+    return marcador;
+}"""
+
+COLUMNAS_DETALLE = ['id', 'lat', 'lon', 'demanda']
+COLUMNAS_PROGRESO_RUTAS = ['vehiculo_id', 'total_demanda', 'distancia_km', 'solver']
+COLUMNAS_PROGRESO_ESCENARIOS = ['escenario', 'vehiculos', 'capacidad', 'distancia_total_km', 'costo_total']
+
+def route_stops_table(resultados, paradas_df):
+    """
+    Una fila por parada visitada (vehiculo_id, orden, id, lat, lon, demanda), en el orden de cada
+    ruta, tomando las columnas de la `StopTable` por posición. Los ids que no están en la tabla se descartan.
+    """
+    tabla = StopTable.of(paradas_df)
+    secuencias = [r['secuencia_paradas_ids'] for r in resultados]
+    largos = np.array([len(s) for s in secuencias], dtype=np.intp)
+    inicios = np.cumsum(largos) - largos
+    posiciones = tabla.posiciones((pid for secuencia in secuencias for pid in secuencia), faltante=-1)
+    validas = posiciones >= 0
+    posiciones = posiciones[validas]
+    visitas = pd.DataFrame({
+        'vehiculo_id': np.repeat([r['vehiculo_id'] for r in resultados], largos)[validas],
+        'orden': (np.arange(largos.sum()) - np.repeat(inicios, largos) + 1)[validas],
+    })
+    for columna in COLUMNAS_DETALLE:
+        visitas[columna] = tabla[columna][posiciones]
+    return visitas
 
 def to_excel(df_dict):
+    """Libro Excel escrito con openpyxl en modo write_only: las filas se vuelcan en streaming, sin crear celdas en memoria."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for sheet_name, df in df_dict.items():
+        ws = wb.create_sheet(title=sheet_name)
+        ws.append([str(col) for col in df.columns])
+        for fila in df.itertuples(index=False, name=None):
+            ws.append(fila)
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for sheet_name, df in df_dict.items():
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    wb.save(output)
     output.seek(0)
     return output
 
-def generate_html_report(resumen_df, paradas_df):
-    paradas_dict = {p['id']: p for _, p in paradas_df.iterrows()}
+def generate_html_report(resumen_df, paradas_df, tabla_paradas=None):
+    if tabla_paradas is None:
+        tabla_paradas = route_stops_table(resumen_df.to_dict('records'), paradas_df)
+    rutas = dict(tuple(tabla_paradas.groupby('vehiculo_id', sort=False)))
     html = """
     <html>
     <head><style>
@@ -36,42 +84,223 @@ def generate_html_report(resumen_df, paradas_df):
             'capacidad_utilizada_pct': '% Capacidad', 'distancia_km': 'Distancia (km)',
             'costo_estimado': 'Costo ($)'
         }, inplace=True)
-        html += "<div class='no-break'><h2>Resumen General</h2>"
-        html += df_reporte[['Vehículo', 'Demanda Total', '% Capacidad', 'Distancia (km)', 'Costo ($)']].to_html(index=False, justify='center')
-        html += "</div><h2 class='page-break'>Detalle por Ruta</h2>"
-        for _, ruta in resumen_df.iterrows():
-            html += f"<div class='no-break'><h3>{ruta['vehiculo_id']}</h3>"
-            ruta_df = pd.DataFrame([paradas_dict[pid] for pid in ruta['secuencia_paradas_ids']])
-            html += ruta_df[['id', 'lat', 'lon', 'demanda']].to_html(index=False, justify='center')
-            html += "</div>"
+        partes = ["<div class='no-break'><h2>Resumen General</h2>",
+                  df_reporte[['Vehículo', 'Demanda Total', '% Capacidad', 'Distancia (km)', 'Costo ($)']].to_html(index=False, justify='center'),
+                  "</div><h2 class='page-break'>Detalle por Ruta</h2>"]
+        vacia = tabla_paradas.iloc[:0]
+        for vehiculo_id in resumen_df['vehiculo_id']:
+            partes += [f"<div class='no-break'><h3>{vehiculo_id}</h3>",
+                       rutas.get(vehiculo_id, vacia)[COLUMNAS_DETALLE].to_html(index=False, justify='center'), "</div>"]
+        html += "".join(partes)
     html += "</body></html>"
     return html
 
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_report_artifacts(huella, _resultados, _paradas_df):
+    """
+    Tabla de detalle, libro Excel (bytes) e informe HTML de unos resultados. Se memoizan por
+    `huella` (ver `cache.results_fingerprint`), así que los reruns de Streamlit no los regeneran.
+    """
+    resumen_df = pd.DataFrame(_resultados)
+    tabla = route_stops_table(_resultados, _paradas_df)
+    informe_sheets = {"Resumen": resumen_df[['vehiculo_id', 'total_demanda', 'capacidad_utilizada_pct', 'distancia_km', 'costo_estimado']]}
+    rutas = dict(tuple(tabla.groupby('vehiculo_id', sort=False)))
+    for vehiculo_id in resumen_df['vehiculo_id']:
+        informe_sheets[f"Ruta {vehiculo_id}"[:31]] = rutas.get(vehiculo_id, tabla.iloc[:0])[COLUMNAS_DETALLE]
+    return tabla, to_excel(informe_sheets).getvalue(), generate_html_report(resumen_df, _paradas_df, tabla)
+
+def simplificar_ruta(lats, lons, zoom=ZOOM_INICIAL, tolerancia_px=TOLERANCIA_PIXELES):
+    """
+    Simplifica una polilínea con Douglas-Peucker, descartando vértices que se desvían menos de
+    `tolerancia_px` píxeles al nivel de `zoom`. Devuelve (lats, lons) de los vértices conservados.
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    if n <= 2:
+        return lats, lons
+    cos_lat = np.cos(np.radians(lats.mean()))
+    # Proyección equirectangular local en metros; suficiente para la escala de un mapa de rutas.
+    puntos = np.column_stack([lons * cos_lat, lats]) * METROS_POR_GRADO
+    tolerancia = tolerancia_px * METROS_POR_PIXEL_ZOOM_0 * cos_lat / 2 ** zoom
+    conservar = np.zeros(n, dtype=bool)
+    conservar[[0, -1]] = True
+    pendientes = [(0, n - 1)]
+    while pendientes:
+        i, j = pendientes.pop()
+        if j - i < 2:
+            continue
+        a, ab, tramo = puntos[i], puntos[j] - puntos[i], puntos[i + 1:j]
+        largo2 = float(ab @ ab)
+        t = np.clip((tramo - a) @ ab / largo2, 0.0, 1.0) if largo2 > 0 else np.zeros(len(tramo))
+        distancias = np.linalg.norm(tramo - (a + t[:, None] * ab), axis=1)
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            conservar[i + 1 + k] = True
+            pendientes += [(i, i + 1 + k), (i + 1 + k, j)]
+    return lats[conservar], lons[conservar]
+
+def _tooltips_paradas(tabla):
+    return [f"<b>{pid}</b><br>Demanda: {demanda}" for pid, demanda in zip(tabla.ids.tolist(), tabla.demanda.tolist())]
+
+def add_stops_layer(m, paradas_df, umbral=UMBRAL_AGRUPAR_PARADAS):
+    """
+    Añade las paradas (sin el depósito) al mapa. Hasta `umbral` paradas se dibuja un marcador por
+    parada; por encima, una única capa FastMarkerCluster que crea los marcadores en el navegador.
+    """
+    import folium
+    from folium.plugins import FastMarkerCluster
+    tabla = StopTable.of(paradas_df)
+    lats, lons = tabla.lat, tabla.lon
+    tooltips = _tooltips_paradas(tabla)
+    if len(tabla) > umbral:
+        datos = [[lat, lon, tooltip] for lat, lon, tooltip in zip(lats.tolist(), lons.tolist(), tooltips)]
+        FastMarkerCluster(datos, callback=CALLBACK_MARCADOR, name="Paradas").add_to(m)
+        return m
+    for lat, lon, tooltip in zip(lats, lons, tooltips):
+        folium.Marker([lat, lon], tooltip=tooltip, icon=folium.Icon(color='blue', icon='circle-dot', prefix='fa')).add_to(m)
+    return m
+
+def build_route_map(paradas_df, resultados, umbral=UMBRAL_AGRUPAR_PARADAS):
+    """
+    Mapa folium con el depósito, las paradas y una polilínea por ruta. Por encima de `umbral`
+    paradas las rutas se simplifican para el zoom inicial; Leaflet (smooth_factor) las vuelve
+    a simplificar en el navegador en cada nivel de zoom.
+    """
+    import folium
+    tabla = StopTable.of(paradas_df)
+    lats, lons = tabla.lat, tabla.lon
+    m = folium.Map(location=[lats.mean(), lons.mean()], zoom_start=ZOOM_INICIAL, tiles="cartodbpositron")
+    depositos = np.flatnonzero(tabla.es_depot)
+    for pos, tooltip in zip(depositos, _tooltips_paradas(tabla.take(depositos))):
+        folium.Marker([lats[pos], lons[pos]], tooltip=tooltip,
+                      icon=folium.Icon(color='red', icon='warehouse', prefix='fa')).add_to(m)
+    add_stops_layer(m, tabla.take(tabla.clientes), umbral)
+    if resultados and len(depositos):
+        grande = len(tabla) > umbral
+        depot_pos = int(depositos[0])
+        for i, ruta in enumerate(resultados):
+            indices = np.r_[depot_pos, tabla.posiciones(ruta['secuencia_paradas_ids']), depot_pos]
+            ruta_lats, ruta_lons = lats[indices], lons[indices]
+            if grande:
+                ruta_lats, ruta_lons = simplificar_ruta(ruta_lats, ruta_lons)
+            folium.PolyLine(np.column_stack([ruta_lats, ruta_lons]).tolist(), color=COLORES_RUTAS[i % len(COLORES_RUTAS)],
+                            weight=4, opacity=0.8, smooth_factor=2.0 if grande else 1.0,
+                            tooltip=f"{ruta['vehiculo_id']} ({ruta['distancia_km']:.1f} km)").add_to(m)
+    return m
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _mapa_rutas_cacheado(huella, _paradas_df, _resultados):
+    # Solo `huella` forma parte de la clave; los argumentos con guion bajo no se hashean.
+    return build_route_map(_paradas_df, _resultados)
+
 def render_map(paradas_df, resultados):
     if paradas_df is None or paradas_df.empty:
         st.warning("No hay datos de paradas para mostrar en el mapa.")
         return
-    map_center = [paradas_df['lat'].mean(), paradas_df['lon'].mean()]
-    m = folium.Map(location=map_center, zoom_start=12, tiles="cartodbpositron")
-    depot_icon = folium.Icon(color='red', icon='warehouse', prefix='fa')
-    stop_icon = folium.Icon(color='blue', icon='circle-dot', prefix='fa')
-    for _, parada in paradas_df.iterrows():
-        tooltip = f"<b>{parada.get('id', 'N/A')}</b><br>Demanda: {parada.get('demanda', 0)}"
-        icon = depot_icon if parada.get('is_depot') else stop_icon
-        folium.Marker([parada['lat'], parada['lon']], tooltip=tooltip, icon=icon).add_to(m)
-    if resultados:
-        colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
-        depot = paradas_df[paradas_df['is_depot']].iloc[0]
-        paradas_dict = {p['id']: p for _, p in paradas_df.iterrows()}
-        for i, ruta in enumerate(resultados):
-            points = [[depot['lat'], depot['lon']]] + \
-                     [[paradas_dict[pid]['lat'], paradas_dict[pid]['lon']] for pid in ruta['secuencia_paradas_ids']] + \
-                     [[depot['lat'], depot['lon']]]
-            folium.PolyLine(points, color=colors[i % len(colors)], weight=4, opacity=0.8,
-                            tooltip=f"{ruta['vehiculo_id']} ({ruta['distancia_km']:.1f} km)").add_to(m)
+    from streamlit_folium import st_folium
+    m = _mapa_rutas_cacheado(results_fingerprint(resultados or [], paradas_df), paradas_df, resultados)
     st_folium(m, width='100%', height=500, returned_objects=[])
 
-def render_results_section(resultados, paradas_df):
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _mapa_deposito_cacheado(huella, centro, _paradas_df):
+    import folium
+    m = folium.Map(location=list(centro), zoom_start=ZOOM_INICIAL, tiles="cartodbpositron")
+    if _paradas_df is not None:
+        add_stops_layer(m, _paradas_df)
+    return m
+
+def render_depot_picker(paradas_df, depot_lat, depot_lon, key="depot_map"):
+    """
+    Mapa para elegir el depósito. El mapa base con las paradas se cachea entre reruns y el
+    marcador del depósito se envía como capa dinámica, así que moverlo no vuelve a generar el mapa.
+    Devuelve los datos de `st_folium` (solo `last_clicked`).
+    """
+    import folium
+    from streamlit_folium import st_folium
+    hay_paradas = paradas_df is not None and not paradas_df.empty
+    if hay_paradas:
+        centro, huella = (paradas_df['lat'].mean(), paradas_df['lon'].mean()), results_fingerprint([], paradas_df)
+    else:
+        centro, huella = (depot_lat, depot_lon), None
+    m = _mapa_deposito_cacheado(huella, centro, paradas_df if hay_paradas else None)
+    capa_deposito = folium.FeatureGroup(name="Depósito")
+    folium.Marker([depot_lat, depot_lon], popup="Depósito Actual", tooltip="Depósito",
+                  icon=folium.Icon(color="red", icon="warehouse", prefix='fa')).add_to(capa_deposito)
+    return st_folium(m, width='100%', height=400, key=key, feature_group_to_add=capa_deposito,
+                     returned_objects=["last_clicked"])
+
+def telemetry_tables(telemetria):
+    """(fases, rutas) de un `Telemetria.como_dict()` como DataFrames para mostrar en la UI."""
+    fases = pd.DataFrame(list(telemetria['fases'].items()), columns=['fase', 'tiempo_s'])
+    rutas = pd.DataFrame([{'vehiculo_id': v_id, **datos} for v_id, datos in telemetria['rutas'].items()])
+    return fases, rutas
+
+def render_telemetry(telemetria):
+    """Tiempos por fase, contadores y solver de cada ruta de la última ejecución, en un expander."""
+    if telemetria is None:
+        return
+    fases, rutas = telemetry_tables(telemetria.como_dict())
+    with st.expander("⏱️ Tiempos de la Ejecución"):
+        st.dataframe(fases, hide_index=True, use_container_width=True)
+        if telemetria.contadores:
+            st.write(", ".join(f"**{nombre}**: {valor}" for nombre, valor in telemetria.contadores.items()))
+        if not rutas.empty:
+            st.dataframe(rutas, hide_index=True, use_container_width=True)
+
+def render_scenario_comparison(comparacion):
+    """Tabla comparativa de un barrido de escenarios (ver `scenarios.run_scenarios`) con el más barato destacado."""
+    st.subheader("🔀 Comparación de Escenarios")
+    if comparacion.empty:
+        st.warning("El barrido no llegó a resolver ningún escenario.")
+        return
+    completos = comparacion[comparacion['paradas_sin_asignar'] == 0]
+    mejor = (completos if not completos.empty else comparacion).sort_values(['costo_total', 'escenario']).iloc[0]
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Escenarios", f"{len(comparacion)}")
+    m2.metric("Menor Costo", f"${mejor['costo_total']:,.2f}",
+              help="Entre los escenarios que atienden todas las paradas, si hay alguno.")
+    m3.metric("Flota", f"{int(mejor['vehiculos'])} × {mejor['capacidad']:g}")
+    m4.metric("Utilización", f"{mejor['utilizacion_flota_pct']:.1f}%")
+    st.dataframe(comparacion, hide_index=True, use_container_width=True)
+    st.line_chart(comparacion.groupby('vehiculos')[['distancia_total_km']].min())
+    st.download_button(label="📥 Descargar comparación (CSV)", data=comparacion.to_csv(index=False).encode('utf-8'),
+                       file_name="comparacion_escenarios.csv", mime="text/csv")
+
+@st.fragment(run_every=1.0)
+def render_job_progress(gestor, trabajo_id):
+    """
+    Progreso de un trabajo en segundo plano (ver `jobs.JobManager`), refrescado cada segundo sin
+    rerun de la página completa. Al terminar el trabajo relanza la app para mostrar el resultado.
+    """
+    trabajo = gestor.get(trabajo_id)
+    if trabajo is None:
+        st.warning("El trabajo ya no está disponible.")
+        return
+    if trabajo.terminado:
+        st.rerun()
+    resumen = trabajo.resumen()
+    presupuesto_s = trabajo.parametros.get('presupuesto_s')
+    # Un barrido de escenarios (ver `scenarios.run_scenarios`) entrega filas de escenario en lugar de rutas.
+    escenarios = trabajo.parametros.get('escenarios')
+    total = max(len(escenarios) if escenarios is not None else len(trabajo.parametros['vehiculos_df']), 1)
+    unidad, columnas = (("escenarios resueltos", COLUMNAS_PROGRESO_ESCENARIOS) if escenarios is not None
+                        else ("rutas resueltas", COLUMNAS_PROGRESO_RUTAS))
+    if presupuesto_s and escenarios is None:
+        fraccion = resumen['transcurrido_s'] / presupuesto_s
+    else:
+        fraccion = resumen['rutas_terminadas'] / total
+    texto = (f"{resumen['descripcion']} | {resumen['estado']} | {resumen['rutas_terminadas']} {unidad} | "
+             f"{resumen['transcurrido_s']:.0f}s")
+    st.progress(min(fraccion, 1.0), text=texto)
+    for vehiculo_id, (iteracion, mejor_distancia, _) in resumen['progreso'].items():
+        st.caption(f"{vehiculo_id}: iteración {iteracion}, mejor distancia {mejor_distancia:.1f} km")
+    parciales = trabajo.parciales()
+    if parciales:
+        st.dataframe(pd.DataFrame(parciales)[columnas], hide_index=True, use_container_width=True)
+    if st.button("⏹️ Cancelar", key=f"cancelar_{trabajo_id}"):
+        gestor.cancel(trabajo_id)
+
+def render_results_section(resultados, paradas_df, telemetria=None):
     if not resultados:
         st.warning("La optimización se completó, pero no se generaron rutas con los parámetros actuales. Intenta aumentar la capacidad o el número de vehículos.")
         return
@@ -93,38 +322,34 @@ def render_results_section(resultados, paradas_df):
     st.markdown("---")
 
     st.subheader("📋 Detalles por Ruta")
-    paradas_dict = {p['id']: p for _, p in paradas_df.iterrows()}
-    for i, ruta_info in enumerate(resumen_df.to_dict('records')):
+    # Solo se cronometra la primera vez; en los reruns los informes salen de la caché.
+    cronometrar = telemetria is not None and 'exportacion' not in telemetria.fases
+    with telemetria.fase('exportacion') if cronometrar else nullcontext():
+        tabla, excel_data, html_report = build_report_artifacts(results_fingerprint(resultados, paradas_df), resultados,
+                                                                paradas_df)
+    rutas = dict(tuple(tabla.groupby('vehiculo_id', sort=False)))
+    for ruta_info in resultados:
         cap_pct = ruta_info.get('capacidad_utilizada_pct', 0)
         title = (f"**{ruta_info['vehiculo_id']}** | "
                  f"Dist: `{ruta_info['distancia_km']:.1f} km` | "
                  f"Costo: `${ruta_info['costo_estimado']:,.0f}` | "
                  f"Carga: `{ruta_info['total_demanda']:.0f} ({cap_pct:.1f}%)`")
         with st.expander(title):
-            id_paradas = ruta_info.get('secuencia_paradas_ids', [])
-            if not id_paradas:
+            if ruta_info['vehiculo_id'] not in rutas:
                 st.write("Sin paradas asignadas.")
                 continue
-            ruta_df = pd.DataFrame([paradas_dict.get(pid) for pid in id_paradas if pid in paradas_dict])
-            st.dataframe(ruta_df[['id', 'demanda', 'lat', 'lon']], hide_index=True, use_container_width=True)
+            st.dataframe(rutas[ruta_info['vehiculo_id']][['id', 'demanda', 'lat', 'lon']], hide_index=True, use_container_width=True)
     st.markdown("---")
 
     st.subheader("📥 Descargar Informes")
-    df_display = resumen_df[['vehiculo_id', 'total_demanda', 'capacidad_utilizada_pct', 'distancia_km', 'costo_estimado']].copy()
-    informe_sheets = {"Resumen": df_display}
-    for _, ruta in resumen_df.iterrows():
-        sheet_name = f"Ruta {ruta['vehiculo_id']}"[:31]
-        ruta_df = pd.DataFrame([paradas_dict.get(pid) for pid in ruta['secuencia_paradas_ids'] if pid in paradas_dict])
-        informe_sheets[sheet_name] = ruta_df[['id', 'lat', 'lon', 'demanda']]
     col_excel, col_pdf = st.columns(2)
     with col_excel:
-        excel_data = to_excel(informe_sheets)
         st.download_button(label="📥 Descargar (Excel)", data=excel_data,
                            file_name="informe_rutas.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                            use_container_width=True)
     with col_pdf:
-        html_report = generate_html_report(resumen_df, paradas_df)
+        import streamlit.components.v1 as components
         html_escaped = json.dumps(html_report)
         components.html(f"""
             <script src="https://cdnjs.cloudflare.com/ajax/libs/html2pdf.js/0.10.1/html2pdf.bundle.min.js"></script>